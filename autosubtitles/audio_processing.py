@@ -0,0 +1,89 @@
+import os
+import re
+import subprocess
+
+# Speech-only settings: Whisper resamples to 16 kHz mono anyway, and at 32 kbps an
+# hour of audio is ~14 MB, comfortably under the API's 25 MB upload limit.
+AUDIO_SAMPLE_RATE = 16000
+AUDIO_BITRATE = "32k"
+AUDIO_FORMAT = f"mp3 mono {AUDIO_SAMPLE_RATE}Hz {AUDIO_BITRATE}"
+# What counts as a pause worth cutting at
+SILENCE_NOISE_DB = -35
+SILENCE_MIN_S = 0.4
+SILENCE_PATTERN = re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+
+def ffmpeg_binary() -> str:
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+
+def run_ffmpeg(*args) -> str:
+    """Run ffmpeg and return its stderr, where it logs; raises RuntimeError on failure."""
+    result = subprocess.run([ffmpeg_binary(), "-hide_banner", "-nostdin", *args], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-2000:]}")
+    return result.stderr
+
+
+def media_duration(path: str) -> float:
+    # Reads the container header only, no decoding
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    return ffmpeg_parse_infos(path)["duration"]
+
+
+def extract_audio(input_video_path: str, audio_path: str):
+    """Demux and transcode only the audio stream (-vn: the video stream is never decoded)."""
+    print(f"Extracting audio: {input_video_path}")
+    run_ffmpeg(
+        "-y", "-i", input_video_path, "-vn", "-map", "0:a:0",
+        "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE), "-c:a", "libmp3lame", "-b:a", AUDIO_BITRATE,
+        audio_path,
+    )
+
+
+def detect_silences(audio_path: str, noise_db: float = SILENCE_NOISE_DB, min_silence_s: float = SILENCE_MIN_S) -> list:
+    """[(start, end)] of pauses, from ffmpeg's silencedetect filter."""
+    log = run_ffmpeg("-i", audio_path, "-af", f"silencedetect=noise={noise_db}dB:d={min_silence_s}", "-f", "null", "-")
+    silences, start = [], None
+    for kind, value in SILENCE_PATTERN.findall(log):
+        if kind == "start":
+            start = max(float(value), 0.0)
+        elif start is not None:
+            silences.append((start, float(value)))
+            start = None
+    return silences
+
+
+def plan_chunks(duration: float, silences: list, chunk_seconds: float, search_seconds: float = 60.0) -> list:
+    """[(start, end)] covering [0, duration], each at most chunk_seconds long.
+
+    Each cut is made in the middle of the last pause in the final
+    search_seconds before the limit, so no word is split; with no pause
+    there it is a hard cut at the limit.
+    """
+    pauses = sorted((start + end) / 2 for start, end in silences)
+    chunks, start = [], 0.0
+    while duration - start > chunk_seconds:
+        limit = start + chunk_seconds
+        candidates = [pause for pause in pauses if max(limit - search_seconds, start) < pause <= limit]
+        cut = candidates[-1] if candidates else limit
+        chunks.append((start, cut))
+        start = cut
+    chunks.append((start, duration))
+    return chunks
+
+
+def split_audio(audio_path: str, chunk_seconds: float, out_dir: str) -> list:
+    """Cut audio_path at pauses into [(start, end, chunk path)]; a short file is returned whole."""
+    duration = media_duration(audio_path)
+    if duration <= chunk_seconds:
+        return [(0.0, duration, audio_path)]
+    chunks = []
+    base_filename, extension = os.path.splitext(os.path.basename(audio_path))
+    for i, (start, end) in enumerate(plan_chunks(duration, detect_silences(audio_path), chunk_seconds)):
+        chunk_path = os.path.join(out_dir, f"{base_filename}_{i:03d}{extension}")
+        # Stream copy: MP3 frames are ~26 ms, far finer than the pause the cut sits in
+        run_ffmpeg("-y", "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", audio_path, "-c", "copy", chunk_path)
+        chunks.append((start, end, chunk_path))
+    return chunks
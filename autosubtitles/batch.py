@@ -0,0 +1,261 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from openai_client import existing_pool
+from stage_cache import dry_run, stage_key, stage_keys
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".avi", ".webm")
+
+
+class VideoJob:
+    """Everything a stage needs to know about one video; plain attributes so it pickles to encode workers."""
+
+    def __init__(self, input_path: str, output_dir: str, work_dir: str, max_words_per_line: int, max_lines: int,
+                 compositor: str = "sprite"):
+        base_filename = os.path.splitext(os.path.basename(input_path))[0]
+        self.input_path = input_path
+        self.output_path = os.path.join(output_dir, f"{base_filename}_subtitles.mp4")
+        # Same intermediate names as process_video, so earlier single-video runs are picked up.
+        self.audio_path = os.path.join(work_dir, f"{base_filename}_audio.mp3")
+        self.translated_text_path = os.path.join(work_dir, f"{base_filename}_translated.txt")
+        self.srt_path = os.path.join(work_dir, f"{base_filename}_subtitles.srt")
+        self.max_words_per_line = max_words_per_line
+        self.max_lines = max_lines
+        self.compositor = compositor
+        # stage_cache keys, filled in by run_batch
+        self.keys = {}
+
+
+def cached_stage(job: VideoJob, stage: str):
+    from stage_cache import StageCache, ensure_stage, stage_outputs
+    outputs = stage_outputs(job.audio_path, job.translated_text_path, job.srt_path)
+    ensure_stage(StageCache(), stage, job.input_path, job.keys, outputs, job.max_words_per_line, job.max_lines)
+
+
+def extract_audio(job: VideoJob):
+    cached_stage(job, "audio")
+
+
+def translate(job: VideoJob):
+    cached_stage(job, "translation")
+
+
+def write_subtitles(job: VideoJob):
+    # LLM sentence processing and SRT layout are cached separately
+    cached_stage(job, "srt")
+
+
+def render(job: VideoJob):
+    from video_processing import add_subtitles_to_video
+    add_subtitles_to_video(job.input_path, job.output_path, job.srt_path, job.compositor)
+
+
+class Stage:
+    def __init__(self, name: str, fn, pool: str, deps: tuple, output: str, cache_stage: str):
+        self.name = name
+        self.fn = fn
+        self.pool = pool
+        self.deps = deps
+        # VideoJob attribute holding the file the stage produces
+        self.output = output
+        # Entry of VideoJob.keys identifying the output's inputs and parameters
+        self.cache_stage = cache_stage
+
+
+# Per-video DAG. "io" stages wait on the OpenAI API, "encode" stages keep CPUs busy.
+STAGES = [
+    Stage("extract_audio", extract_audio, "encode", (), "audio_path", "audio"),
+    Stage("translate", translate, "io", ("extract_audio",), "translated_text_path", "translation"),
+    Stage("subtitles", write_subtitles, "io", ("translate",), "srt_path", "srt"),
+    Stage("render", render, "encode", ("subtitles",), "output_path", "render"),
+]
+
+
+class Manifest:
+    """Per-video, per-stage status persisted after every transition, so a crashed batch resumes where it stopped."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {"videos": {}, "runs": []}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def stage(self, video: str, stage: str) -> dict:
+        return self.data["videos"].setdefault(video, {}).setdefault(stage, {"status": "pending"})
+
+    def update(self, video: str, stage: str, **fields):
+        with self.lock:
+            self.stage(video, stage).update(fields)
+            self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def find_videos(patterns: list) -> list:
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(
+                os.path.join(pattern, name) for name in sorted(os.listdir(pattern))
+                if name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+        else:
+            paths.extend(sorted(glob.glob(pattern)))
+    # Outputs of earlier runs match the same globs
+    return [path for path in dict.fromkeys(paths) if not path.endswith("_subtitles.mp4")]
+
+
+def is_done(manifest: Manifest, job: VideoJob, stage: Stage) -> bool:
+    record = manifest.stage(job.input_path, stage.name)
+    if not os.path.exists(getattr(job, stage.output)):
+        return False
+    # Made from a different video or with different parameters
+    if record.get("key") != job.keys[stage.cache_stage]:
+        return False
+    # "running" means the previous batch died mid-stage and the output may be truncated
+    return record["status"] in ("done", "pending")
+
+
+def run_batch(patterns: list, output_dir: str = ".", work_dir: str = ".", io_workers: int = 4, encode_workers: int = 2,
+              max_words_per_line: int = 4, max_lines: int = 1, manifest_path: str = None, compositor: str = "sprite"):
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(work_dir, exist_ok=True)
+    manifest = Manifest(manifest_path or os.path.join(output_dir, "batch_manifest.json"))
+    jobs = [
+        VideoJob(path, output_dir, work_dir, max_words_per_line, max_lines, compositor) for path in find_videos(patterns)
+    ]
+    for job in jobs:
+        job.keys = stage_keys(job.input_path, max_words_per_line, max_lines)
+        # Switching backend re-renders
+        job.keys["render"] = stage_key("render", job.keys["srt"], compositor=compositor)
+    print(f"Batch: {len(jobs)} videos, {io_workers} I/O workers, {encode_workers} encode workers")
+
+    todo = {}
+    for job in jobs:
+        for stage in STAGES:
+            # A stage whose input is being redone is stale too
+            rerun_deps = any((job.input_path, dep) in todo for dep in stage.deps)
+            if not rerun_deps and is_done(manifest, job, stage):
+                manifest.stage(job.input_path, stage.name)["status"] = "done"
+            else:
+                manifest.stage(job.input_path, stage.name)["status"] = "pending"
+                todo[(job.input_path, stage.name)] = (job, stage)
+    manifest.save()
+    to_finish = {job.input_path for job in jobs if any(key[0] == job.input_path for key in todo)}
+    print(f"{len(jobs) - len(to_finish)} videos already done, {len(todo)} stages to run")
+
+    # spawn, not fork: encode workers start while the OpenAI loop thread and the I/O threads hold locks
+    encode_context = multiprocessing.get_context("spawn")
+    pools = {"io": ThreadPoolExecutor(io_workers), "encode": ProcessPoolExecutor(encode_workers, mp_context=encode_context)}
+    capacity = {"io": io_workers, "encode": encode_workers}
+    in_flight = {"io": 0, "encode": 0}
+    busy_seconds = {"io": 0.0, "encode": 0.0}
+    running = {}
+    failed_videos = set()
+    finished_videos = 0
+    started = time.time()
+
+    def ready(job, stage):
+        return all(manifest.stage(job.input_path, dep)["status"] == "done" for dep in stage.deps)
+
+    try:
+        while todo or running:
+            # Later stages first, so videos finish (and free their intermediates) instead of all piling up mid-way.
+            for key, (job, stage) in sorted(todo.items(), key=lambda item: -STAGES.index(item[1][1])):
+                if job.input_path in failed_videos or in_flight[stage.pool] >= capacity[stage.pool]:
+                    continue
+                if not ready(job, stage):
+                    continue
+                del todo[key]
+                in_flight[stage.pool] += 1
+                manifest.update(job.input_path, stage.name, status="running", started=time.time(), error=None)
+                print(f"[{stage.pool}] {stage.name}: {job.input_path}")
+                running[pools[stage.pool].submit(stage.fn, job)] = (job, stage, time.time())
+
+            if not running:
+                # Everything left is blocked behind a failed stage
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, stage, stage_started = running.pop(future)
+                in_flight[stage.pool] -= 1
+                seconds = time.time() - stage_started
+                busy_seconds[stage.pool] += seconds
+                try:
+                    future.result()
+                except Exception as e:
+                    failed_videos.add(job.input_path)
+                    manifest.update(job.input_path, stage.name, status="failed", seconds=seconds, error=repr(e))
+                    print(f"FAILED {stage.name} for {job.input_path}: {e!r}")
+                    continue
+                manifest.update(job.input_path, stage.name, status="done", seconds=seconds,
+                                key=job.keys[stage.cache_stage])
+                if stage is STAGES[-1]:
+                    finished_videos += 1
+                    print(f"Done: {job.output_path} ({finished_videos}/{len(to_finish)})")
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.time() - started
+    videos_per_hour = finished_videos / (elapsed / 3600) if elapsed > 0 else 0.0
+    utilization = {
+        name: busy_seconds[name] / (elapsed * capacity[name]) if elapsed > 0 else 0.0 for name in pools
+    }
+    pool = existing_pool()
+    run = {
+        "started": started,
+        "seconds": elapsed,
+        "videos_done": finished_videos,
+        "videos_failed": sorted(failed_videos),
+        "videos_per_hour": videos_per_hour,
+        "utilization": utilization,
+        # Latency, retries and cost of the Whisper / GPT requests this run made; a run that made none
+        # (all cached or resumed) does not build a client, which would need OPENAI_API_KEY
+        "openai": pool.usage.summary() if pool is not None else {},
+    }
+    with manifest.lock:
+        manifest.data["runs"].append(run)
+        manifest.save()
+    print(
+        f"Batch finished in {elapsed:.0f}s: {finished_videos} videos ({videos_per_hour:.1f} videos/hour), "
+        f"{len(failed_videos)} failed · I/O pool {utilization['io']:.0%} busy, encode pool {utilization['encode']:.0%} busy"
+    )
+    if run["openai"]:
+        print(pool.usage.describe())
+    if failed_videos:
+        print("Re-run the same command to retry failed stages; finished stages are skipped.")
+    return run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Subtitle a batch of videos with overlapping API and encode stages.")
+    parser.add_argument("inputs", nargs="+", help="video files, globs or directories")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--work-dir", default=".", help="where audio, translations and .srt files are kept")
+    parser.add_argument("--io-workers", type=int, default=4, help="concurrent OpenAI stages")
+    parser.add_argument("--encode-workers", type=int, default=2, help="concurrent audio extraction / render processes")
+    parser.add_argument("--max-words-per-line", type=int, default=4)
+    parser.add_argument("--max-lines", type=int, default=1)
+    parser.add_argument("--manifest", help="defaults to <output-dir>/batch_manifest.json")
+    parser.add_argument("--compositor", choices=("sprite", "ffmpeg", "moviepy"), default="sprite",
+                        help="ffmpeg burns in ASS captions in one pass (square box corners); falls back to sprite")
+    parser.add_argument("--dry-run", action="store_true", help="print which cached stages would be recomputed and exit")
+    args = parser.parse_args()
+    if args.dry_run:
+        dry_run(find_videos(args.inputs), args.max_words_per_line, args.max_lines)
+        raise SystemExit
+    run_batch(args.inputs, args.output_dir, args.work_dir, args.io_workers, args.encode_workers,
+              args.max_words_per_line, args.max_lines, args.manifest, args.compositor)
@@ -0,0 +1,176 @@
+"""Frames-per-second benchmark of the subtitle compositors.
+
+Renders the same clip and SRT through each compositor in
+video_processing (MoviePy's SubtitlesClip / CompositeVideoClip path and the
+cached-sprite path) and reports compositing fps. With --encode it also
+writes each result with libx264 and reports encode time against the clip
+duration; the ffmpeg/libass burn-in backend has no separate compositing
+step, so it is only measured end to end with --encode. Without --video a
+synthetic 1080x1920 clip is generated in memory, so decoding is not part of
+the compositing measurement:
+
+    python benchmark.py --duration 20 --output bench.json
+    python benchmark.py --video day_10.mp4 --srt day_10_subtitles.srt --encode
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+
+import moviepy.editor as mp
+import numpy as np
+import srt
+
+from video_processing import (
+    COMPOSITORS, burn_in_ffmpeg, ffmpeg_has_subtitles_filter, subtitled_clip_moviepy, subtitled_clip_sprites,
+)
+
+WORDS = "this is a short synthetic subtitle line for the compositing benchmark run".split()
+
+
+def synthetic_clip(width, height, duration, fps):
+    """Noise frames from a small pool, read-only like decoded frames."""
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+    for frame in frames:
+        frame.setflags(write=False)
+    return mp.VideoClip(lambda t: frames[int(t * fps) % len(frames)], duration=duration).set_fps(fps)
+
+
+def synthetic_srt(path, duration, seconds_per_subtitle=1.5, max_words_per_line=4):
+    """Back-to-back subtitles covering the clip, like create_subtitles produces."""
+    rng = np.random.default_rng(1)
+    subtitles = []
+    count = max(int(duration / seconds_per_subtitle), 1)
+    for i in range(count):
+        words = rng.choice(WORDS, rng.integers(1, max_words_per_line + 1))
+        subtitles.append(srt.Subtitle(
+            index=i + 1,
+            start=datetime.timedelta(seconds=i * seconds_per_subtitle),
+            end=datetime.timedelta(seconds=(i + 1) * seconds_per_subtitle),
+            content=" ".join(words),
+        ))
+    with open(path, "w") as f:
+        f.write(srt.compose(subtitles))
+
+
+def run_compositor(name, video, srt_path, encode, work_dir):
+    build = subtitled_clip_sprites if name == "sprite" else subtitled_clip_moviepy
+    start = time.perf_counter()
+    clip = build(video, srt_path)
+    # Sprites are rendered here; MoviePy renders its TextClips lazily on first use
+    setup_s = time.perf_counter() - start
+
+    frames = 0
+    checksum = 0
+    start = time.perf_counter()
+    for frame in clip.iter_frames(fps=video.fps, dtype="uint8"):
+        checksum += int(frame[0, 0, 0])
+        frames += 1
+    composite_s = time.perf_counter() - start
+    result = {
+        "compositor": name,
+        "frames": frames,
+        "setup_s": setup_s,
+        "composite_s": composite_s,
+        "fps": frames / composite_s if composite_s else 0.0,
+    }
+
+    if encode:
+        output_path = os.path.join(work_dir, f"{name}.mp4")
+        start = time.perf_counter()
+        clip.write_videofile(output_path, codec="libx264", audio=video.audio is not None, audio_codec="aac",
+                             fps=video.fps, logger=None)
+        result["encode_s"] = time.perf_counter() - start
+        result["encode_realtime_factor"] = result["encode_s"] / video.duration
+    return result
+
+
+def run_ffmpeg(source_path, frames, duration, srt_path, work_dir):
+    start = time.perf_counter()
+    burn_in_ffmpeg(source_path, os.path.join(work_dir, "ffmpeg.mp4"), srt_path)
+    encode_s = time.perf_counter() - start
+    return {
+        "compositor": "ffmpeg",
+        "frames": frames,
+        "setup_s": 0.0,
+        "encode_s": encode_s,
+        # Decode, libass rendering and encode together
+        "fps": frames / encode_s if encode_s else 0.0,
+        "encode_realtime_factor": encode_s / duration,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="real video to subtitle instead of the synthetic clip")
+    parser.add_argument("--srt", help="subtitles for --video; generated when omitted")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of video to render")
+    parser.add_argument("--width", type=int, default=1080)
+    parser.add_argument("--height", type=int, default=1920)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--compositors", default=",".join(COMPOSITORS), help="comma-separated: sprite, ffmpeg, moviepy")
+    parser.add_argument("--encode", action="store_true", help="also encode each result with libx264")
+    parser.add_argument("--output", default="benchmark-results.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.video:
+            video = mp.VideoFileClip(args.video)
+            video = video.subclip(0, min(args.duration, video.duration))
+        else:
+            video = synthetic_clip(args.width, args.height, args.duration, args.fps)
+        srt_path = args.srt
+        if srt_path is None:
+            srt_path = os.path.join(work_dir, "subtitles.srt")
+            synthetic_srt(srt_path, video.duration)
+
+        results = []
+        source_path = None
+        for name in args.compositors.split(","):
+            if name == "ffmpeg" and not (args.encode and ffmpeg_has_subtitles_filter()):
+                print("ffmpeg: skipped (needs --encode and an ffmpeg built with libass)")
+                continue
+            print(f"{name}...", flush=True)
+            if name == "ffmpeg":
+                if source_path is None:
+                    # ffmpeg reads a file: the same frames, written once and not timed
+                    source_path = os.path.join(work_dir, "source.mp4")
+                    video.write_videofile(source_path, codec="libx264", audio=video.audio is not None,
+                                          audio_codec="aac", fps=video.fps, preset="ultrafast", logger=None)
+                frames = int(round(video.duration * video.fps))
+                result = run_ffmpeg(source_path, frames, video.duration, srt_path, work_dir)
+            else:
+                result = run_compositor(name, video, srt_path, args.encode, work_dir)
+            line = f"  {result['frames']} frames at {result['fps']:.1f} fps (setup {result['setup_s']:.2f}s)"
+            if args.encode:
+                line += f", encode {result['encode_realtime_factor']:.2f}x real time"
+            print(line)
+            results.append(result)
+        video.close()
+
+    by_name = {result["compositor"]: result for result in results}
+    if "sprite" in by_name and "moviepy" in by_name and by_name["moviepy"]["fps"]:
+        print(f"Sprite compositing is {by_name['sprite']['fps'] / by_name['moviepy']['fps']:.1f}x faster")
+    if args.encode and "ffmpeg" in by_name and "moviepy" in by_name:
+        print(f"ffmpeg burn-in is {by_name['moviepy']['encode_s'] / by_name['ffmpeg']['encode_s']:.1f}x faster end to end")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "video": args.video or f"synthetic {args.width}x{args.height}@{args.fps}",
+        "duration_s": args.duration,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,15 @@
 import os
-import srt
-from openai_translation import translate_audio
-from subtitle_generation import create_subtitles
+from audio_processing import media_duration
+from stage_cache import StageCache, ensure_stage, stage_keys, stage_outputs
 from video_processing import add_subtitles_to_video
-import moviepy.editor as mp
 
-def process_video(input_video_path: str, output_video_path: str, max_words_per_line: int = 4, max_lines: int = 1):
+def process_video(input_video_path: str, output_video_path: str, max_words_per_line: int = 4, max_lines: int = 1,
+                  cache: StageCache = None, compositor: str = "sprite"):
     print(f"Processing video: {input_video_path}")
     
-    # Load the video 
-    video = mp.VideoFileClip(input_video_path)
-    print(f"Video duration: {video.duration} seconds")
+    # Only the container header is read; the video is decoded once, when rendering
+    video_duration = media_duration(input_video_path)
+    print(f"Video duration: {video_duration} seconds")
 
     # Get the base filename without extension
     base_filename = os.path.splitext(os.path.basename(input_video_path))[0]
@@ -20,37 +19,22 @@ def process_video(input_video_path: str, output_video_path: str, max_words_per_l
     translated_text_path = f"{base_filename}_translated.txt"
     srt_path = f"{base_filename}_subtitles.srt"
 
-    # Step 1: Extract audio from video
-    if not os.path.exists(audio_path):
-        print("Extracting audio...")
-        video.audio.write_audiofile(audio_path)
-    else:
-        print(f"Using existing audio file: {audio_path}")
-
-    # Step 2: Translate audio to English text
-    if not os.path.exists(translated_text_path):
-        print("Translating audio...")
-        translate_audio(audio_path, translated_text_path)
-    else:
-        print(f"Using existing translated text: {translated_text_path}")
-
-    create_subtitles(translated_text_path, srt_path, max_words_per_line, max_lines, video.duration)
+    # Steps 1-3: audio, translation, LLM sentences and SRT, each reused from the
+    # stage cache when the video, model, prompt and layout parameters match
+    cache = cache or StageCache()
+    keys = stage_keys(input_video_path, max_words_per_line, max_lines)
+    outputs = stage_outputs(audio_path, translated_text_path, srt_path)
+    ensure_stage(cache, "srt", input_video_path, keys, outputs, max_words_per_line, max_lines, video_duration)
 
     # Step 4: Add subtitles to video
     print("Adding subtitles to video...")
-    add_subtitles_to_video(input_video_path, output_video_path, srt_path)
+    add_subtitles_to_video(input_video_path, output_video_path, srt_path, compositor)
 
     print(f"Video processing complete. Output saved as '{output_video_path}'")
 
 # Example usage
 if __name__ == "__main__":
-    process_video("day_10.mp4", "day_10_subtitles.mp4", max_words_per_line=4, max_lines=1)
-    process_video("day_11.mp4", "day_11_subtitles.mp4", max_words_per_line=4, max_lines=1)
-    process_video("day_12.mp4", "day_12_subtitles.mp4", max_words_per_line=4, max_lines=1)
-    process_video("day_13.mp4", "day_13_subtitles.mp4", max_words_per_line=4, max_lines=1)
-    # process_video("day_14.mp4", "day_14_subtitles.mp4", max_words_per_line=4, max_lines=1)
-    process_video("day_15.mp4", "day_15_subtitles.mp4", max_words_per_line=4, max_lines=1)
-    process_video("day_16.mp4", "day_16_subtitles.mp4", max_words_per_line=4, max_lines=1)
-    process_video("day_17.mp4", "day_17_subtitles.mp4", max_words_per_line=4, max_lines=1)
-    process_video("day_18.mp4", "day_18_subtitles.mp4", max_words_per_line=4, max_lines=1)
-    process_video("day_19.mp4", "day_19_subtitles.mp4", max_words_per_line=4, max_lines=1)
+    # Videos are processed concurrently (API calls overlap with encoding); see batch.py for the CLI.
+    from batch import run_batch
+    days = [f"day_{day}.mp4" for day in range(10, 20) if day != 14]
+    run_batch(days, max_words_per_line=4, max_lines=1)
@@ -0,0 +1,184 @@
+"""Local stand-in for the OpenAI endpoints autosubtitles calls.
+
+Answers Whisper translations (json, text and verbose_json) and the GPT
+sentence pass with deterministic text, after an optional delay, and logs
+how many requests were in flight, so chunked/concurrent translation can be
+exercised without an API key or network:
+
+    python mock_openai.py --port 8089 --latency 2
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock python main.py
+
+Uploads over --max-upload-mb get the API's 413, as files past the real
+limit do. With --rpm every response carries x-ratelimit-* headers for a
+per-endpoint sliding one-minute window, and requests past it get a 429 with
+retry-after-ms; --error-rate adds random 500s to exercise retries.
+"""
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIELD = re.compile(rb'name="([^"]+)"(?:; filename="([^"]*)")?\r\n(?:[^\r\n]+\r\n)*?\r\n(.*?)\r\n--', re.S)
+
+
+class MockOpenAI(BaseHTTPRequestHandler):
+    latency = 0.0
+    max_upload_bytes = 25 * 1024 * 1024
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    requests = 0
+    rpm = 0
+    error_rate = 0.0
+    # endpoint -> times of accepted requests in the last minute
+    windows = collections.defaultdict(collections.deque)
+    throttled = 0
+    errors = 0
+    rate_headers = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def admit(self, endpoint):
+        """Count the request against the endpoint's window; returns (admitted, rate-limit headers)."""
+        if not self.rpm:
+            return True, {}
+        cls = type(self)
+        with cls.lock:
+            now = time.monotonic()
+            window = cls.windows[endpoint]
+            while window and now - window[0] >= 60:
+                window.popleft()
+            admitted = len(window) < self.rpm
+            if admitted:
+                window.append(now)
+            else:
+                cls.throttled += 1
+            reset = 60 - (now - window[0]) if window else 0.0
+            headers = {
+                "x-ratelimit-limit-requests": str(self.rpm),
+                "x-ratelimit-remaining-requests": str(self.rpm - len(window)),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+            }
+        if not admitted:
+            headers["retry-after-ms"] = str(int(reset * 1000))
+        return admitted, headers
+
+    def reply(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in self.rate_headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.requests += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            print(f"{self.path} ({len(body)} bytes), {cls.in_flight} in flight, max {cls.max_in_flight}", flush=True)
+        try:
+            # Per endpoint stands in for the API's per-model limits
+            admitted, self.rate_headers = self.admit(self.path.rsplit("/", 1)[-1])
+            if not admitted:
+                self.reply(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}})
+                return
+            time.sleep(self.latency)
+            if random.random() < self.error_rate:
+                with cls.lock:
+                    cls.errors += 1
+                self.reply(500, {"error": {"message": "mock server error", "type": "server_error"}})
+                return
+            if self.path.endswith("/audio/translations"):
+                self.translation(body)
+            elif self.path.endswith("/chat/completions"):
+                self.chat_completion(json.loads(body))
+            else:
+                self.reply(404, {"error": {"message": f"mock has no {self.path}"}})
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def translation(self, body):
+        if len(body) > self.max_upload_bytes:
+            self.reply(413, {"error": {"message": "Maximum content size limit exceeded", "type": "invalid_request_error"}})
+            return
+        fields = {name.decode(): (filename, value) for name, filename, value in FIELD.findall(body)}
+        # Stem only: the mock GPT pass splits sentences on "."
+        filename = (fields.get("file", (b"audio", b""))[0] or b"audio").decode().rsplit(".", 1)[0]
+        response_format = fields.get("response_format", (None, b"json"))[1].decode()
+        audio_bytes = len(fields.get("file", (None, b""))[1])
+        # Deterministic text that says which chunk it came from, so stitching order is checkable
+        sentences = [f"{filename} sentence {i} of {audio_bytes} bytes" for i in range(3)]
+        text = ". ".join(sentences)
+        if response_format == "text":
+            self.reply(200, text, "text/plain")
+        elif response_format == "verbose_json":
+            self.reply(200, {
+                "task": "translate",
+                "language": "english",
+                "duration": 3.0,
+                "text": text,
+                "segments": [
+                    {"id": i, "seek": 0, "start": float(i), "end": float(i + 1), "text": sentence, "tokens": [],
+                     "temperature": 0.0, "avg_logprob": 0.0, "compression_ratio": 1.0, "no_speech_prob": 0.0}
+                    for i, sentence in enumerate(sentences)
+                ],
+            })
+        else:
+            self.reply(200, {"text": text})
+
+    def chat_completion(self, request):
+        text = request["messages"][-1]["content"]
+        sentences = [sentence.strip() for sentence in text.split(".") if sentence.strip()]
+        self.reply(200, {
+            "id": f"chatcmpl-mock-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps({"sentences": sentences}), "refusal": None},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {"prompt_tokens": len(text.split()), "completion_tokens": len(text.split()),
+                      "total_tokens": 2 * len(text.split())},
+        })
+
+
+def serve(port=8089, latency=0.0, max_upload_mb=25.0, rpm=0, error_rate=0.0):
+    MockOpenAI.latency = latency
+    MockOpenAI.rpm = rpm
+    MockOpenAI.error_rate = error_rate
+    MockOpenAI.max_upload_bytes = int(max_upload_mb * 1024 * 1024)
+    # A burst of concurrent uploads overflows socketserver's default backlog of 5
+    ThreadingHTTPServer.request_queue_size = 128
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockOpenAI)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds each request takes")
+    parser.add_argument("--max-upload-mb", type=float, default=25.0)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute per endpoint; 0 = unlimited")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    args = parser.parse_args()
+    server = serve(args.port, args.latency, args.max_upload_mb, args.rpm, args.error_rate)
+    print(f"Mock OpenAI on http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
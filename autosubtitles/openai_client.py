@@ -0,0 +1,277 @@
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Requests in flight at once, over the client's shared keep-alive connections
+MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "16"))
+MAX_ATTEMPTS = int(os.getenv("OPENAI_MAX_ATTEMPTS", "6"))
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 30.0
+# Assumed per-model limits until the first response reports the real ones
+DEFAULT_RPM = int(os.getenv("OPENAI_DEFAULT_RPM", "500"))
+DEFAULT_TPM = int(os.getenv("OPENAI_DEFAULT_TPM", "30000"))
+REQUEST_TIMEOUT_S = 600.0
+RETRYABLE_STATUS = (408, 409, 429)
+# USD: Whisper per audio minute, chat models per million tokens
+PRICES = {
+    "whisper-1": {"audio_minute": 0.006},
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+}
+DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str) -> float:
+    """Seconds in an x-ratelimit-reset-* header, e.g. "20ms", "1s", "6m0s"."""
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in DURATION.findall(value or ""))
+
+
+def retry_after(headers) -> float:
+    if headers is None:
+        return 0.0
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    try:
+        return float(headers.get("retry-after", 0))
+    except ValueError:
+        return 0.0
+
+
+def backoff(attempt: int, floor: float = 0.0) -> float:
+    # Full jitter, so clients that were throttled together do not retry together
+    return max(floor, random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt)))
+
+
+class TokenBucket:
+    """Per-minute limit as a bucket refilled continuously; `level` may go negative while requests are reserved."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self.refill(now)
+        # A request larger than the whole bucket still goes through once it is full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) * 60 / self.capacity)
+
+    def observe(self, limit, remaining, now: float):
+        """Adopt the server's view: its limit, and its remaining count if that is lower than ours."""
+        self.refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+
+class RateLimiter:
+    """Request and token buckets for one model, corrected by every response's x-ratelimit-* headers."""
+
+    def __init__(self):
+        self.requests = TokenBucket(DEFAULT_RPM)
+        self.tokens = TokenBucket(DEFAULT_TPM)
+        self.paused_until = 0.0
+
+    async def acquire(self, tokens: int = 0):
+        # Only ever touched from the client's event loop, so no lock
+        while True:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now), self.paused_until - now)
+            if wait <= 0:
+                self.requests.level -= 1
+                self.tokens.level -= min(tokens, self.tokens.capacity)
+                return
+            await asyncio.sleep(wait)
+
+    def observe(self, headers):
+        if headers is None:
+            return
+        now = time.monotonic()
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            bucket.observe(headers.get(f"x-ratelimit-limit-{kind}"), headers.get(f"x-ratelimit-remaining-{kind}"), now)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class Usage:
+    """Per-request latency, retries, tokens and cost, summarised per model."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+
+    def record(self, **fields):
+        with self.lock:
+            self.records.append(fields)
+
+    def summary(self) -> dict:
+        with self.lock:
+            records = list(self.records)
+        models = {}
+        for record in records:
+            models.setdefault(record["model"], []).append(record)
+        summary = {}
+        for model, model_records in models.items():
+            latencies = np.array([record["latency_s"] for record in model_records])
+            summary[model] = {
+                "requests": len(model_records),
+                "failed": sum(record["status"] != "ok" for record in model_records),
+                "retries": sum(record["attempts"] - 1 for record in model_records),
+                "p50_s": float(np.percentile(latencies, 50)),
+                "p95_s": float(np.percentile(latencies, 95)),
+                "input_tokens": sum(record["input_tokens"] for record in model_records),
+                "output_tokens": sum(record["output_tokens"] for record in model_records),
+                "audio_minutes": sum(record["audio_s"] for record in model_records) / 60,
+                "cost_usd": sum(record["cost_usd"] for record in model_records),
+            }
+        return summary
+
+    def describe(self) -> str:
+        lines = []
+        for model, stats in self.summary().items():
+            lines.append(
+                f"{model}: {stats['requests']} requests ({stats['failed']} failed, {stats['retries']} retries), "
+                f"p50 {stats['p50_s']:.1f}s p95 {stats['p95_s']:.1f}s, ${stats['cost_usd']:.4f}"
+            )
+        return "\n".join(lines)
+
+
+def request_cost(model: str, input_tokens: int, output_tokens: int, audio_s: float) -> float:
+    prices = PRICES.get(model, {})
+    return (
+        prices.get("audio_minute", 0.0) * audio_s / 60
+        + prices.get("input", 0.0) * input_tokens / 1e6
+        + prices.get("output", 0.0) * output_tokens / 1e6
+    )
+
+
+class OpenAIPool:
+    """One AsyncOpenAI client per process, with pooled connections and its own event loop thread.
+
+    Synchronous callers (pipeline stages, batch worker threads) hand
+    coroutines to run(); everything shares the connection pool, the
+    per-model rate limiters and the usage log. The SDK's own retries are
+    off: request() retries with jittered backoff and keeps the limiter in
+    step with the server's rate-limit headers, which the SDK's do not.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.usage = Usage()
+        self.limiters = {}
+        self.slots = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="openai", daemon=True).start()
+        self.client = AsyncOpenAI(
+            # OPENAI_BASE_URL points it at another endpoint, e.g. mock_openai.py
+            api_key=os.getenv('OPENAI_API_KEY'),
+            max_retries=0,
+            timeout=REQUEST_TIMEOUT_S,
+        )
+
+    def run(self, coroutine):
+        """Run a coroutine on the client's loop from any thread and return its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def limiter(self, model: str) -> RateLimiter:
+        if model not in self.limiters:
+            self.limiters[model] = RateLimiter()
+        return self.limiters[model]
+
+    async def request(self, model: str, call, tokens: int = 0, audio_s: float = 0.0):
+        """Await call() (a with_raw_response coroutine factory) under the model's limiter, with retries."""
+        limiter = self.limiter(model)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            await limiter.acquire(tokens)
+            if self.slots is None:
+                # Made lazily so it belongs to the client's loop
+                self.slots = asyncio.Semaphore(MAX_CONNECTIONS)
+            try:
+                async with self.slots:
+                    raw = await call()
+            except (APIStatusError, APIConnectionError) as e:
+                response = getattr(e, "response", None)
+                headers = response.headers if response is not None else None
+                status = getattr(e, "status_code", None)
+                limiter.observe(headers)
+                if status == 429:
+                    # Everyone waiting on this model holds off, not just this request
+                    limiter.pause(retry_after(headers) or parse_duration(headers and headers.get("x-ratelimit-reset-requests"))
+                                  or backoff(attempt))
+                retryable = status is None or status in RETRYABLE_STATUS or status >= 500
+                if not retryable or attempt >= MAX_ATTEMPTS:
+                    self.usage.record(
+                        model=model, status=str(status or type(e).__name__), attempts=attempt,
+                        latency_s=time.perf_counter() - start, input_tokens=0, output_tokens=0, audio_s=0.0,
+                        cost_usd=0.0,
+                    )
+                    raise
+                await asyncio.sleep(backoff(attempt, retry_after(headers)))
+                continue
+            limiter.observe(raw.headers)
+            result = raw.parse()
+            usage = getattr(result, "usage", None)
+            input_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            output_tokens = getattr(usage, "completion_tokens", 0) or 0
+            self.usage.record(
+                model=model, status="ok", attempts=attempt, latency_s=time.perf_counter() - start,
+                input_tokens=input_tokens, output_tokens=output_tokens, audio_s=audio_s,
+                cost_usd=request_cost(model, input_tokens, output_tokens, audio_s),
+            )
+            return result
+
+    async def translate(self, file_path: str, model: str, audio_s: float = 0.0, **kwargs):
+        def call():
+            # Reopened per attempt: a failed upload has consumed the file object
+            with open(file_path, 'rb') as audio_file:
+                content = audio_file.read()
+            return self.client.audio.translations.with_raw_response.create(
+                model=model, file=(os.path.basename(file_path), content), **kwargs,
+            )
+        return await self.request(model, call, audio_s=audio_s)
+
+    async def chat_parse(self, model: str, messages: list, **kwargs):
+        # ~4 characters per token, and the reply is about as long as the prompt
+        tokens = 2 * sum(len(message["content"]) for message in messages) // 4
+        return await self.request(
+            model, lambda: self.client.beta.chat.completions.with_raw_response.parse(model=model, messages=messages, **kwargs),
+            tokens=tokens,
+        )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def openai_pool() -> OpenAIPool:
+    """The process-wide pool; a forked worker process builds its own rather than sharing the parent's loop."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = OpenAIPool()
+        return _pool
+
+
+def existing_pool():
+    """This process's pool if a request already made one, else None; never builds a client."""
+    with _pool_lock:
+        return _pool if _pool is not None and _pool.pid == os.getpid() else None
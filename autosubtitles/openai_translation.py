@@ -1,22 +1,57 @@
-from openai import OpenAI
+import asyncio
+import json
 import os
-from dotenv import load_dotenv
+import tempfile
+from audio_processing import split_audio
+from openai_client import openai_pool
 
-# Load environment variables from .env file
-load_dotenv()
+TRANSLATION_MODEL = "whisper-1"
+# Long audio is cut at pauses into chunks of at most this length, translated concurrently
+CHUNK_SECONDS = int(os.getenv("TRANSLATION_CHUNK_SECONDS", "600"))
+TRANSLATION_WORKERS = int(os.getenv("TRANSLATION_WORKERS", "4"))
 
-# Get OpenAI API key from environment variable
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+def segments_path_for(translation_file: str) -> str:
+    return os.path.splitext(translation_file)[0] + "_segments.json"
 
-def translate_audio(file_path: str, translation_file: str) -> str:
-    print(f"Translating audio to English: {file_path}")
-    with open(file_path, 'rb') as audio_file:
-        translation = client.audio.translations.create(
-            model="whisper-1", 
-            file=audio_file
+async def translate_chunk(chunk_path: str, start: float, end: float, slots: asyncio.Semaphore) -> tuple:
+    """(text, segments) for one chunk, with segment times shifted to the full audio's timeline."""
+    async with slots:
+        translation = await openai_pool().translate(
+            chunk_path, TRANSLATION_MODEL, audio_s=end - start, response_format="verbose_json",
         )
+    segments = [
+        {"start": segment.start + start, "end": segment.end + start, "text": segment.text.strip()}
+        for segment in (getattr(translation, "segments", None) or [])
+    ]
+    return translation.text.strip(), segments
+
+async def translate_chunks(chunks: list, workers: int) -> list:
+    # Created on the client's loop; the pool's rate limiter paces requests across all videos
+    slots = asyncio.Semaphore(workers)
+    # gather keeps chunk order whatever order the requests finish in
+    return await asyncio.gather(*(translate_chunk(path, start, end, slots) for start, end, path in chunks))
+
+def translate_audio(file_path: str, translation_file: str, chunk_seconds: float = CHUNK_SECONDS,
+                    workers: int = TRANSLATION_WORKERS) -> str:
+    print(f"Translating audio to English: {file_path}")
+    with tempfile.TemporaryDirectory() as chunk_dir:
+        chunks = split_audio(file_path, chunk_seconds, chunk_dir)
+        if len(chunks) > 1:
+            print(f"Translating {len(chunks)} chunks, {min(workers, len(chunks))} at a time")
+        results = openai_pool().run(translate_chunks(chunks, workers))
+
+    text = " ".join(chunk_text for chunk_text, _ in results if chunk_text)
     print(f"Audio translated. Saving to: {translation_file}")
-    # save it in a txt file 
+    # save it in a txt file
     with open(translation_file, "w") as file:
-        file.write(translation.text)
-    return translation.text
+        file.write(text)
+    # Chunk and segment offsets on the full audio's timeline, next to the text
+    with open(segments_path_for(translation_file), "w") as file:
+        json.dump({
+            "chunks": [
+                {"start": start, "end": end, "text": chunk_text}
+                for (start, end, _), (chunk_text, _) in zip(chunks, results)
+            ],
+            "segments": [segment for _, segments in results for segment in segments],
+        }, file, indent=2)
+    return text
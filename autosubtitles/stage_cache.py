@@ -0,0 +1,270 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+CACHE_DIR = os.getenv("AUTOSUBTITLES_CACHE_DIR", os.path.expanduser("~/.cache/autosubtitles"))
+CACHE_MAX_MB = int(os.getenv("AUTOSUBTITLES_CACHE_MAX_MB", "2048"))
+CACHE_MAX_AGE_DAYS = float(os.getenv("AUTOSUBTITLES_CACHE_MAX_AGE_DAYS", "30"))
+# Bump when a stage's output changes for the same inputs and parameters.
+# 2: translation entries carry the segments sidecar.
+CACHE_VERSION = 2
+
+# Pipeline order; each stage's key is derived from the previous stage's key.
+STAGES = ["audio", "translation", "sentences", "srt"]
+
+_file_digests = {}
+
+
+def file_digest(path: str) -> str:
+    """sha256 of a file's bytes, memoised on (path, size, mtime) so a video is hashed once per process."""
+    stat = os.stat(path)
+    memo = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo not in _file_digests:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _file_digests[memo] = digest.hexdigest()
+    return _file_digests[memo]
+
+
+def stage_key(stage: str, parent: str, **params) -> str:
+    payload = json.dumps({"stage": stage, "parent": parent, "version": CACHE_VERSION, **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def stage_keys(input_video_path: str, max_words_per_line: int, max_lines: int) -> dict:
+    """Cache key of every stage for one video.
+
+    Keys chain: a stage's key covers its parent's key plus its own
+    parameters, so it is known without computing the parent's output (a dry
+    run only hashes the video), and a change anywhere upstream changes every
+    key below it. The SRT depends on the video duration, which the video
+    digest already covers.
+    """
+    from audio_processing import AUDIO_FORMAT
+    from openai_translation import CHUNK_SECONDS, TRANSLATION_MODEL
+    from subtitle_generation import LLM_MODEL, LLM_TEMPERATURE, SYSTEM_PROMPT
+
+    keys = {}
+    keys["audio"] = stage_key("audio", file_digest(input_video_path), format=AUDIO_FORMAT)
+    keys["translation"] = stage_key("translation", keys["audio"], model=TRANSLATION_MODEL, chunk_seconds=CHUNK_SECONDS)
+    keys["sentences"] = stage_key(
+        "sentences", keys["translation"], model=LLM_MODEL, prompt=SYSTEM_PROMPT, temperature=LLM_TEMPERATURE,
+    )
+    keys["srt"] = stage_key("srt", keys["sentences"], max_words_per_line=max_words_per_line, max_lines=max_lines)
+    return keys
+
+
+class StageCache:
+    """Stage outputs stored by key, one directory per entry holding the output file, its sidecars and meta.json.
+
+    A hit is copied to wherever the caller wants the output, so the working
+    directory files are plain copies and can be deleted freely. The
+    meta.json mtime is the last-used time that eviction goes by.
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = CACHE_MAX_MB * 1024 * 1024,
+                 max_age_s: float = CACHE_MAX_AGE_DAYS * 86400):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self._path(key), "meta.json"))
+
+    def fetch(self, key: str, output_path: str, sidecars: dict = None) -> bool:
+        """Copy the cached output for key to output_path, and each sidecar {name: path}; False on a miss."""
+        if not self.contains(key):
+            return False
+        files = {"output": output_path, **(sidecars or {})}
+        copies = {}
+        try:
+            for name, path in files.items():
+                copies[path] = f"{path}.{uuid.uuid4().hex}.tmp"
+                shutil.copyfile(os.path.join(self._path(key), name), copies[path])
+        except FileNotFoundError:
+            # Evicted by another process between the check and the copy
+            for tmp_path in copies.values():
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            return False
+        for path, tmp_path in copies.items():
+            os.replace(tmp_path, path)
+        try:
+            os.utime(os.path.join(self._path(key), "meta.json"))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def store(self, key: str, output_path: str, stage: str, source: str = "", sidecars: dict = None):
+        """Copy a freshly computed output and its sidecars {name: path} into the cache, then evict down to the limits."""
+        if self.contains(key):
+            return
+        path = self._path(key)
+        tmp_path = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+        files = {"output": output_path, **(sidecars or {})}
+        for name, file_path in files.items():
+            shutil.copyfile(file_path, os.path.join(tmp_path, name))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({
+                "stage": stage,
+                "source": source,
+                "created": time.time(),
+                "bytes": sum(os.path.getsize(file_path) for file_path in files.values()),
+            }, f)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process stored the same key first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict()
+
+    def entries(self) -> list:
+        """[(key, meta, last used)] for every complete entry."""
+        entries = []
+        for prefix in os.listdir(self.root):
+            prefix_path = os.path.join(self.root, prefix)
+            if prefix.startswith(".") or not os.path.isdir(prefix_path):
+                continue
+            for key in os.listdir(prefix_path):
+                meta_path = os.path.join(prefix_path, key, "meta.json")
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    entries.append((key, meta, os.path.getmtime(meta_path)))
+                except (OSError, ValueError):
+                    continue
+        return entries
+
+    def evict(self) -> list:
+        """Drop entries unused for max_age_s, then least recently used ones until under max_bytes."""
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(meta["bytes"] for _, meta, _ in entries)
+        evicted = []
+        for key, meta, last_used in entries:
+            if now - last_used <= self.max_age_s and total <= self.max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= meta["bytes"]
+            evicted.append(key)
+        return evicted
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        per_stage = {}
+        for _, meta, _ in entries:
+            stage = per_stage.setdefault(meta["stage"], {"entries": 0, "bytes": 0})
+            stage["entries"] += 1
+            stage["bytes"] += meta["bytes"]
+        return {
+            "entries": len(entries),
+            "size_mb": sum(meta["bytes"] for _, meta, _ in entries) / (1024 * 1024),
+            "stages": per_stage,
+        }
+
+
+def stale_stages(cache: StageCache, keys: dict, upto: str = STAGES[-1]) -> list:
+    """Stages that would be recomputed to produce `upto`: walking back from it until a cached stage."""
+    stale = []
+    for stage in reversed(STAGES[:STAGES.index(upto) + 1]):
+        if cache.contains(keys[stage]):
+            break
+        stale.append(stage)
+    return stale[::-1]
+
+
+def stage_outputs(audio_path: str, translated_text_path: str, srt_path: str) -> dict:
+    from subtitle_generation import sentences_path_for
+    return {
+        "audio": audio_path,
+        "translation": translated_text_path,
+        "sentences": sentences_path_for(srt_path),
+        "srt": srt_path,
+    }
+
+
+def stage_sidecars(stage: str, outputs: dict) -> dict:
+    """Files a stage writes next to its output, {name: path}; cached and restored along with it."""
+    if stage == "translation":
+        from openai_translation import segments_path_for
+        return {"segments": segments_path_for(outputs["translation"])}
+    return {}
+
+
+def compute_stage(stage: str, input_video_path: str, outputs: dict, max_words_per_line: int, max_lines: int,
+                  video_duration: float = None):
+    if stage == "audio":
+        from audio_processing import extract_audio
+        extract_audio(input_video_path, outputs["audio"])
+    elif stage == "translation":
+        from openai_translation import translate_audio
+        translate_audio(outputs["audio"], outputs["translation"])
+    elif stage == "sentences":
+        from subtitle_generation import write_sentences
+        write_sentences(outputs["translation"], outputs["sentences"])
+    elif stage == "srt":
+        from subtitle_generation import build_subtitles, read_sentences
+        if video_duration is None:
+            from audio_processing import media_duration
+            video_duration = media_duration(input_video_path)
+        build_subtitles(read_sentences(outputs["sentences"]), outputs["srt"], max_words_per_line, max_lines,
+                        video_duration)
+
+
+def ensure_stage(cache: StageCache, stage: str, input_video_path: str, keys: dict, outputs: dict,
+                 max_words_per_line: int, max_lines: int, video_duration: float = None) -> bool:
+    """Put the output of `stage` at outputs[stage], from the cache or by recomputing it; True if recomputed.
+
+    Only the stages after the last cached one run: with the sentences
+    cached, a new max_lines rebuilds the SRT without audio, Whisper or GPT.
+    """
+    sidecars = stage_sidecars(stage, outputs)
+    if cache.fetch(keys[stage], outputs[stage], sidecars):
+        print(f"Using cached {stage}: {outputs[stage]}")
+        return False
+    position = STAGES.index(stage)
+    if position:
+        ensure_stage(cache, STAGES[position - 1], input_video_path, keys, outputs, max_words_per_line, max_lines,
+                     video_duration)
+    compute_stage(stage, input_video_path, outputs, max_words_per_line, max_lines, video_duration)
+    cache.store(keys[stage], outputs[stage], stage, input_video_path, sidecars)
+    return True
+
+
+def dry_run(input_paths: list, max_words_per_line: int, max_lines: int, cache: StageCache = None) -> dict:
+    """Print, per video, which stages are cached and which would be recomputed; nothing is run."""
+    cache = cache or StageCache()
+    plan = {}
+    for path in input_paths:
+        stale = stale_stages(cache, stage_keys(path, max_words_per_line, max_lines))
+        plan[path] = stale
+        print(f"{path}: {'recompute ' + ', '.join(stale) if stale else 'all stages cached'}")
+    return plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or trim the autosubtitles stage cache.")
+    parser.add_argument("inputs", nargs="*", help="videos to check with --dry-run")
+    parser.add_argument("--dry-run", action="store_true", help="print which stages would be recomputed")
+    parser.add_argument("--evict", action="store_true", help="apply the size and age limits now")
+    parser.add_argument("--max-words-per-line", type=int, default=4)
+    parser.add_argument("--max-lines", type=int, default=1)
+    args = parser.parse_args()
+    cache = StageCache()
+    if args.dry_run:
+        dry_run(args.inputs, args.max_words_per_line, args.max_lines, cache)
+    if args.evict:
+        print(f"Evicted {len(cache.evict())} entries")
+    print(json.dumps(cache.stats(), indent=2))
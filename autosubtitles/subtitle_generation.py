@@ -2,35 +2,42 @@ import srt
 import datetime
 import json
 from typing import List
-from openai import OpenAI
+from openai_client import openai_pool
 from pydantic import BaseModel, Field
 
+LLM_MODEL = "gpt-4o"  # Update this to the latest available model
+LLM_TEMPERATURE = 0.0
+SYSTEM_PROMPT = "You are an expert in creating subtitles for videos in a mix of Hindi and English. Your task is to correct the grammar and improve the tonality of the provided text, splitting it into clear and concise sentences. Each sentence should be easy to read, grammatically correct, and maintain the original meaning and tone of the video. Avoid using full stops at the end of sentences."
+
 class ProcessedText(BaseModel):
     sentences: List[str] = Field(..., description="An array of corrected and split sentences from the input text")
 
 def process_text_with_llm(text: str) -> List[str]:
-    client = OpenAI()
-    
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o",  # Update this to the latest available model
+    pool = openai_pool()
+
+    completion = pool.run(pool.chat_parse(
+        model=LLM_MODEL,
         messages=[
             {
                 "role": "system",
-                "content": "You are an expert in creating subtitles for videos in a mix of Hindi and English. Your task is to correct the grammar and improve the tonality of the provided text, splitting it into clear and concise sentences. Each sentence should be easy to read, grammatically correct, and maintain the original meaning and tone of the video. Avoid using full stops at the end of sentences."
+                "content": SYSTEM_PROMPT
             },
             {
                 "role": "user",
                 "content": text
             }
         ],
-        temperature=0.0,
+        temperature=LLM_TEMPERATURE,
         response_format=ProcessedText,
-    )
+    ))
 
     processed_text = completion.choices[0].message.parsed
     return processed_text.sentences
 
-def create_subtitles(translated_text_path: str, srt_path: str, max_words_per_line: int, max_lines: int, video_duration: float) -> List[srt.Subtitle]:
+def sentences_path_for(srt_path: str) -> str:
+    return srt_path.replace('.srt', '_processed.json')
+
+def write_sentences(translated_text_path: str, processed_sentences_path: str) -> List[str]:
     # Read the translated text
     with open(translated_text_path, "r") as file:
         text = file.read()
@@ -39,10 +46,19 @@ def create_subtitles(translated_text_path: str, srt_path: str, max_words_per_lin
     processed_sentences = process_text_with_llm(text)
     
     # Save processed sentences to a file
-    processed_sentences_path = srt_path.replace('.srt', '_processed.json')
     with open(processed_sentences_path, "w") as file:
         json.dump({"sentences": processed_sentences}, file, indent=2)
-    
+    return processed_sentences
+
+def read_sentences(processed_sentences_path: str) -> List[str]:
+    with open(processed_sentences_path, "r") as file:
+        return json.load(file)["sentences"]
+
+def create_subtitles(translated_text_path: str, srt_path: str, max_words_per_line: int, max_lines: int, video_duration: float) -> List[srt.Subtitle]:
+    processed_sentences = write_sentences(translated_text_path, sentences_path_for(srt_path))
+    return build_subtitles(processed_sentences, srt_path, max_words_per_line, max_lines, video_duration)
+
+def build_subtitles(processed_sentences: List[str], srt_path: str, max_words_per_line: int, max_lines: int, video_duration: float) -> List[srt.Subtitle]:
     # Create subtitle parts from processed sentences
     subtitle_parts = []
     current_part = []
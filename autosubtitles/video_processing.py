@@ -1,61 +1,274 @@
+import bisect
+import os
+import subprocess
+from functools import lru_cache
+from typing import NamedTuple
+
 import moviepy.editor as mp
 from moviepy.video.tools.subtitles import SubtitlesClip
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 from PIL import Image, ImageDraw
 import numpy as np
+import srt
+from audio_processing import ffmpeg_binary
 
-def create_subtitle_clip(txt, video_width, video_height):
-    fontsize = 64
-    font = 'Manrope-ExtraBold'
-    text_color = '#F55E12'
-    box_color = '#FFFFFF'
-    box_opacity = int(255 * 0.9)  # 90% opacity
-    horizontal_padding = 30
-    vertical_padding = 20
+COMPOSITORS = ("sprite", "ffmpeg", "moviepy")
 
-    # Create text clip
-    txt_clip = mp.TextClip(txt, fontsize=fontsize, font=font, color=text_color, method='label', align='center')
-    
-    # Calculate the size of the background
-    txt_width, txt_height = txt_clip.size
-    background_width = txt_width + (2 * horizontal_padding)
-    background_height = txt_height + (2 * vertical_padding)
-    
+class SubtitleStyle(NamedTuple):
+    fontsize: int = 64
+    font: str = 'Manrope-ExtraBold'
+    text_color: str = '#F55E12'
+    box_color: str = '#FFFFFF'
+    box_opacity: int = int(255 * 0.9)  # 90% opacity
+    horizontal_padding: int = 30
+    vertical_padding: int = 20
+    radius: int = 15
+
+DEFAULT_STYLE = SubtitleStyle()
+
+def render_box(width: int, height: int, style: SubtitleStyle = DEFAULT_STYLE) -> np.ndarray:
     # Create a rounded rectangle background using PIL
-    background = Image.new('RGBA', (background_width, background_height), (0, 0, 0, 0))
+    background = Image.new('RGBA', (width, height), (0, 0, 0, 0))
     draw = ImageDraw.Draw(background)
-    
+
     # Convert hex color to RGB and add opacity
-    box_color_rgb = tuple(int(box_color[i:i+2], 16) for i in (1, 3, 5))
-    box_color_rgba = box_color_rgb + (box_opacity,)
-    
-    draw.rounded_rectangle([(0, 0), (background_width, background_height)], radius=15, fill=box_color_rgba)
-    
+    box_color_rgb = tuple(int(style.box_color[i:i+2], 16) for i in (1, 3, 5))
+    box_color_rgba = box_color_rgb + (style.box_opacity,)
+
+    draw.rounded_rectangle([(0, 0), (width, height)], radius=style.radius, fill=box_color_rgba)
+
     # Convert PIL Image to numpy array
-    background_array = np.array(background)
-    
+    return np.array(background)
+
+def create_subtitle_clip(txt, video_width, video_height, style: SubtitleStyle = DEFAULT_STYLE):
+    # Create text clip
+    txt_clip = mp.TextClip(txt, fontsize=style.fontsize, font=style.font, color=style.text_color, method='label', align='center')
+
+    # Calculate the size of the background
+    txt_width, txt_height = txt_clip.size
+    background_width = txt_width + (2 * style.horizontal_padding)
+    background_height = txt_height + (2 * style.vertical_padding)
+
+    background_array = render_box(background_width, background_height, style)
+
     # Create MoviePy clip from the numpy array
     background_clip = mp.ImageClip(background_array).set_duration(txt_clip.duration)
 
     # Composite text over background
     composite = mp.CompositeVideoClip([background_clip, txt_clip.set_position('center')])
-    
+
     # Set position to center of video
     composite = composite.set_position(('center', 'center'))
-    
+
     return composite
 
-def add_subtitles_to_video(input_video_path: str, output_video_path: str, srt_path: str):
-    print(f"Adding subtitles from {srt_path} to video: {input_video_path}")
-    # Load the video
-    video = mp.VideoFileClip(input_video_path)
+class Sprite:
+    """A subtitle rendered once, stored in the integer form blend() needs.
+
+    `premul` is the premultiplied colour scaled by 255 (plus 127 so the
+    final division rounds) and `inv_alpha` is 255 - alpha. A frame pixel F
+    becomes (F * inv_alpha + premul) // 255, which never exceeds uint16, so
+    the blend is four in-place ops on a preallocated scratch buffer.
+    """
+
+    def __init__(self, rgb: np.ndarray, alpha: np.ndarray):
+        # rgb: straight colour 0-255, alpha: 0-1, both float
+        self.height, self.width = alpha.shape
+        alpha = alpha[..., None]
+        self.premul = (np.rint(rgb * alpha * 255) + 127).astype(np.uint16)
+        self.inv_alpha = (255 - np.rint(alpha * 255)).astype(np.uint16)
+        self.scratch = np.empty((self.height, self.width, 3), dtype=np.uint16)
 
+    def blend(self, frame: np.ndarray, x: int, y: int):
+        """Alpha-blend over frame (uint8 RGB, writable) in place, touching only the sprite's bounding box."""
+        frame_height, frame_width = frame.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + self.width, frame_width), min(y + self.height, frame_height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        sprite_box = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+        region = frame[y0:y1, x0:x1]
+        scratch = self.scratch[sprite_box]
+        np.multiply(region, self.inv_alpha[sprite_box], out=scratch)
+        np.add(scratch, self.premul[sprite_box], out=scratch)
+        np.floor_divide(scratch, 255, out=scratch)
+        np.copyto(region, scratch, casting='unsafe')
+
+@lru_cache(maxsize=512)
+def subtitle_sprite(txt: str, style: SubtitleStyle = DEFAULT_STYLE) -> Sprite:
+    """Text over the rounded box, composited once per (text, style) with the same look as create_subtitle_clip."""
+    txt_clip = mp.TextClip(txt, fontsize=style.fontsize, font=style.font, color=style.text_color, method='label', align='center')
+    text_rgb = txt_clip.get_frame(0).astype(np.float32)
+    text_alpha = txt_clip.mask.get_frame(0).astype(np.float32)
+    txt_clip.close()
+
+    txt_height, txt_width = text_alpha.shape
+    background = render_box(txt_width + (2 * style.horizontal_padding), txt_height + (2 * style.vertical_padding), style).astype(np.float32)
+    rgb = background[..., :3]
+    alpha = background[..., 3] / 255
+
+    # "Over" compositing of the text, centred the way set_position('center') places it
+    top = (alpha.shape[0] - txt_height) // 2
+    left = (alpha.shape[1] - txt_width) // 2
+    box = (slice(top, top + txt_height), slice(left, left + txt_width))
+    under_alpha = alpha[box] * (1 - text_alpha)
+    out_alpha = text_alpha + under_alpha
+    covered = np.maximum(out_alpha, 1e-6)[..., None]
+    rgb[box] = (text_rgb * text_alpha[..., None] + rgb[box] * under_alpha[..., None]) / covered
+    alpha[box] = out_alpha
+    return Sprite(rgb, alpha)
+
+class SubtitleOverlay:
+    """Frame filter that blends the active subtitle's sprite onto each frame, centred.
+
+    Sprites are rendered up front; per frame it is a bisect for the active
+    subtitle, a copy of the decoded frame into a reused buffer (decoded
+    frames are read-only) and Sprite.blend. write_videofile consumes each
+    frame before asking for the next, so one buffer is enough.
+    """
+
+    def __init__(self, srt_path: str, size: tuple, style: SubtitleStyle = DEFAULT_STYLE):
+        with open(srt_path, "r") as file:
+            subtitles = sorted(srt.parse(file.read()), key=lambda subtitle: subtitle.start)
+        self.starts = [subtitle.start.total_seconds() for subtitle in subtitles]
+        self.ends = [subtitle.end.total_seconds() for subtitle in subtitles]
+        self.sprites = [subtitle_sprite(subtitle.content, style) for subtitle in subtitles]
+        width, height = size
+        self.positions = [((width - sprite.width) // 2, (height - sprite.height) // 2) for sprite in self.sprites]
+        self.buffer = np.empty((height, width, 3), dtype=np.uint8)
+
+    def active(self, t: float):
+        i = bisect.bisect_right(self.starts, t) - 1
+        return i if i >= 0 and t < self.ends[i] else None
+
+    def __call__(self, get_frame, t):
+        frame = get_frame(t)
+        i = self.active(t)
+        if i is None:
+            return frame
+        np.copyto(self.buffer, frame[..., :3])
+        self.sprites[i].blend(self.buffer, *self.positions[i])
+        return self.buffer
+
+def subtitled_clip_sprites(video, srt_path: str, style: SubtitleStyle = DEFAULT_STYLE):
+    return video.fl(SubtitleOverlay(srt_path, video.size, style))
+
+def subtitled_clip_moviepy(video, srt_path: str, style: SubtitleStyle = DEFAULT_STYLE):
     # Create a SubtitlesClip with adjusted style
-    generator = lambda txt: create_subtitle_clip(txt, video.w, video.h)
+    generator = lambda txt: create_subtitle_clip(txt, video.w, video.h, style)
     subtitles_clip = SubtitlesClip(srt_path, generator)
 
     # Overlay subtitles on the video
-    final_video = CompositeVideoClip([video, subtitles_clip.set_position(('center', 'center'))])
+    return CompositeVideoClip([video, subtitles_clip.set_position(('center', 'center'))])
+
+def ass_color(hex_color: str, opacity: int = 255) -> str:
+    # ASS colours are &HAABBGGRR with alpha 0 = opaque
+    red, green, blue = (hex_color[i:i+2] for i in (1, 3, 5))
+    return f"&H{255 - opacity:02X}{blue}{green}{red}".upper()
+
+def ass_time(delta) -> str:
+    centiseconds = int(round(delta.total_seconds() * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+def srt_to_ass(srt_path: str, ass_path: str, video_size: tuple, style: SubtitleStyle = DEFAULT_STYLE):
+    """Write the SRT as ASS in the caption style, for libass to render inside ffmpeg.
+
+    The box is an ASS opaque box (BorderStyle 3) padded by \\xbord/\\ybord;
+    libass has no rounded boxes, so its corners are square. PlayRes is the
+    video size, so font size and padding are in video pixels.
+    """
+    with open(srt_path, "r") as file:
+        subtitles = list(srt.parse(file.read()))
+    width, height = video_size
+    text_color = ass_color(style.text_color)
+    box_color = ass_color(style.box_color, style.box_opacity)
+    # ImageMagick takes the PostScript name, fontconfig/libass the full name
+    font = style.font.replace('-', ' ')
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, "
+        "Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, "
+        "MarginL, MarginR, MarginV, Encoding",
+        f"Style: Caption,{font},{style.fontsize},{text_color},{text_color},{box_color},{box_color},0,0,0,0,100,100,0,0,"
+        f"3,{style.vertical_padding},0,5,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    padding = f"{{\\xbord{style.horizontal_padding}\\ybord{style.vertical_padding}}}"
+    for subtitle in subtitles:
+        text = subtitle.content.replace('\n', '\\N')
+        lines.append(f"Dialogue: 0,{ass_time(subtitle.start)},{ass_time(subtitle.end)},Caption,,0,0,0,,{padding}{text}")
+    with open(ass_path, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+
+@lru_cache(maxsize=None)
+def ffmpeg_has_subtitles_filter() -> bool:
+    # Static ffmpeg builds (e.g. imageio-ffmpeg's) may be built without libass
+    try:
+        filters = subprocess.run([ffmpeg_binary(), "-hide_banner", "-filters"], capture_output=True, text=True).stdout
+    except OSError:
+        return False
+    return any(line.split()[1:2] == ["subtitles"] for line in filters.splitlines())
+
+def filter_path(path: str) -> str:
+    # Escaped once as an option value and once for the filtergraph
+    for char in "\\':":
+        path = path.replace(char, "\\" + char)
+    for char in "\\'[],;":
+        path = path.replace(char, "\\" + char)
+    return path
+
+def burn_in_ffmpeg(input_video_path: str, output_video_path: str, srt_path: str, style: SubtitleStyle = DEFAULT_STYLE):
+    """One ffmpeg pass: libass draws the captions in the filter graph and the audio is stream-copied."""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    video_size = ffmpeg_parse_infos(input_video_path)["video_size"]
+    ass_path = os.path.splitext(srt_path)[0] + ".ass"
+    srt_to_ass(srt_path, ass_path, video_size, style)
+    command = [
+        ffmpeg_binary(), "-y", "-loglevel", "error", "-i", input_video_path,
+        "-vf", f"subtitles=filename={filter_path(os.path.abspath(ass_path))}",
+        "-map", "0:v:0", "-map", "0:a?",
+        "-c:v", "libx264", "-c:a", "copy",
+        output_video_path,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg burn-in failed: {result.stderr.strip()}")
+
+def add_subtitles_to_video(input_video_path: str, output_video_path: str, srt_path: str, compositor: str = "sprite"):
+    print(f"Adding subtitles from {srt_path} to video: {input_video_path}")
+    if compositor not in COMPOSITORS:
+        raise ValueError(f"Unknown compositor {compositor!r}; expected one of {COMPOSITORS}")
+    if compositor == "ffmpeg":
+        if ffmpeg_has_subtitles_filter():
+            try:
+                burn_in_ffmpeg(input_video_path, output_video_path, srt_path)
+                print(f"Video processing complete. Output saved as '{output_video_path}'")
+                return
+            except RuntimeError as e:
+                # e.g. an audio codec the output container cannot take as-is
+                print(f"{e}; falling back to MoviePy")
+        else:
+            print("ffmpeg has no subtitles filter (libass); falling back to MoviePy")
+        compositor = "sprite"
+    # Load the video
+    video = mp.VideoFileClip(input_video_path)
+
+    if compositor == "sprite":
+        final_video = subtitled_clip_sprites(video, srt_path)
+    else:
+        final_video = subtitled_clip_moviepy(video, srt_path)
 
     # Write the final video
     final_video.write_videofile(output_video_path, codec='libx264', audio_codec='aac')
@@ -0,0 +1,120 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+# "sales in 2023" and "sales in 2024" embed almost identically; numbers must match exactly.
+NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+REPLAY_CHUNK = re.compile(r"\S+\s*|\s+")
+
+
+def normalize_question(question):
+    return " ".join(question.lower().split())
+
+
+def replay(answer):
+    """Yield a cached answer in word-sized pieces, like a streaming LLM would."""
+    yield from REPLAY_CHUNK.findall(answer)
+
+
+class CachedAnswer:
+    def __init__(self, index_key, question, embedding, answer, path, detail):
+        self.index_key = index_key
+        self.question = normalize_question(question)
+        self.numbers = NUMBER.findall(question)
+        self.embedding = embedding
+        self.answer = answer
+        self.path = path
+        self.detail = detail
+        self.created = time.time()
+
+
+class AnswerCache:
+    """Process-wide cache of finished answers, looked up by index key + question similarity.
+
+    An entry is reused when it belongs to the same index key (so any change
+    to the file, parser or embedding model misses), is younger than `ttl`,
+    has the same numbers in the question, and either has the same
+    normalized text or a query embedding with cosine similarity >=
+    `threshold`. Entries stored without an embedding only match on text.
+    Least recently used entries go first beyond `max_entries`.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL_S, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _expire(self, now):
+        expired = [entry_id for entry_id, entry in self.entries.items() if now - entry.created > self.ttl]
+        for entry_id in expired:
+            del self.entries[entry_id]
+
+    def lookup_text(self, index_key, question):
+        """Exact (normalized) question match; needs no embedding."""
+        question = normalize_question(question)
+        with self.lock:
+            self._expire(time.time())
+            for entry_id, entry in self.entries.items():
+                if entry.index_key == index_key and entry.question == question:
+                    self.entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return entry, 1.0
+        return None, 0.0
+
+    def lookup(self, index_key, question, embedding):
+        """Return (entry, similarity) for the best match above the threshold, else (None, best similarity)."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        numbers = NUMBER.findall(question)
+        with self.lock:
+            self._expire(time.time())
+            candidates = [
+                (entry_id, entry) for entry_id, entry in self.entries.items()
+                if entry.index_key == index_key and entry.numbers == numbers and entry.embedding is not None
+            ]
+            if not candidates:
+                self.misses += 1
+                return None, 0.0
+            similarities = np.stack([entry.embedding for _, entry in candidates]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None, float(similarities[best])
+            entry_id, entry = candidates[best]
+            self.entries.move_to_end(entry_id)
+            self.hits += 1
+            return entry, float(similarities[best])
+
+    def store(self, index_key, question, embedding, answer, path, detail=""):
+        if not answer.strip():
+            return
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding /= np.linalg.norm(embedding) or 1.0
+        with self.lock:
+            self.entries[self.next_id] = CachedAnswer(index_key, question, embedding, answer, path, detail)
+            self.next_id += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,262 @@
+"""Ingestion and query benchmark for chat-with-excel.
+
+Generates synthetic CSV / XLSX files, runs the same ingestion path as the
+app (parse -> Parquet table cache -> row-group nodes -> embeddings -> index
+cache -> query router) with deterministic local stand-ins for Ollama and the
+embedding model, and writes wall times, peak RSS, node counts and
+retrieval/query latencies to a JSON file so runs can be compared.
+
+Every (format, rows) case runs in a fresh interpreter so peak RSS is per
+case:
+
+    python benchmark.py --sizes 1000,10000,100000 --formats csv,xlsx --output bench.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+FORMATS = ["csv", "xlsx"]
+EMBED_DIM = 256
+QUESTIONS = [
+    "What is the price of SKU-0000042?",
+    "Which products did customer7@example.com buy?",
+    "How many orders were shipped to the North region?",
+    "What is the total quantity per region?",
+    "Show orders with notes mentioning a refund",
+    "Which orders were gift wrapped?",
+    "What did customers order in March 2023?",
+    "List the most expensive laptop orders",
+]
+TOKEN = re.compile(r"\w+")
+
+
+def synthetic_frame(rows, seed=0):
+    """Deterministic order table with IDs, emails, categories, dates, numbers and free text."""
+    rng = np.random.default_rng(seed)
+    positions = np.arange(rows).astype(str)
+    customers = rng.integers(0, max(rows // 10, 1), rows).astype(str)
+    return pd.DataFrame({
+        "order_id": np.char.add("SKU-", np.char.zfill(positions, 7)),
+        "date": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 730, rows), unit="D"),
+        "region": rng.choice(["North", "South", "East", "West"], rows),
+        "product": rng.choice(["laptop", "monitor", "keyboard", "mouse", "dock", "headset", "webcam", "chair"], rows),
+        "customer": np.char.add(np.char.add("customer", customers), "@example.com"),
+        "quantity": rng.integers(1, 50, rows),
+        "price": rng.uniform(1, 2500, rows).round(2),
+        "notes": rng.choice(["", "refund requested", "gift wrap", "express shipping", "damaged box"], rows),
+    })
+
+
+def synthetic_file(data_dir, fmt, rows):
+    """Path of the synthetic file, generated on first use and reused afterwards."""
+    path = os.path.join(data_dir, f"synthetic-{rows}.{fmt}")
+    if not os.path.exists(path):
+        df = synthetic_frame(rows)
+        if fmt == "csv":
+            df.to_csv(path, index=False)
+        else:
+            df.to_excel(path, index=False, sheet_name="orders")
+    return path
+
+
+def percentiles(samples):
+    values = np.array(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def peak_rss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def stub_models(answer_tokens):
+    """Deterministic local stand-ins for Ollama and the embedding model."""
+    from llama_index.core.base.embeddings.base import BaseEmbedding
+    from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+
+    class HashEmbedding(BaseEmbedding):
+        """Feature-hashed bag of words: cheap and deterministic, but still ranks related text together."""
+
+        def _embed(self, text):
+            vector = np.zeros(EMBED_DIM, dtype=np.float32)
+            for token in TOKEN.findall(text.lower()):
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+                vector[int.from_bytes(digest[:4], "little") % EMBED_DIM] += 1.0 if digest[4] & 1 else -1.0
+            norm = np.linalg.norm(vector)
+            return (vector / norm if norm else vector).tolist()
+
+        def _get_query_embedding(self, query):
+            return self._embed(query)
+
+        async def _aget_query_embedding(self, query):
+            return self._embed(query)
+
+        def _get_text_embedding(self, text):
+            return self._embed(text)
+
+    class StubLLM(CustomLLM):
+        """Streams a fixed answer; its plans never parse, so every question takes the RAG path."""
+
+        tokens: int = 32
+
+        @property
+        def metadata(self):
+            return LLMMetadata(model_name="stub")
+
+        def complete(self, prompt, formatted=False, **kwargs):
+            return CompletionResponse(text=" ".join(["answer"] * self.tokens))
+
+        def stream_complete(self, prompt, formatted=False, **kwargs):
+            def gen():
+                text = ""
+                for _ in range(self.tokens):
+                    text += "answer "
+                    yield CompletionResponse(text=text, delta="answer ")
+            return gen()
+
+    return HashEmbedding(model_name="hash", embed_batch_size=64), StubLLM(tokens=answer_tokens)
+
+
+def run_case(fmt, rows, data_dir, repeats, answer_tokens):
+    from llama_index.core import Settings
+
+    from engine_cache import EngineCache
+    from index_store import IndexStore, index_key, lineage
+    from indexing import IndexJob
+    from pipeline import PARSER_SETTINGS, build_engine
+    from table_store import TableStore
+
+    start = time.perf_counter()
+    path = synthetic_file(data_dir, fmt, rows)
+    generate_s = time.perf_counter() - start
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    file_name = os.path.basename(path)
+
+    embed_model, llm = stub_models(answer_tokens)
+    Settings.llm = llm
+    key = index_key(file_bytes, PARSER_SETTINGS, "hash")
+    result = {"format": fmt, "rows": rows, "file_mb": len(file_bytes) / (1024 * 1024), "generate_s": generate_s}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        table_store = TableStore(os.path.join(work_dir, "tables"))
+        index_store = IndexStore(os.path.join(work_dir, "indexes"))
+        engine_cache = EngineCache()
+
+        job = IndexJob(key, file_name)
+        start = time.perf_counter()
+        build_engine(job, file_name, file_bytes, key, lineage(PARSER_SETTINGS, "hash"), llm, embed_model, 512,
+                     index_store, table_store, engine_cache, None)
+        result["ingest_s"] = time.perf_counter() - start
+        result["nodes"] = job.total
+        query_engine, sheets = engine_cache.get(key)
+        result["sheet_timings"] = {str(sheet.name): sheet.timings for sheet in sheets}
+        result["resident_mb"] = engine_cache.stats()["size_mb"]
+
+        # Same upload again with nothing resident: Parquet table + persisted index
+        job = IndexJob(key, file_name)
+        start = time.perf_counter()
+        build_engine(job, file_name, file_bytes, key, lineage(PARSER_SETTINGS, "hash"), llm, embed_model, 512,
+                     index_store, table_store, EngineCache(), None)
+        result["cached_reload_s"] = time.perf_counter() - start
+
+        retriever = query_engine.rag_engine.retriever
+        retrievals, queries = [], []
+        for _ in range(repeats):
+            for question in QUESTIONS:
+                start = time.perf_counter()
+                retriever.retrieve(question)
+                retrievals.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                "".join(query_engine.query(question).response_gen)
+                queries.append(time.perf_counter() - start)
+        result["retrieval"] = percentiles(retrievals)
+        result["query"] = percentiles(queries)
+
+    result["peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_SELF)
+    # Workbook sheets are parsed in worker processes
+    result["children_peak_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma-separated row counts")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="comma-separated: csv, xlsx")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "chat-with-excel-bench"),
+                        help="where synthetic files are generated (and reused across runs)")
+    parser.add_argument("--repeats", type=int, default=3, help="passes over the question set")
+    parser.add_argument("--answer-tokens", type=int, default=32, help="tokens streamed by the stub LLM")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    if args.case:
+        fmt, rows = args.case.split(":")
+        print(json.dumps(run_case(fmt, int(rows), args.data_dir, args.repeats, args.answer_tokens)))
+        return
+
+    results = []
+    for fmt in args.formats.split(","):
+        for rows in map(int, args.sizes.split(",")):
+            print(f"{fmt} {rows} rows...", flush=True)
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--case", f"{fmt}:{rows}", "--data-dir", args.data_dir,
+                 "--repeats", str(args.repeats), "--answer-tokens", str(args.answer_tokens)],
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                print(proc.stderr, file=sys.stderr)
+                results.append({"format": fmt, "rows": rows, "error": proc.stderr.strip().splitlines()[-1:]})
+                continue
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(
+                f"  ingest {result['ingest_s']:.1f}s, {result['nodes']} nodes, reload {result['cached_reload_s']:.1f}s, "
+                f"retrieval p50 {result['retrieval']['p50_ms']:.1f}ms, peak RSS {result['peak_rss_mb']:.0f}MB"
+            )
+            results.append(result)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "questions": QUESTIONS,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from llama_index.core import QueryBundle
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore
+
+from table_parser import row_group_starts
+
+# Whole identifier-like values (emails, SKUs, invoice numbers) and their alphanumeric parts.
+VALUE_TOKEN = re.compile(r"[\w][\w@.+\-/]*[\w]|\w")
+WORD_TOKEN = re.compile(r"\w+")
+# A query token that looks like an ID and is this rare is treated as an exact lookup.
+EXACT_MAX_ROWS = 20
+# "1", "2023", "2nd" or "10k" are not IDs: mixed tokens need this length, all-digit ones this many digits.
+ID_MIN_LENGTH = 4
+ID_MIN_DIGITS = 5
+EMAIL = re.compile(r"[^@\s]+@[^@\s]+\.\w+")
+
+
+def tokenize(text):
+    text = text.lower()
+    tokens = VALUE_TOKEN.findall(text)
+    return tokens + [word for word in WORD_TOKEN.findall(text) if word not in tokens]
+
+
+def looks_like_id(token):
+    """Emails, letter+digit codes (SKUs, "inv-2023-001") and long numbers."""
+    if EMAIL.fullmatch(token):
+        return True
+    digits = sum(ch.isdigit() for ch in token)
+    if any(ch.isalpha() for ch in token):
+        return digits > 0 and len(token) >= ID_MIN_LENGTH
+    return digits >= ID_MIN_DIGITS
+
+
+class CellIndex:
+    """Inverted index (token -> row ids) with BM25 scoring over the cell values of a table.
+
+    Postings are stored CSR-style in numpy arrays: the rows of token i are
+    rows[offsets[i]:offsets[i + 1]] with matching term frequencies, so the
+    index loads with np.load and scoring is a handful of vectorized ops.
+    Rows map to the node that holds them through `row_chunk` / `node_ids`.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, vocab, offsets, rows, tfs, row_lengths, row_chunk, node_ids=()):
+        self.vocab = vocab
+        self.token_ids = {token: i for i, token in enumerate(vocab)}
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.row_lengths = row_lengths
+        self.row_chunk = row_chunk
+        self.node_ids = list(node_ids)
+        self.avg_length = float(row_lengths.mean()) if len(row_lengths) else 1.0
+
+    @classmethod
+    def build(cls, df, rows_per_chunk):
+        """Tokenize every cell with vectorized pandas string ops and build the postings."""
+        pairs = []
+        for position in range(len(df.columns)):
+            # Positional row ids, whatever index the frame came with
+            values = df.iloc[:, position].reset_index(drop=True).dropna().astype(str).str.lower()
+            for pattern in (VALUE_TOKEN, WORD_TOKEN):
+                tokens = values.str.findall(pattern).explode().dropna()
+                pairs.append(pd.DataFrame({
+                    "row": tokens.index.to_numpy(dtype=np.int64), "column": position, "token": tokens.to_numpy(),
+                }))
+        pairs = pd.concat(pairs, ignore_index=True) if pairs else pd.DataFrame({"row": [], "column": [], "token": []})
+        # A value such as "ab12" matches both patterns; count it once per cell, so a token's
+        # term frequency in a row is the number of cells that hold it.
+        pairs = pairs.drop_duplicates()
+
+        codes, vocab = pd.factorize(pairs["token"])
+        counts = pd.DataFrame({"code": codes, "row": pairs["row"].to_numpy()}).value_counts().sort_index()
+        posting_codes = counts.index.get_level_values("code").to_numpy()
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_codes, minlength=len(vocab)), out=offsets[1:])
+
+        positions = np.arange(len(df))
+        starts = row_group_starts(df, rows_per_chunk)
+        row_lengths = np.bincount(pairs["row"].to_numpy(dtype=np.int64), minlength=len(df)).astype(np.int32)
+        return cls(
+            vocab=list(vocab),
+            offsets=offsets,
+            rows=counts.index.get_level_values("row").to_numpy(dtype=np.int32),
+            tfs=counts.to_numpy(dtype=np.float32),
+            row_lengths=row_lengths,
+            row_chunk=(np.searchsorted(starts, positions, side="right") - 1).astype(np.int32),
+        )
+
+    @classmethod
+    def merge(cls, parts, rows_per_chunk):
+        """Concatenate per-sheet indexes, in sheet order, into one over all rows and chunks."""
+        if not parts:
+            return cls.build(pd.DataFrame(), rows_per_chunk)
+        tokens, rows, tfs = [], [], []
+        row_offset = chunk_offset = 0
+        row_chunk = []
+        for part in parts:
+            codes = np.repeat(np.arange(len(part.vocab)), np.diff(part.offsets))
+            tokens.append(np.asarray(part.vocab, dtype=object)[codes])
+            rows.append(part.rows.astype(np.int64) + row_offset)
+            tfs.append(part.tfs)
+            row_chunk.append(part.row_chunk + chunk_offset)
+            row_offset += len(part.row_lengths)
+            chunk_offset += int(part.row_chunk.max()) + 1 if len(part.row_chunk) else 0
+
+        codes, vocab = pd.factorize(np.concatenate(tokens))
+        rows = np.concatenate(rows)
+        order = np.lexsort((rows, codes))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(vocab)), out=offsets[1:])
+        return cls(
+            vocab=list(vocab),
+            offsets=offsets,
+            rows=rows[order].astype(np.int32),
+            tfs=np.concatenate(tfs)[order],
+            row_lengths=np.concatenate([part.row_lengths for part in parts]),
+            row_chunk=np.concatenate(row_chunk).astype(np.int32),
+        )
+
+    def save(self, path):
+        np.savez(
+            os.path.join(path, "cell_index.npz"),
+            offsets=self.offsets, rows=self.rows, tfs=self.tfs,
+            row_lengths=self.row_lengths, row_chunk=self.row_chunk,
+        )
+        with open(os.path.join(path, "cell_index.json"), "w", encoding="utf-8") as f:
+            json.dump({"vocab": self.vocab, "node_ids": self.node_ids}, f)
+
+    @classmethod
+    def load(cls, path):
+        """Load the sidecar stored next to a persisted index, or None if there is none."""
+        if not os.path.exists(os.path.join(path, "cell_index.npz")):
+            return None
+        arrays = np.load(os.path.join(path, "cell_index.npz"))
+        with open(os.path.join(path, "cell_index.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(meta["vocab"], arrays["offsets"], arrays["rows"], arrays["tfs"],
+                   arrays["row_lengths"], arrays["row_chunk"], meta["node_ids"])
+
+    def is_exact(self, query):
+        """Whether search() would report an exact hit for query, without scoring anything."""
+        for token in set(tokenize(query)):
+            token_id = self.token_ids.get(token)
+            if token_id is not None and looks_like_id(token) and \
+                    self.offsets[token_id + 1] - self.offsets[token_id] <= EXACT_MAX_ROWS:
+                return True
+        return False
+
+    def search(self, query, top_k=5):
+        """Return ([(chunk position, score)], exact) for the best matching chunks.
+
+        `exact` is True when a rare identifier-like query token matched, in
+        which case the caller can skip dense retrieval entirely; only the
+        chunks holding such a token are returned then, not ones that merely
+        share common words with the query.
+        """
+        n_rows = len(self.row_lengths)
+        matched_rows, matched_scores = [], []
+        exact_rows = []
+        for token in set(tokenize(query)):
+            token_id = self.token_ids.get(token)
+            if token_id is None:
+                continue
+            start, end = self.offsets[token_id], self.offsets[token_id + 1]
+            rows, tfs = self.rows[start:end], self.tfs[start:end]
+            if looks_like_id(token) and len(rows) <= EXACT_MAX_ROWS:
+                exact_rows.append(rows)
+            idf = np.log(1 + (n_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.row_lengths[rows] / self.avg_length)
+            matched_rows.append(rows)
+            matched_scores.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+        if not matched_rows:
+            return [], False
+
+        rows = np.concatenate(matched_rows)
+        scores = np.concatenate(matched_scores)
+        row_ids, inverse = np.unique(rows, return_inverse=True)
+        row_scores = np.bincount(inverse, weights=scores)
+        # A chunk scores as well as its best row.
+        chunks, chunk_inverse = np.unique(self.row_chunk[row_ids], return_inverse=True)
+        chunk_scores = np.zeros(len(chunks))
+        np.maximum.at(chunk_scores, chunk_inverse, row_scores)
+        if exact_rows:
+            chunk_scores[~np.isin(chunks, self.row_chunk[np.concatenate(exact_rows)])] = -np.inf
+        best = np.argsort(-chunk_scores)[:top_k]
+        return [(int(chunks[i]), float(chunk_scores[i])) for i in best if chunk_scores[i] > -np.inf], bool(exact_rows)
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuses BM25 over cell values with dense vector retrieval (reciprocal rank fusion).
+
+    Exact identifier hits are answered from the inverted index alone, with no
+    query embedding round trip.
+    """
+
+    def __init__(self, index, cell_index, similarity_top_k=4, rrf_k=60):
+        super().__init__()
+        self.index = index
+        self.cell_index = cell_index
+        self.vector_retriever = index.as_retriever(similarity_top_k=similarity_top_k)
+        self.similarity_top_k = similarity_top_k
+        self.rrf_k = rrf_k
+
+    def _keyword_nodes(self, query):
+        hits, exact = self.cell_index.search(query, top_k=self.similarity_top_k)
+        node_ids = [self.cell_index.node_ids[chunk] for chunk, _ in hits]
+        nodes = self.index.docstore.get_nodes(node_ids)
+        return [NodeWithScore(node=node, score=score) for node, (_, score) in zip(nodes, hits)], exact
+
+    def _retrieve(self, query_bundle: QueryBundle):
+        keyword_hits, exact = self._keyword_nodes(query_bundle.query_str)
+        if exact:
+            return keyword_hits
+
+        fused = {}
+        for hits in (keyword_hits, self.vector_retriever.retrieve(query_bundle)):
+            for rank, hit in enumerate(hits):
+                entry = fused.setdefault(hit.node.node_id, [hit.node, 0.0])
+                entry[1] += 1.0 / (self.rrf_k + rank + 1)
+        ranked = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+        return [NodeWithScore(node=node, score=score) for node, score in ranked[:self.similarity_top_k]]
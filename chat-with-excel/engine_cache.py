@@ -0,0 +1,115 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+ENGINE_CACHE_MAX_MB = int(os.getenv("ENGINE_CACHE_MAX_MB", "4096"))
+# A float in a Python list: the float object plus the list slot pointing at it.
+PY_FLOAT_BYTES = sys.getsizeof(0.0) + 8
+
+
+def index_nbytes(index):
+    """Approximate resident size of a VectorStoreIndex: embeddings plus node texts."""
+    total = 0
+    embedding_dict = getattr(getattr(index.vector_store, "data", None), "embedding_dict", {})
+    for embedding in embedding_dict.values():
+        total += len(embedding) * PY_FLOAT_BYTES
+    for node in index.docstore.docs.values():
+        total += sys.getsizeof(node.get_content()) + sys.getsizeof(node.metadata)
+    return total
+
+
+def cell_index_nbytes(cell_index):
+    if cell_index is None:
+        return 0
+    arrays = (cell_index.offsets, cell_index.rows, cell_index.tfs, cell_index.row_lengths, cell_index.row_chunk)
+    # The vocab is held twice: the list and the token -> id dict.
+    return sum(a.nbytes for a in arrays) + 2 * sum(sys.getsizeof(token) for token in cell_index.vocab)
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+class Entry:
+    def __init__(self, value, nbytes, source_name):
+        self.value = value
+        self.nbytes = nbytes
+        self.source_name = source_name
+        self.created = time.time()
+        self.last_used = self.created
+        self.hits = 0
+        self.sessions = set()
+
+
+class EngineCache:
+    """Process-wide, memory-bounded LRU of loaded query engines, keyed by index key.
+
+    Sessions that upload identical content get the same key and therefore
+    share one in-memory index instead of loading a copy each. Entries are
+    evicted least recently used first once the summed size estimates exceed
+    max_bytes; the entry just inserted is always kept. An evicted engine is
+    freed as soon as no running script still holds it, and a later request
+    reloads it from the on-disk IndexStore. Streamlit runs sessions in
+    threads, so all access goes through a lock.
+    """
+
+    def __init__(self, max_bytes=ENGINE_CACHE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, session_id=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            entry.last_used = time.time()
+            entry.hits += 1
+            entry.sessions.add(session_id)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value, nbytes, source_name="", session_id=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = Entry(value, nbytes, source_name)
+            self.entries.move_to_end(key)
+            entry.sessions.add(session_id)
+            self._evict()
+            return entry.value
+
+    def _evict(self):
+        total = sum(entry.nbytes for entry in self.entries.values())
+        while len(self.entries) > 1 and total > self.max_bytes:
+            _, entry = self.entries.popitem(last=False)
+            total -= entry.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.evictions += len(self.entries)
+            self.entries.clear()
+
+    def resident(self):
+        """[(key, entry)] most recently used first, for the admin view."""
+        with self.lock:
+            return list(reversed(self.entries.items()))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "size_mb": sum(entry.nbytes for entry in self.entries.values()) / (1024 * 1024),
+                "max_mb": self.max_bytes / (1024 * 1024),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from llama_index.core import StorageContext, load_index_from_storage
+
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", os.path.expanduser("~/.cache/chat-with-excel/indexes"))
+INDEX_CACHE_MAX_MB = int(os.getenv("INDEX_CACHE_MAX_MB", "2048"))
+
+
+def index_key(file_bytes, parser_settings, embed_model_name):
+    """Content address of an index: same bytes + same parsing + same embeddings -> same index."""
+    digest = hashlib.sha256()
+    digest.update(file_bytes)
+    digest.update(json.dumps(parser_settings, sort_keys=True).encode("utf-8"))
+    digest.update(embed_model_name.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def lineage(parser_settings, embed_model_name):
+    """Entries with the same source name and lineage can share embeddings chunk by chunk."""
+    return f"{embed_model_name}|{json.dumps(parser_settings, sort_keys=True)}"
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class DiskCache:
+    """Directory-per-key on-disk cache with size-bounded LRU eviction.
+
+    Every entry is a directory named by its key, holding the payload files
+    plus a meta.json whose mtime records the last use. Subclasses write the
+    payload into a scratch directory and hand it to _commit.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def _meta_path(self, key):
+        return os.path.join(self._path(key), "meta.json")
+
+    def contains(self, key):
+        return os.path.exists(self._meta_path(key))
+
+    def _touch(self, key):
+        """Record a use of key; False (and a miss) if it is not stored."""
+        meta_path = self._meta_path(key)
+        if not os.path.exists(meta_path):
+            self.misses += 1
+            return False
+        os.utime(meta_path)
+        self.hits += 1
+        return True
+
+    def _scratch(self, key):
+        # Entries are written into a scratch directory and renamed, so a half-written entry is never loaded.
+        return f"{self._path(key)}.tmp-{uuid.uuid4().hex}"
+
+    def _commit(self, key, tmp_path, meta):
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({**meta, "created": time.time(), "bytes": dir_size(tmp_path)}, f)
+        try:
+            os.rename(tmp_path, self._path(key))
+        except OSError:
+            # Another session stored the same content first.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """[(key, meta)] with meta["bytes"] and meta["last_used"], least recently used first."""
+        entries = []
+        for key in os.listdir(self.root):
+            meta_path = self._meta_path(key)
+            if ".tmp-" in key or not os.path.exists(meta_path):
+                continue
+            meta = self.read_meta(key)
+            meta["last_used"] = os.path.getmtime(meta_path)
+            entries.append((key, meta))
+        entries.sort(key=lambda entry: entry[1]["last_used"])
+        return entries
+
+    def read_meta(self, key):
+        with open(self._meta_path(key)) as f:
+            return json.load(f)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(meta["bytes"] for _, meta in entries)
+        while entries and total > self.max_bytes:
+            key, meta = entries.pop(0)
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= meta["bytes"]
+            self.evictions += 1
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            "entries": len(entries),
+            "size_mb": sum(meta["bytes"] for _, meta in entries) / (1024 * 1024),
+            "max_mb": self.max_bytes / (1024 * 1024),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class IndexStore(DiskCache):
+    """Persisted VectorStoreIndexes (nodes + embeddings), plus sidecars such as the cell index."""
+
+    def __init__(self, root=INDEX_CACHE_DIR, max_bytes=INDEX_CACHE_MAX_MB * 1024 * 1024):
+        super().__init__(root, max_bytes)
+
+    def entry_path(self, key):
+        """Directory of a stored entry, for sidecar files saved next to the index."""
+        return self._path(key)
+
+    def load(self, key, embed_model=None):
+        """Return the stored index for key, or None on a miss; it embeds queries with embed_model."""
+        if not self._touch(key):
+            return None
+        storage_context = StorageContext.from_defaults(persist_dir=self._path(key))
+        return load_index_from_storage(storage_context, embed_model=embed_model)
+
+    def save(self, key, index, source_name="", sidecars=(), lineage=""):
+        if self.contains(key):
+            return
+        tmp_path = self._scratch(key)
+        index.storage_context.persist(persist_dir=tmp_path)
+        for sidecar in sidecars:
+            sidecar.save(tmp_path)
+        self._commit(key, tmp_path, {"source": source_name, "lineage": lineage})
+
+    def latest(self, source_name, lineage, exclude=None):
+        """Key of the newest stored version of a file (same name and lineage), or None."""
+        versions = [
+            (meta["created"], key) for key, meta in self.entries()
+            if key != exclude and meta.get("source") == source_name and meta.get("lineage") == lineage
+        ]
+        return max(versions)[1] if versions else None
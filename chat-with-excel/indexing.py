@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Finished jobs are kept this long so every session polling them sees the outcome.
+JOB_RETENTION_S = 3600
+
+
+class IndexJob:
+    """State of one background indexing run; written by the worker, polled by the UI."""
+
+    def __init__(self, key, source_name, upload_id=None):
+        self.key = key
+        self.source_name = source_name
+        self.upload_id = upload_id
+        self.status = "queued"
+        self.stage = "waiting for a worker"
+        self.total = 0
+        self.done = 0
+        self.reused = 0
+        self.removed = 0
+        self.summary = ""
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def running(self):
+        return self.status in ("queued", "running")
+
+    def progress(self):
+        return min(self.done / self.total, 1.0) if self.total else 0.0
+
+    def describe(self):
+        text = f"{self.source_name}: {self.stage}"
+        if self.total:
+            text += f" · {self.done}/{self.total} chunks"
+        if self.reused:
+            text += f", {self.reused} reused"
+        return text
+
+
+class IndexingJobs:
+    """Runs index builds on background threads so the Streamlit script never blocks on them.
+
+    There is at most one job per index key: sessions that upload the same
+    content while it is being indexed attach to the running job. A failed
+    job is kept, so its error is shown instead of retried on every rerun,
+    until the file is uploaded again (a different upload_id); a finished one
+    is replaced when asked again (its engine was evicted since).
+    """
+
+    def __init__(self, max_workers=1):
+        self.pool = ThreadPoolExecutor(max_workers, thread_name_prefix="indexing")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.jobs.get(key)
+
+    def submit(self, key, source_name, fn, *args, upload_id=None):
+        """Run fn(job, *args) in the background unless a job for key is running, or failed on this upload."""
+        with self.lock:
+            self._prune(time.time())
+            job = self.jobs.get(key)
+            if job is not None and (job.running or job.status == "failed" and job.upload_id == upload_id):
+                return job
+            job = self.jobs[key] = IndexJob(key, source_name, upload_id)
+        self.pool.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        job.status = "running"
+        job.started = time.time()
+        try:
+            fn(job, *args)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+
+    def _prune(self, now):
+        stale = [key for key, job in self.jobs.items() if job.finished and now - job.finished > JOB_RETENTION_S]
+        for key in stale:
+            del self.jobs[key]
@@ -0,0 +1,187 @@
+import csv
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from llama_index.core import VectorStoreIndex
+from llama_index.core.schema import MetadataMode
+
+from cell_index import CellIndex
+
+SNIFF_BYTES = 64 * 1024
+# Workbook bytes, handed to every worker process once by the pool initializer.
+_workbook_bytes = None
+
+
+def sniff_delimiter(sample):
+    """Detect the delimiter from the first lines of a CSV (comma, semicolon, tab or pipe)."""
+    # Only look at complete lines so a row cut in half does not confuse the sniffer.
+    if "\n" in sample:
+        sample = sample[:sample.rindex("\n")]
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        for delimiter in (',', ';', '\t'):
+            if delimiter in sample:
+                return delimiter
+    return None
+
+
+def read_csv(file_bytes):
+    """Parse a CSV upload exactly once.
+
+    Returns (df, None) on success or (None, error message) so the caller can
+    show why the file was rejected. The same frame is then reused for the
+    preview and for indexing.
+    """
+    try:
+        sample = file_bytes[:SNIFF_BYTES].decode('utf-8', errors='ignore')
+        if not sample.strip():
+            return None, "File is empty"
+
+        delimiter = sniff_delimiter(sample)
+        if delimiter is None:
+            return None, "Could not detect valid CSV delimiter (comma, semicolon, or tab)"
+
+        df = pd.read_csv(io.BytesIO(file_bytes), sep=delimiter, encoding='utf-8')
+        if df.empty:
+            return None, "File contains no data"
+        if len(df.columns) < 1:
+            return None, "No columns found in the file"
+        return df, None
+    except UnicodeDecodeError:
+        return None, "File encoding issue. Please save the file with UTF-8 encoding"
+    except pd.errors.EmptyDataError:
+        return None, "The file is empty"
+    except Exception as e:
+        return None, f"Error reading CSV: {str(e)}"
+
+
+class Sheet:
+    """One parsed sheet. nodes / cell_index are filled in when the sheet was chunked."""
+
+    def __init__(self, name, df, nodes=None, cell_index=None, timings=None):
+        self.name = name
+        self.df = df
+        self.nodes = nodes
+        self.cell_index = cell_index
+        self.timings = timings or {}
+
+
+def chunk_sheet(sheet, parser, file_name):
+    """Render the row-group nodes and the cell index of a parsed sheet."""
+    start = time.perf_counter()
+    sheet.nodes = list(parser.iter_nodes(sheet.df, file_name, sheet.name))
+    chunked = time.perf_counter()
+    sheet.cell_index = CellIndex.build(sheet.df, parser.rows_per_chunk)
+    sheet.timings["chunk"] = chunked - start
+    sheet.timings["cell_index"] = time.perf_counter() - chunked
+    return sheet
+
+
+def _init_worker(file_bytes):
+    global _workbook_bytes
+    _workbook_bytes = file_bytes
+
+
+def _ingest_sheet(sheet_name, parser, file_name):
+    start = time.perf_counter()
+    df = pd.read_excel(io.BytesIO(_workbook_bytes), sheet_name=sheet_name)
+    sheet = Sheet(sheet_name, df, timings={"parse": time.perf_counter() - start})
+    if parser is not None:
+        chunk_sheet(sheet, parser, file_name)
+    return sheet
+
+
+def read_workbook(file_bytes, file_name, parser=None, max_workers=None):
+    """Parse every sheet of a workbook in a process pool; returns [Sheet] in workbook order.
+
+    openpyxl is single-threaded, so each worker parses one sheet (read-only
+    mode only inflates that sheet's XML). With a parser, the workers also
+    render the sheet's nodes and cell index, which is most of the CPU time
+    before embedding. Empty sheets are dropped.
+    """
+    sheet_names = pd.ExcelFile(io.BytesIO(file_bytes)).sheet_names
+    max_workers = min(len(sheet_names), max_workers or os.cpu_count() or 1)
+    if max_workers <= 1:
+        _init_worker(file_bytes)
+        try:
+            sheets = [_ingest_sheet(name, parser, file_name) for name in sheet_names]
+        finally:
+            _init_worker(None)
+    else:
+        # spawn, not fork: the Streamlit server process is multithreaded
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers, mp_context=context, initializer=_init_worker, initargs=(file_bytes,)) as pool:
+            futures = [pool.submit(_ingest_sheet, name, parser, file_name) for name in sheet_names]
+            sheets = [future.result() for future in futures]
+    return [sheet for sheet in sheets if not sheet.df.empty]
+
+
+def iter_sheet_nodes(sheets, parser, file_name):
+    """Nodes of all sheets in order; sheets that were not chunked up front are rendered lazily."""
+    for sheet in sheets:
+        if sheet.nodes is not None:
+            yield from sheet.nodes
+        else:
+            yield from parser.iter_nodes(sheet.df, file_name, sheet.name)
+
+
+def merged_cell_index(sheets, parser):
+    parts = [
+        sheet.cell_index if sheet.cell_index is not None else CellIndex.build(sheet.df, parser.rows_per_chunk)
+        for sheet in sheets
+    ]
+    return parts[0] if len(parts) == 1 else CellIndex.merge(parts, parser.rows_per_chunk)
+
+
+def chunk_hash(node):
+    """Hash of exactly what gets embedded; equal hashes can share an embedding."""
+    return hashlib.sha256(node.get_content(metadata_mode=MetadataMode.EMBED).encode("utf-8")).hexdigest()
+
+
+def reusable_embeddings(index):
+    """{chunk hash: embedding} for every node of an existing index."""
+    return {
+        chunk_hash(node): index.vector_store.get(node_id)
+        for node_id, node in index.docstore.docs.items()
+    }
+
+
+def build_index(nodes, insert_batch_size=512, reuse=None, progress=None, embed_model=None):
+    """Embed and insert nodes from any iterable in batches; returns (index, node_ids in order).
+
+    Consuming a generator this way means only one batch of node texts is
+    alive at a time. `reuse` maps chunk hashes to embeddings from a
+    previous version of the file: those nodes get the stored vector and are
+    skipped by the embedding model. `progress(inserted, reused)` is called
+    after every batch. `embed_model` is passed explicitly rather than taken
+    from the global Settings, which other sessions may change meanwhile.
+    """
+    index = VectorStoreIndex(nodes=[], embed_model=embed_model)
+    reuse = reuse or {}
+    batch = []
+    node_ids = []
+    reused = 0
+    for node in nodes:
+        embedding = reuse.get(chunk_hash(node)) if reuse else None
+        if embedding is not None:
+            # VectorStoreIndex only embeds nodes that have no embedding yet
+            node.embedding = embedding
+            reused += 1
+        batch.append(node)
+        node_ids.append(node.node_id)
+        if len(batch) >= insert_batch_size:
+            index.insert_nodes(batch)
+            batch = []
+            if progress:
+                progress(len(node_ids), reused)
+    if batch:
+        index.insert_nodes(batch)
+    if progress:
+        progress(len(node_ids), reused)
+    return index, node_ids
@@ -1,198 +1,264 @@
-import os
-
 import gc
-import tempfile
+import time
 import uuid
+from functools import partial
+
 import pandas as pd
 
 from llama_index.core import Settings
 from llama_index.llms.ollama import Ollama
-from llama_index.core import PromptTemplate
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader
-from llama_index.readers.docling import DoclingReader
-from llama_index.core.node_parser import MarkdownNodeParser
+
+from answer_cache import AnswerCache, replay
+from engine_cache import EngineCache
+from index_store import IndexStore, index_key, lineage
+from indexing import IndexingJobs
+from pipeline import PARSER_SETTINGS, build_engine
+from query_router import RoutedResponse
+from streaming import render_stream
+from table_store import TableStore, table_key
 
 import streamlit as st
 
 if "id" not in st.session_state:
     st.session_state.id = uuid.uuid4()
-    st.session_state.file_cache = {}
 
 session_id = st.session_state.id
 client = None
 
+EMBED_MODEL_NAME = "BAAI/bge-large-en-v1.5"
+ONNX_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+PREVIEW_PAGE_ROWS = 100
+
 @st.cache_resource
 def load_llm():
     llm = Ollama(model="llama3.2", request_timeout=120.0)
     return llm
 
+@st.cache_resource
+def load_embed_model(batch_size=32, num_threads=0, backend="torch"):
+    """Load the embedding model once per process (per settings), not per upload.
+
+    backend="onnx" / "onnx-int8" run the model through ONNX Runtime on CPU
+    (the int8 variant loads the quantized export named by ONNX_INT8_FILE),
+    which is usually several times faster than torch on CPU-only machines.
+    """
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+    kwargs = {}
+    if backend == "onnx-int8":
+        kwargs = {"backend": "onnx", "model_kwargs": {"file_name": ONNX_INT8_FILE}, "device": "cpu"}
+    elif backend == "onnx":
+        kwargs = {"backend": "onnx", "device": "cpu"}
+    return HuggingFaceEmbedding(
+        model_name=EMBED_MODEL_NAME,
+        trust_remote_code=True,
+        embed_batch_size=batch_size,
+        **kwargs,
+    )
+
+@st.cache_resource
+def get_index_store():
+    return IndexStore()
+
+@st.cache_resource
+def get_table_store():
+    return TableStore()
+
+@st.cache_resource
+def get_engine_cache():
+    # One per process: sessions share loaded indexes instead of each keeping its own copy.
+    return EngineCache()
+
+@st.cache_resource
+def get_answer_cache():
+    return AnswerCache()
+
+@st.cache_resource
+def get_indexing_jobs():
+    return IndexingJobs()
+
+def answer_question(question, file_key, query_engine, embed_model):
+    """Replay a cached answer to the same (or a near-identical) question, else ask the router.
+
+    The question is only embedded once it is headed for dense retrieval:
+    dataframe answers and exact ID lookups never touch the embedding model.
+    Returns (response, embedding); embedding is the query embedding the
+    answer should be stored under, or None for an answer stored for exact
+    repeats only, or a cache hit.
+    """
+    answer_cache = get_answer_cache()
+    entry, similarity = answer_cache.lookup_text(file_key, question)
+    if entry is None:
+        routed = query_engine.query_dataframe(question)
+        if routed is not None:
+            return routed, None
+        if query_engine.is_exact_lookup(question):
+            return query_engine.query_rag(question), None
+        embedding = embed_model.get_query_embedding(question)
+        entry, similarity = answer_cache.lookup(file_key, question, embedding)
+        if entry is None:
+            # Retrieval reuses the embedding computed for the lookup
+            return query_engine.query_rag(question, embedding), embedding
+    return RoutedResponse("cache", replay(entry.answer), f"similarity {similarity:.3f} to an earlier {entry.path} answer"), None
+
 def reset_chat():
     st.session_state.messages = []
     st.session_state.context = None
     gc.collect()
 
 
-def display_excel(file):
+def display_excel(sheet_rows, read_page):
+    """Paged preview: only the visible page of rows is read and sent to the browser.
+
+    sheet_rows is [(sheet name, row count)]; read_page(position, start, count)
+    returns those rows of one sheet.
+    """
     st.markdown("### File Preview")
-    # Read the file based on its type
-    if file.name.endswith(('.xlsx', '.xls')):
-        df = pd.read_excel(file)
-    else:  # CSV file
-        df = pd.read_csv(file)
+    position = 0
+    if len(sheet_rows) > 1:
+        names = [name for name, _ in sheet_rows]
+        position = names.index(st.selectbox("Sheet", names))
+    total = sheet_rows[position][1]
+    pages = max(-(-total // PREVIEW_PAGE_ROWS), 1)
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+    start = (page - 1) * PREVIEW_PAGE_ROWS
+    rows = read_page(position, start, PREVIEW_PAGE_ROWS)
+    rows.index = range(start + 1, start + 1 + len(rows))
     # Display the dataframe
-    st.dataframe(df)
-
-def validate_csv(file):
-    try:
-        # Try to read the first few lines to detect the delimiter
-        sample = file.read(1024).decode('utf-8')
-        file.seek(0)  # Reset file pointer
-        
-        if not sample.strip():
-            return False, "File is empty"
-            
-        # Detect delimiter
-        if ',' in sample:
-            delimiter = ','
-        elif ';' in sample:
-            delimiter = ';'
-        elif '\t' in sample:
-            delimiter = '\t'
-        else:
-            return False, "Could not detect valid CSV delimiter (comma, semicolon, or tab)"
-            
-        # Try reading with detected delimiter
-        df = pd.read_csv(file, delimiter=delimiter)
-        
-        if df.empty:
-            return False, "File contains no data"
-        if len(df.columns) < 1:
-            return False, "No columns found in the file"
-            
-        return True, None
-    except UnicodeDecodeError:
-        return False, "File encoding issue. Please save the file with UTF-8 encoding"
-    except pd.errors.EmptyDataError:
-        return False, "The file is empty"
-    except Exception as e:
-        return False, f"Error reading CSV: {str(e)}"
-
-def process_file(file_path):
-    """Process file based on its extension"""
-    if file_path.endswith('.csv'):
-        try:
-            # Try different delimiters
-            delimiters = [',', ';', '\t']
-            df = None
-            
-            for delimiter in delimiters:
-                try:
-                    df = pd.read_csv(file_path, delimiter=delimiter)
-                    if not df.empty and len(df.columns) > 1:
-                        break
-                except:
-                    continue
-                    
-            if df is None or df.empty:
-                raise Exception("Could not read CSV file with any standard delimiter")
-                
-            # Convert DataFrame to markdown for DoclingReader
-            markdown_content = df.to_markdown()
-            with open(file_path + '.md', 'w', encoding='utf-8') as f:
-                f.write(markdown_content)
-            return file_path + '.md'
-        except Exception as e:
-            raise Exception(f"Error processing CSV file: {str(e)}")
-    return file_path
+    st.dataframe(rows)
+    st.caption(f"Rows {start + 1}-{start + len(rows)} of {total}")
+
+def frame_page(sheets, position, start, count):
+    return sheets[position].df.iloc[start:start + count].copy()
+
+def display_sheet_timings(sheets):
+    """Per-sheet parse/chunk times, slowest first, so outlier sheets stand out."""
+    rows = [{"sheet": s.name or "-", "rows": len(s.df), **s.timings} for s in sheets]
+    timings = pd.DataFrame(rows).fillna(0.0)
+    timings["total"] = timings.drop(columns=["sheet", "rows"]).sum(axis=1)
+    st.dataframe(timings.sort_values("total", ascending=False), hide_index=True)
+
+@st.fragment(run_every=1.0)
+def display_job_progress(job):
+    """Polls a background indexing job and reruns the app once it has finished."""
+    if not job.running:
+        st.rerun()
+    st.progress(job.progress(), text=job.describe())
+
+def display_answer_metrics(metrics):
+    with st.expander("Answer timing"):
+        cols = st.columns(4)
+        cols[0].metric("Retrieval / routing", f"{metrics['retrieval_s']:.2f}s")
+        cols[1].metric("First token", f"{metrics['ttft_s']:.2f}s")
+        cols[2].metric("Generation", f"{metrics['generation_s']:.2f}s")
+        cols[3].metric("Tokens/s", f"{metrics['tokens_per_s']:.1f}")
+        st.caption(f"{metrics['tokens']} tokens streamed in {metrics['renders']} renders")
+
+def display_resident(engine_cache):
+    """Admin view: what is loaded in this process, most recently used first."""
+    stats = engine_cache.stats()
+    st.write(
+        f"{stats['entries']} resident, {stats['size_mb']:.1f} / {stats['max_mb']:.0f} MB · "
+        f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions"
+    )
+    now = time.time()
+    rows = [
+        {
+            "file": entry.source_name,
+            "key": key[:12],
+            "MB": round(entry.nbytes / (1024 * 1024), 1),
+            "sessions": len(entry.sessions),
+            "hits": entry.hits,
+            "idle (s)": int(now - entry.last_used),
+        }
+        for key, entry in engine_cache.resident()
+    ]
+    if rows:
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+    if st.button("Evict all"):
+        engine_cache.clear()
+        gc.collect()
 
 with st.sidebar:
     st.header(f"Add your documents!")
     
     uploaded_file = st.file_uploader("Choose your `.xlsx` or `.csv` file", type=["xlsx", "xls", "csv"])
 
+    with st.expander("Indexing settings"):
+        embed_batch_size = st.number_input("Embedding batch size", min_value=1, max_value=1024, value=32)
+        embed_threads = st.number_input("Embedding threads (0 = default)", min_value=0, max_value=64, value=0)
+        embed_backend = st.selectbox("Embedding backend", ["torch", "onnx", "onnx-int8"])
+
+    with st.expander("Index cache"):
+        cache_stats = get_index_store().stats()
+        st.write(
+            f"{cache_stats['entries']} indexes, {cache_stats['size_mb']:.1f} / {cache_stats['max_mb']:.0f} MB · "
+            f"{cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['evictions']} evictions"
+        )
+        table_stats = get_table_store().stats()
+        st.write(f"{table_stats['entries']} parsed uploads (Parquet), {table_stats['size_mb']:.1f} / {table_stats['max_mb']:.0f} MB")
+
+    with st.expander("Answer cache"):
+        answer_stats = get_answer_cache().stats()
+        st.write(
+            f"{answer_stats['entries']} answers · {answer_stats['hits']} hits, {answer_stats['misses']} misses "
+            f"({answer_stats['hit_rate']:.0%} hit rate)"
+        )
+
+    with st.expander("Resident indexes"):
+        display_resident(get_engine_cache())
+
+    query_engine = None
     if uploaded_file:
         try:
-            # Validate CSV files before processing
-            if uploaded_file.name.endswith('.csv'):
-                is_valid, error_message = validate_csv(uploaded_file)
-                if not is_valid:
-                    st.error(f"Invalid CSV file: {error_message}")
-                    st.stop()
-
-            with tempfile.TemporaryDirectory() as temp_dir:
-                file_path = os.path.join(temp_dir, uploaded_file.name)
-                
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getvalue())
-                
-                file_key = f"{session_id}-{uploaded_file.name}"
-                st.write("Indexing your document...")
-
-                if file_key not in st.session_state.get('file_cache', {}):
-                    if os.path.exists(temp_dir):
-                        try:
-                            # Process the file if needed
-                            processed_file_path = process_file(file_path)
-                            
-                            reader = DoclingReader()
-                            loader = SimpleDirectoryReader(
-                                input_dir=temp_dir,
-                                file_extractor={
-                                    ".xlsx": reader,
-                                    ".xls": reader,
-                                    ".csv": reader,
-                                    ".md": reader  # Add support for processed markdown files
-                                },
-                            )
-                            docs = loader.load_data()
-                            
-                            if not docs:
-                                raise Exception("No documents were loaded. The file might be empty or in an unsupported format.")
-                            
-                        except Exception as e:
-                            st.error(f"Error processing document: {str(e)}")
-                            st.error("Please make sure your file is properly formatted and not empty.")
-                            st.stop()
-                    else:    
-                        st.error('Could not find the file you uploaded, please check again...')
-                        st.stop()
-                    
-                    # setup llm & embedding model
-                    llm=load_llm()
-                    embed_model = HuggingFaceEmbedding( model_name="BAAI/bge-large-en-v1.5", trust_remote_code=True)
-                    # Creating an index over loaded data
-                    Settings.embed_model = embed_model
-                    node_parser = MarkdownNodeParser()
-                    index = VectorStoreIndex.from_documents(documents=docs, transformations=[node_parser], show_progress=True)
-
-                    # Create the query engine, where we use a cohere reranker on the fetched nodes
-                    Settings.llm = llm
-                    query_engine = index.as_query_engine(streaming=True)
-
-                    # ====== Customise prompt template ======
-                    qa_prompt_tmpl_str = (
-                    "Context information is below.\n"
-                    "---------------------\n"
-                    "{context_str}\n"
-                    "---------------------\n"
-                    "Given the context information above I want you to think step by step to answer the query in a highly precise and crisp manner focused on the final answer, incase case you don't know the answer say 'I don't know!'.\n"
-                    "Query: {query_str}\n"
-                    "Answer: "
-                    )
-                    qa_prompt_tmpl = PromptTemplate(qa_prompt_tmpl_str)
-
-                    query_engine.update_prompts(
-                        {"response_synthesizer:text_qa_template": qa_prompt_tmpl}
-                    )
-                    
-                    st.session_state.file_cache[file_key] = query_engine
-                else:
-                    query_engine = st.session_state.file_cache[file_key]
+            file_bytes = uploaded_file.getvalue()
+            embed_id = f"{EMBED_MODEL_NAME}:{embed_backend}"
+            # Same content + parser settings + embedding model -> same index, whatever the file is called.
+            file_key = index_key(file_bytes, PARSER_SETTINGS, embed_id)
+            engine_cache = get_engine_cache()
+            cached = engine_cache.get(file_key, session_id)
+            if cached is None:
+                # setup llm & embedding model
+                llm=load_llm()
+                embed_model = load_embed_model(embed_batch_size, embed_threads, embed_backend)
+                # The indexing job gets embed_model explicitly: Settings is shared with every other session
+                Settings.llm = llm
 
+                # Indexing runs in the background; the previous file stays available for chat meanwhile
+                jobs = get_indexing_jobs()
+                job = jobs.submit(
+                    file_key, uploaded_file.name, build_engine,
+                    uploaded_file.name, file_bytes, file_key, lineage(PARSER_SETTINGS, embed_id), llm, embed_model,
+                    max(embed_batch_size * 16, 512), get_index_store(), get_table_store(), engine_cache, session_id,
+                    upload_id=uploaded_file.file_id,
+                )
+                if job.status == "failed":
+                    # Shown until the file is uploaded again, which starts a new job
+                    raise RuntimeError(job.error)
+                if job.status == "done":
+                    cached = engine_cache.get(file_key, session_id)
+                if cached is None:
+                    st.write("Indexing your document...")
+                    display_job_progress(job)
+                    # The parsed upload is on disk as soon as parsing is done; preview it from there
+                    upload_key = table_key(uploaded_file.name, file_bytes)
+                    table_store = get_table_store()
+                    if table_store.contains(upload_key):
+                        display_excel(table_store.sheet_rows(upload_key), partial(table_store.read_page, upload_key))
+
+            if cached is not None:
+                st.session_state.chat_key = file_key
+                query_engine, sheets = cached
                 # Inform the user that the file is processed and Display the PDF uploaded
                 st.success("Ready to Chat!")
-                display_excel(uploaded_file)
+                job = get_indexing_jobs().get(file_key)
+                if job is not None and job.summary:
+                    st.caption(job.summary)
+                with st.expander(f"Sheet timings ({len(sheets)} sheets)"):
+                    display_sheet_timings(sheets)
+                display_excel([(sheet.name, len(sheet.df)) for sheet in sheets], partial(frame_page, sheets))
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
             if "Input document" in str(e):
@@ -203,10 +269,19 @@ with st.sidebar:
             st.error("3. Try saving the CSV file with UTF-8 encoding")
             st.stop()     
 
+    # Until a new upload is indexed, keep chatting over the last file that was ready
+    chat_key = st.session_state.get("chat_key")
+    if query_engine is None and chat_key is not None:
+        cached = get_engine_cache().get(chat_key, session_id)
+        if cached is not None:
+            query_engine = cached[0]
+            if uploaded_file:
+                st.info("Answering from the previous version until indexing finishes")
+
 col1, col2 = st.columns([6, 1])
 
 with col1:
-    st.header(f"RAG over Excel using Dockling 🐥 &  Llama-3.2")
+    st.header(f"RAG over Excel 🐥 &  Llama-3.2")
 
 with col2:
     st.button("Clear ↺", on_click=reset_chat)
@@ -220,10 +295,12 @@ if "messages" not in st.session_state:
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if message.get("metrics"):
+            display_answer_metrics(message["metrics"])
 
 
 # Accept user input
-if prompt := st.chat_input("What's up?"):
+if prompt := st.chat_input("What's up?", disabled=query_engine is None):
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": prompt})
     # Display user message in chat message container
@@ -233,19 +310,19 @@ if prompt := st.chat_input("What's up?"):
     # Display assistant response in chat message container
     with st.chat_message("assistant"):
         message_placeholder = st.empty()
-        full_response = ""
-        
-        # Simulate stream of response with milliseconds delay
-        streaming_response = query_engine.query(prompt)
-        
-        for chunk in streaming_response.response_gen:
-            full_response += chunk
-            message_placeholder.markdown(full_response + "▌")
-
-        # full_response = query_engine.query(prompt)
-
-        message_placeholder.markdown(full_response)
+
+        start = time.perf_counter()
+        embed_model = load_embed_model(embed_batch_size, embed_threads, embed_backend)
+        streaming_response, query_embedding = answer_question(prompt, chat_key, query_engine, embed_model)
+        # Chunks are coalesced so the growing answer is not re-sent on every token
+        full_response, metrics = render_stream(streaming_response.response_gen, message_placeholder, start, time.perf_counter())
+
+        detail = f" · {streaming_response.detail}" if streaming_response.detail else ""
+        st.caption(f"Answered via {streaming_response.path} in {time.perf_counter() - start:.2f}s{detail}")
+        if streaming_response.path != "cache":
+            get_answer_cache().store(chat_key, prompt, query_embedding, full_response, streaming_response.path, streaming_response.detail)
+        display_answer_metrics(metrics)
         # st.session_state.context = ctx
 
     # Add assistant response to chat history
-    st.session_state.messages.append({"role": "assistant", "content": full_response})
\ No newline at end of file
+    st.session_state.messages.append({"role": "assistant", "content": full_response, "metrics": metrics})
\ No newline at end of file
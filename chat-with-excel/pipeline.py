@@ -0,0 +1,131 @@
+import time
+
+from llama_index.core import PromptTemplate
+from llama_index.core.query_engine import RetrieverQueryEngine
+
+from cell_index import CellIndex, HybridRetriever
+from engine_cache import cell_index_nbytes, frame_nbytes, index_nbytes
+from ingestion import (
+    Sheet, build_index, chunk_hash, iter_sheet_nodes, merged_cell_index, read_csv, read_workbook, reusable_embeddings,
+)
+from query_router import QueryRouter
+from table_parser import TableNodeParser, row_group_starts
+from table_store import table_key
+
+TABLE_PARSER = TableNodeParser()
+# Part of the persisted index key: change it whenever parsing or chunking changes.
+PARSER_SETTINGS = {**TABLE_PARSER.settings(), "workbook": "all-sheets"}
+
+
+def build_query_engine(index, cell_index=None):
+    # Hybrid BM25 + vector retrieval when the cell index is available
+    if cell_index is not None:
+        query_engine = RetrieverQueryEngine.from_args(HybridRetriever(index, cell_index), streaming=True)
+    else:
+        query_engine = index.as_query_engine(streaming=True)
+
+    # ====== Customise prompt template ======
+    qa_prompt_tmpl_str = (
+    "Context information is below.\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "Given the context information above I want you to think step by step to answer the query in a highly precise and crisp manner focused on the final answer, incase case you don't know the answer say 'I don't know!'.\n"
+    "Query: {query_str}\n"
+    "Answer: "
+    )
+    qa_prompt_tmpl = PromptTemplate(qa_prompt_tmpl_str)
+
+    query_engine.update_prompts(
+        {"response_synthesizer:text_qa_template": qa_prompt_tmpl}
+    )
+    return query_engine
+
+
+def parse_upload(file_name, file_bytes, table_store, parser=None):
+    """Parse the upload once; validation, preview, indexing and pandas queries all reuse the same sheets.
+
+    Parsed uploads are kept as Parquet by content hash, so the same bytes
+    are never parsed twice. Workbooks are parsed one sheet per worker
+    process; with a parser the workers also chunk the sheets, which is only
+    worth it when the index has to be built. Raises ValueError for files
+    that cannot be used.
+    """
+    key = table_key(file_name, file_bytes)
+    sheets = table_store.load(key)
+    if sheets is not None:
+        return sheets
+    if file_name.endswith('.csv'):
+        start = time.perf_counter()
+        df, error_message = read_csv(file_bytes)
+        if df is None:
+            raise ValueError(f"Invalid CSV file: {error_message}")
+        sheets = [Sheet(None, df, timings={"parse": time.perf_counter() - start})]
+    else:
+        sheets = read_workbook(file_bytes, file_name, parser)
+        if not sheets:
+            raise ValueError("The workbook has no data in any sheet")
+    table_store.save(key, sheets, file_name)
+    return sheets
+
+
+def build_engine(job, file_name, file_bytes, file_key, file_lineage, llm, embed_model, insert_batch_size, index_store, table_store,
+                 engine_cache, session_id):
+    """Background job: parse, load or build the index, then publish the query engine.
+
+    Runs on an indexing thread, so it reports through `job` and never calls
+    st.*. A new version of a file reuses the embeddings of every unchanged
+    row group of the previous version and only embeds the rest.
+    """
+    job.stage = "parsing"
+    needs_build = not index_store.contains(file_key)
+    sheets = parse_upload(file_name, file_bytes, table_store, TABLE_PARSER if needs_build else None)
+    index = None if needs_build else index_store.load(file_key, embed_model)
+    if index is not None:
+        cell_index = CellIndex.load(index_store.entry_path(file_key))
+        job.summary = "Loaded the index from the on-disk cache"
+    else:
+        reuse = {}
+        previous_key = index_store.latest(file_name, file_lineage, exclude=file_key)
+        if previous_key is not None:
+            job.stage = "reading the previous version"
+            previous = index_store.load(previous_key, embed_model)
+            if previous is not None:
+                reuse = reusable_embeddings(previous)
+
+        def progress(done, reused):
+            job.done, job.reused = done, reused
+
+        job.stage = "embedding"
+        job.total = sum(len(row_group_starts(sheet.df, TABLE_PARSER.rows_per_chunk)) for sheet in sheets)
+        # Row groups are rendered and embedded batch by batch, straight from the parsed frames
+        start = time.perf_counter()
+        index, node_ids = build_index(
+            iter_sheet_nodes(sheets, TABLE_PARSER, file_name),
+            insert_batch_size=insert_batch_size,
+            reuse=reuse,
+            progress=progress,
+            embed_model=embed_model,
+        )
+        elapsed = time.perf_counter() - start
+        embedded = len(node_ids) - job.reused
+        job.summary = f"Embedded {embedded} nodes in {elapsed:.1f}s ({embedded / max(elapsed, 1e-9):.1f} nodes/s)"
+        if reuse:
+            job.removed = len(set(reuse) - {chunk_hash(node) for node in index.docstore.docs.values()})
+            job.summary += f"; reused {job.reused} unchanged chunks, dropped {job.removed} removed ones"
+
+        job.stage = "saving"
+        # Exact-value lookups (IDs, SKUs, emails) go through an inverted index over the cells
+        cell_index = merged_cell_index(sheets, TABLE_PARSER)
+        cell_index.node_ids = node_ids
+        index_store.save(file_key, index, file_name, sidecars=[cell_index], lineage=file_lineage)
+        for sheet in sheets:
+            # The index owns the nodes now
+            sheet.nodes = sheet.cell_index = None
+
+    # Aggregate questions are answered with pandas over the sheets, the rest through RAG
+    tables = {sheet.name: sheet.df for sheet in sheets}
+    query_engine = QueryRouter(tables, build_query_engine(index, cell_index), llm, cell_index)
+    nbytes = index_nbytes(index) + cell_index_nbytes(cell_index) + sum(frame_nbytes(s.df) for s in sheets)
+    engine_cache.put(file_key, (query_engine, sheets), nbytes, file_name, session_id)
+    job.stage = "ready"
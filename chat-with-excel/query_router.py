@@ -0,0 +1,249 @@
+import json
+import operator
+import re
+import time
+
+import numpy as np
+import pandas as pd
+from llama_index.core import QueryBundle
+
+# Questions that smell like filtering / counting / aggregating over the whole sheet.
+# Phrases only: bare "by", "per", "max" or "min" also appear in plain lookups, which
+# would then wait on a plan completion before RAG runs.
+TABULAR_HINTS = re.compile(
+    r"\b(how many|count|number of|total|sum|average|avg|mean|median|maximum|minimum|"
+    r"highest|lowest|largest|smallest|top \d+|bottom \d+|(grouped|broken down|split|sorted) by|group by|"
+    r"for each|per (each|every)|distinct|unique|rows? (where|with))\b",
+    re.IGNORECASE,
+)
+
+COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+AGGREGATES = {"count", "sum", "mean", "median", "min", "max", "nunique", "rows"}
+MAX_LIMIT = 100
+
+PLAN_PROMPT = (
+    "You turn questions about a table into a JSON query plan.\n"
+    "{tables}"
+    "Reply with JSON only, using this shape:\n"
+    '{{{sheet_field}"filters": [{{"column": "<column>", "op": "==|!=|>|>=|<|<=|contains|in", "value": <value>}}], '
+    '"group_by": ["<column>"], "aggregate": {{"func": "count|sum|mean|median|min|max|nunique|rows", "column": "<column or null>"}}, '
+    '"sort": "desc|asc", "limit": <number>}}\n'
+    'If the question cannot be answered by filtering, grouping and aggregating the table, reply {{"route": "rag"}}.\n'
+    "Question: {question}\n"
+    "JSON: "
+)
+TABLE_PROMPT = (
+    "Columns and dtypes:\n"
+    "{columns}\n"
+    "Sample rows:\n"
+    "{sample}\n"
+)
+
+
+class PlanError(ValueError):
+    pass
+
+
+class RoutedResponse:
+    """What the chat UI consumes: which path answered, and a generator of answer text."""
+
+    def __init__(self, path, response_gen, detail=""):
+        self.path = path
+        self.response_gen = response_gen
+        self.detail = detail
+
+
+def parse_plan(text):
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise PlanError("no JSON object in the model output")
+    try:
+        return json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise PlanError(f"invalid JSON plan: {e}")
+
+
+def validate_plan(plan):
+    """Reject plans whose parts have the wrong shape before anything runs them."""
+    if not isinstance(plan, dict):
+        raise PlanError("plan is not a JSON object")
+    filters = plan.get("filters") or []
+    if not isinstance(filters, list) or not all(isinstance(condition, dict) for condition in filters):
+        raise PlanError("filters must be a list of objects")
+    if not isinstance(plan.get("aggregate") or {}, dict):
+        raise PlanError("aggregate must be an object")
+    if not isinstance(plan.get("group_by") or [], list):
+        raise PlanError("group_by must be a list")
+    return plan
+
+
+def check_column(df, column):
+    if column not in df.columns:
+        # Be forgiving about case and surrounding spaces, nothing else.
+        matches = [c for c in df.columns if str(c).strip().lower() == str(column).strip().lower()]
+        if not matches:
+            raise PlanError(f"unknown column {column!r}")
+        column = matches[0]
+    return column
+
+
+def check_sheet(tables, sheet):
+    if len(tables) == 1:
+        return next(iter(tables))
+    if sheet not in tables:
+        matches = [name for name in tables if str(name).strip().lower() == str(sheet).strip().lower()]
+        if not matches:
+            raise PlanError(f"unknown sheet {sheet!r}")
+        sheet = matches[0]
+    return sheet
+
+
+def describe_table(df, sample_rows=3):
+    columns = "\n".join(f"- {c} ({dtype})" for c, dtype in df.dtypes.items())
+    return TABLE_PROMPT.format(columns=columns, sample=df.head(sample_rows).to_markdown(index=False))
+
+
+def filter_mask(df, condition):
+    column = check_column(df, condition.get("column"))
+    op = condition.get("op")
+    value = condition.get("value")
+    series = df[column]
+    if op == "contains":
+        return series.astype(str).str.contains(str(value), case=False, na=False, regex=False)
+    if op == "in":
+        values = value if isinstance(value, list) else [value]
+        return series.astype(str).str.lower().isin([str(v).lower() for v in values])
+    if op not in COMPARISONS:
+        raise PlanError(f"unsupported operator {op!r}")
+    if pd.api.types.is_numeric_dtype(series):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise PlanError(f"{column!r} is numeric but got {value!r}")
+        return COMPARISONS[op](series, value)
+    if op in ("==", "!="):
+        return COMPARISONS[op](series.astype(str).str.lower(), str(value).lower())
+    return COMPARISONS[op](series.astype(str), str(value))
+
+
+def run_plan(df, plan):
+    """Execute a validated JSON plan with vectorized pandas operations over the full frame.
+
+    Returns (result, description). Only whitelisted operators and aggregate
+    functions on existing columns are allowed, and nothing is ever eval'd.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for condition in plan.get("filters") or []:
+        mask &= filter_mask(df, condition).to_numpy()
+    view = df[mask]
+
+    aggregate = plan.get("aggregate") or {"func": "count"}
+    func = aggregate.get("func", "count")
+    if func not in AGGREGATES:
+        raise PlanError(f"unsupported aggregate {func!r}")
+    column = aggregate.get("column")
+    if func not in ("count", "rows"):
+        column = check_column(df, column)
+        if func != "nunique" and not pd.api.types.is_numeric_dtype(df[column]):
+            raise PlanError(f"cannot {func} non-numeric column {column!r}")
+    group_by = [check_column(df, c) for c in plan.get("group_by") or []]
+    ascending = plan.get("sort") == "asc"
+    limit = min(int(plan.get("limit") or MAX_LIMIT), MAX_LIMIT)
+
+    description = f"{func}({column or '*'}) over {len(view)} of {len(df)} rows"
+    if group_by:
+        description += f", grouped by {', '.join(map(str, group_by))}"
+
+    if func == "rows":
+        return view.head(limit), description
+    if group_by:
+        grouped = view.groupby(group_by)
+        result = grouped.size() if func == "count" else grouped[column].agg(func)
+        name = "count" if func == "count" else f"{func}({column})"
+        result = result.sort_values(ascending=ascending).head(limit).rename(name).reset_index()
+        return result, description
+    result = len(view) if func == "count" else view[column].agg(func)
+    return result, description
+
+
+def format_result(result):
+    if isinstance(result, pd.DataFrame):
+        return result.to_markdown(index=False) if len(result) else "No matching rows."
+    if isinstance(result, (float, np.floating)):
+        return f"{result:,.4g}" if abs(result) < 1e4 else f"{result:,.2f}"
+    return str(result)
+
+
+class QueryRouter:
+    """Sends aggregate/tabular questions to a pandas query plan and everything else to RAG.
+
+    The LLM only writes the JSON plan; the plan is validated and executed
+    with pandas over the full DataFrame, so answers do not depend on which
+    top-k chunks retrieval happened to return. Any plan failure falls back to
+    the RAG query engine. `tables` is a DataFrame or a {sheet name: DataFrame}
+    mapping; with several sheets the plan also names the sheet. `llm` only
+    needs `.complete(prompt).text`, and `rag_engine` only needs
+    `.query(question).response_gen`, so both can be stubbed locally.
+    `cell_index`, if given, tells which questions are exact ID lookups.
+    """
+
+    def __init__(self, tables, rag_engine, llm, cell_index=None):
+        self.tables = tables if isinstance(tables, dict) else {None: tables}
+        self.rag_engine = rag_engine
+        self.llm = llm
+        self.cell_index = cell_index
+
+    def is_exact_lookup(self, question):
+        """True when retrieval will answer from the cell index alone, with no query embedding."""
+        return self.cell_index is not None and self.cell_index.is_exact(question)
+
+    def plan_prompt(self, question):
+        if len(self.tables) == 1:
+            tables = describe_table(next(iter(self.tables.values())))
+            sheet_field = ""
+        else:
+            # Keep the prompt short on wide workbooks: one sample row per sheet.
+            tables = "".join(f"Sheet {name!r}:\n{describe_table(df, 1)}" for name, df in self.tables.items())
+            sheet_field = '"sheet": "<sheet name>", '
+        return PLAN_PROMPT.format(tables=tables, sheet_field=sheet_field, question=question)
+
+    def try_dataframe(self, question):
+        if not TABULAR_HINTS.search(question):
+            return None
+        try:
+            plan = validate_plan(parse_plan(self.llm.complete(self.plan_prompt(question)).text))
+            if plan.get("route") == "rag":
+                return None
+            sheet = check_sheet(self.tables, plan.get("sheet"))
+            result, description = run_plan(self.tables[sheet], plan)
+        except (PlanError, AttributeError, KeyError, TypeError, ValueError):
+            return None
+        if sheet is not None and len(self.tables) > 1:
+            description = f"{sheet}: {description}"
+        return format_result(result), description
+
+    def query_dataframe(self, question):
+        """The dataframe answer, or None if the question should go to RAG."""
+        start = time.perf_counter()
+        answered = self.try_dataframe(question)
+        if answered is None:
+            return None
+        answer, description = answered
+        elapsed = time.perf_counter() - start
+        return RoutedResponse("dataframe", iter([answer]), f"{description} · {elapsed:.2f}s")
+
+    def query_rag(self, question, embedding=None):
+        """`embedding`, if the caller already embedded the question, is reused by retrieval."""
+        if embedding is not None:
+            question = QueryBundle(question, embedding=embedding)
+        return RoutedResponse("rag", self.rag_engine.query(question).response_gen)
+
+    def query(self, question, embedding=None):
+        return self.query_dataframe(question) or self.query_rag(question, embedding)
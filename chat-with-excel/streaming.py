@@ -0,0 +1,51 @@
+import time
+
+# Re-render at most this often, or as soon as this many characters are waiting.
+FLUSH_INTERVAL_S = 0.1
+FLUSH_CHARS = 400
+CURSOR = "▌"
+
+
+def render_stream(response_gen, placeholder, start, answer_started, interval=FLUSH_INTERVAL_S, flush_chars=FLUSH_CHARS):
+    """Drain a generator of answer chunks into a Streamlit placeholder; returns (text, metrics).
+
+    Every re-render re-sends the whole answer over the websocket, so chunks
+    are buffered and flushed on a time/size interval instead of per token.
+    `start` is when the question was asked and `answer_started` when
+    retrieval/routing returned and generation began (both perf_counter).
+    Chunks are counted as tokens, which is what Ollama streams.
+    """
+    text = ""
+    pending = []
+    pending_chars = 0
+    renders = 0
+    tokens = 0
+    first_token = None
+    last_flush = time.perf_counter()
+    for chunk in response_gen:
+        now = time.perf_counter()
+        if first_token is None:
+            first_token = now
+        tokens += 1
+        pending.append(chunk)
+        pending_chars += len(chunk)
+        if now - last_flush >= interval or pending_chars >= flush_chars:
+            text += "".join(pending)
+            pending, pending_chars = [], 0
+            placeholder.markdown(text + CURSOR)
+            renders += 1
+            last_flush = now
+    text += "".join(pending)
+    placeholder.markdown(text)
+    end = time.perf_counter()
+
+    first_token = first_token or end
+    generation_s = end - first_token
+    return text, {
+        "retrieval_s": answer_started - start,
+        "ttft_s": first_token - start,
+        "generation_s": generation_s,
+        "tokens": tokens,
+        "tokens_per_s": (tokens - 1) / generation_s if tokens > 1 and generation_s > 0 else 0.0,
+        "renders": renders + 1,
+    }
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from llama_index.core.schema import TextNode
+
+ROWS_PER_CHUNK = 50
+
+
+def column_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "int"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "date"
+    return "text"
+
+
+def row_group_starts(df, rows_per_chunk=ROWS_PER_CHUNK):
+    """First row of every row group, with boundaries picked by row content.
+
+    A row whose hash is 0 modulo the divisor ends a group (groups are kept
+    between half and twice rows_per_chunk, about rows_per_chunk on average).
+    Boundaries depend on the rows around them, not on their positions, so
+    inserting or deleting a row only changes the groups next to it and the
+    rest keep their text, and their embeddings.
+    """
+    total = len(df)
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    min_rows = max(rows_per_chunk // 2, 1)
+    max_rows = max(rows_per_chunk * 2, 1)
+    divisor = np.uint64(max(rows_per_chunk - min_rows, 1))
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    starts = [0]
+    for cut in (np.flatnonzero(hashes % divisor == 0) + 1).tolist() + [total]:
+        while cut - starts[-1] > max_rows:
+            starts.append(starts[-1] + max_rows)
+        if cut - starts[-1] >= min_rows and cut < total:
+            starts.append(cut)
+    return np.array(starts, dtype=np.int64)
+
+
+class TableNodeParser:
+    """Splits a DataFrame into row-group nodes instead of one giant markdown table.
+
+    Every chunk repeats the header and the column types, so each node can be
+    understood on its own. Each also carries file/sheet/row-range metadata.
+    Groups end at content-defined boundaries (see row_group_starts).
+    The row-range line is metadata the LLM sees but the embedding does not,
+    so a row group that only moved (rows appended or removed elsewhere)
+    embeds to the same text and can reuse its vector.
+    iter_nodes() is a generator: only one row group is rendered at a time,
+    so memory stays flat however many rows the sheet has.
+    """
+
+    def __init__(self, rows_per_chunk=ROWS_PER_CHUNK):
+        self.rows_per_chunk = rows_per_chunk
+
+    def settings(self):
+        """Everything that changes the produced nodes; part of the index cache key."""
+        return {"parser": "table-row-groups", "rows_per_chunk": self.rows_per_chunk, "location": "metadata",
+                "boundaries": "content"}
+
+    def iter_nodes(self, df, file_name, sheet_name=None):
+        columns = ", ".join(f"{c} ({column_type(dtype)})" for c, dtype in df.dtypes.items())
+        total = len(df)
+        starts = row_group_starts(df, self.rows_per_chunk).tolist()
+        for start, stop in zip(starts, starts[1:] + [total]):
+            rows = df.iloc[start:stop]
+            end = start + len(rows) - 1
+            location = f"Sheet: {sheet_name}, rows" if sheet_name else "Rows"
+            text = f"Columns: {columns}\n\n{rows.to_markdown(index=False)}"
+            metadata = {"file_name": file_name, "row_start": start + 1, "row_end": end + 1}
+            if sheet_name:
+                metadata["sheet"] = sheet_name
+            hidden = list(metadata)
+            metadata["location"] = f"{location} {start + 1}-{end + 1} of {total}"
+            yield TextNode(
+                text=text,
+                metadata=metadata,
+                excluded_embed_metadata_keys=hidden + ["location"],
+                excluded_llm_metadata_keys=hidden,
+            )
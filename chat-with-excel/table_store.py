@@ -0,0 +1,113 @@
+import hashlib
+import os
+import shutil
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from index_store import DiskCache
+from ingestion import Sheet
+
+TABLE_CACHE_DIR = os.getenv("TABLE_CACHE_DIR", os.path.expanduser("~/.cache/chat-with-excel/tables"))
+TABLE_CACHE_MAX_MB = int(os.getenv("TABLE_CACHE_MAX_MB", "4096"))
+# Row groups are the unit a page read touches; small enough that a preview page is cheap.
+PARQUET_ROW_GROUP = 16384
+# Bump when parsing changes in a way that changes the parsed frames.
+PARSE_VERSION = 1
+
+
+def parquet_frame(df):
+    """df with string column names, and mixed-type object columns Arrow rejects as strings.
+
+    Real sheets often mix numbers and text in one column ("12", 12, "n/a").
+    Only the cells of columns Arrow cannot type are converted; missing
+    values stay missing.
+    """
+    df = df.rename(columns=str)
+    for position, dtype in enumerate(df.dtypes):
+        if dtype != object:
+            continue
+        column = df.iloc[:, position]
+        try:
+            pa.array(column, from_pandas=True)
+        except (pa.ArrowException, ValueError, TypeError):
+            df.isetitem(position, column.where(column.isna(), column.astype(str)))
+    return df
+
+
+def table_key(file_name, file_bytes):
+    """Content address of a parsed upload: the bytes plus how they are parsed (CSV or workbook)."""
+    digest = hashlib.sha256()
+    digest.update(file_bytes)
+    digest.update(f"{os.path.splitext(file_name)[1].lower()}:{PARSE_VERSION}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class TableStore(DiskCache):
+    """Parsed uploads stored as one Parquet file per sheet, keyed by table_key.
+
+    Loading a stored upload is a columnar read instead of another CSV /
+    openpyxl parse, and read_page() reads only the row groups a preview page
+    touches, so a million-row sheet never has to be loaded to show 100 rows.
+    """
+
+    def __init__(self, root=TABLE_CACHE_DIR, max_bytes=TABLE_CACHE_MAX_MB * 1024 * 1024):
+        super().__init__(root, max_bytes)
+
+    def _sheet_path(self, key, position):
+        return os.path.join(self._path(key), f"{position}.parquet")
+
+    def save(self, key, sheets, source_name=""):
+        """Store parsed sheets; returns False if a frame cannot be written as Parquet even with mixed columns as text."""
+        if self.contains(key):
+            return True
+        tmp_path = self._scratch(key)
+        os.makedirs(tmp_path)
+        try:
+            for position, sheet in enumerate(sheets):
+                path = os.path.join(tmp_path, f"{position}.parquet")
+                try:
+                    # Parquet wants string column names
+                    sheet.df.rename(columns=str).to_parquet(path, index=False, row_group_size=PARQUET_ROW_GROUP)
+                except (pa.ArrowException, ValueError, TypeError):
+                    # Mixed-type columns: store them as text rather than give up on the whole upload
+                    parquet_frame(sheet.df).to_parquet(path, index=False, row_group_size=PARQUET_ROW_GROUP)
+        except (pa.ArrowException, ValueError, TypeError):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return False
+        self._commit(key, tmp_path, {
+            "source": source_name,
+            "sheets": [{"name": sheet.name, "rows": len(sheet.df)} for sheet in sheets],
+        })
+        return True
+
+    def load(self, key):
+        """Return the stored sheets for key, or None on a miss."""
+        if not self._touch(key):
+            return None
+        sheets = []
+        for position, info in enumerate(self.read_meta(key)["sheets"]):
+            start = time.perf_counter()
+            df = pd.read_parquet(self._sheet_path(key, position))
+            sheets.append(Sheet(info["name"], df, timings={"parquet": time.perf_counter() - start}))
+        return sheets
+
+    def sheet_rows(self, key):
+        """[(sheet name, row count)] of a stored upload, without reading any data."""
+        return [(info["name"], info["rows"]) for info in self.read_meta(key)["sheets"]]
+
+    def read_page(self, key, position, start, count):
+        """Rows [start, start + count) of one sheet, reading only the row groups that hold them."""
+        parquet = pq.ParquetFile(self._sheet_path(key, position))
+        groups, first_row, group_start = [], None, 0
+        for i in range(parquet.num_row_groups):
+            group_end = group_start + parquet.metadata.row_group(i).num_rows
+            if group_start < start + count and group_end > start:
+                groups.append(i)
+                first_row = group_start if first_row is None else first_row
+            group_start = group_end
+        if not groups:
+            return parquet.schema_arrow.empty_table().to_pandas()
+        return parquet.read_row_groups(groups).slice(start - first_row, count).to_pandas()
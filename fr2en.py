@@ -5,30 +5,56 @@ Real-time French-to-English translation using Moshi MLX inference.
 This script captures microphone audio in real time, performs inference using
 the Moshi/Mimi model pipeline, prints the translated text, and plays back the
 synthesized audio. It reuses the inference logic from run_inference.py.
+With --input-file it translates a recorded WAV/FLAC instead, as fast as the
+hardware allows, and reports the achieved real-time factor.
+
+The audio runs as a small pipeline so that the PortAudio callback never does
+any model work:
+
+    capture callback -> input ring -> inference thread (encode, LM step,
+    decode) -> output ring -> jitter-buffered output stream callback
+
+The rings are single-producer / single-consumer, so they need no locks.
 """
 
 import argparse
+import collections
+import contextlib
+import http.server
 import json
+import os
+import queue
+import threading
 import numpy as np
 import time
-import sounddevice as sd
 
-from huggingface_hub import hf_hub_download
-import mlx.core as mx
-import mlx.nn as nn
-import rustymimi
-import sentencepiece
-# We do not need sphn since we are not decoding a file
-from moshi_mlx.client_utils import make_log
-from moshi_mlx import models, utils
+# MLX, Moshi, the tokenizers, the hub client and the audio I/O libraries are
+# heavy to import, so they are only imported once they are actually needed
+# (see import_inference_modules); `--help` and artifact resolution stay fast.
+mx = nn = models = utils = rustymimi = sentencepiece = None
+
+# Set audio processing parameters
+SAMPLE_RATE = 24000  # in Hz
+BLOCK_SIZE = 1920    # number of samples per inference step (≈80ms)
+
+
+def import_inference_modules():
+    global mx, nn, models, utils, rustymimi, sentencepiece
+    import mlx.core as mx
+    import mlx.nn as nn
+    import rustymimi
+    import sentencepiece
+    from moshi_mlx import models, utils
 
 
 def log(level: str, msg: str):
+    from moshi_mlx.client_utils import make_log
     print(make_log(level, msg))
 
 
 def hf_get(filename: str) -> str:
     if filename.startswith("hf://"):
+        from huggingface_hub import hf_hub_download
         parts = filename[5:].split("/")
         repo_name = parts[0] + "/" + parts[1]
         filename = "/".join(parts[2:])
@@ -38,138 +64,625 @@ def hf_get(filename: str) -> str:
         return filename
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Real-time French-to-English translation using microphone input"
-    )
-    parser.add_argument("--tokenizer", type=str, help="Path to the text tokenizer file")
-    parser.add_argument("--moshi-weights", type=str, help="Path to a local checkpoint file for Moshi.")
-    parser.add_argument("--mimi-weights", type=str, help="Path to a local checkpoint file for Mimi.")
-    parser.add_argument("--hf-repo", type=str, default="kyutai/hibiki-1b-mlx-bf16", help="HuggingFace repo name")
-    parser.add_argument("--lm-config", type=str, help="The LM config as a json file.")
-    parser.add_argument("--cfg-coef", type=float, default=1.0, help="CFG coefficient")
-    parser.add_argument("--device", type=str, default=None, help="Audio device for playback (optional)")
-    parser.add_argument("--input-device", type=str, default=None, help="Audio input device (microphone)")
-    args = parser.parse_args()
+class StartupTimer:
+    """Wall time per startup phase, printed as one breakdown line once the model is ready."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - t0))
+
+    def summary(self) -> str:
+        total = time.perf_counter() - self.start
+        return "startup: " + ", ".join(f"{name} {secs:.2f}s" for name, secs in self.phases) + f", total {total:.2f}s"
+
+
+def load_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as fobj:
+        return json.load(fobj)
+
+
+def save_manifest(path: str, manifest: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fobj:
+        json.dump(manifest, fobj, indent=2)
+    os.replace(tmp_path, path)
+
+
+def resolve_artifacts(args, use_compiled: bool = True):
+    """Return ({config, mimi, moshi, tokenizer, compiled}, lm_config_dict) as local paths.
+
+    Paths are looked up in <artifact-dir>/manifest.json first, keyed by
+    --hf-repo, so a warm start makes no hub calls at all. Explicit CLI paths
+    win. Anything missing is downloaded once and recorded in the manifest.
+    """
+    manifest_path = os.path.join(args.artifact_dir, "manifest.json")
+    manifest = load_manifest(manifest_path)
+    entry = manifest.setdefault(args.hf_repo, {})
+    changed = False
+
+    def cached(key: str, filename: str) -> str:
+        nonlocal changed
+        path = entry.get(key)
+        if path and os.path.exists(path):
+            return path
+        from huggingface_hub import hf_hub_download
+        log("info", f"retrieving {filename} from hf repo {args.hf_repo}")
+        path = hf_hub_download(args.hf_repo, filename)
+        entry[key] = path
+        changed = True
+        return path
+
+    paths = {}
+    paths["config"] = hf_get(args.lm_config) if args.lm_config else cached("config", "config.json")
+    log("info", f"loading config from {paths['config']}")
+    with open(paths["config"], "r") as fobj:
+        lm_config_dict = json.load(fobj)
 
-    # Set audio processing parameters
-    sample_rate = 24000  # in Hz
-    block_size = 1920    # number of samples per inference step (≈80ms)
+    for key, arg in (("mimi", args.mimi_weights), ("moshi", args.moshi_weights), ("tokenizer", args.tokenizer)):
+        paths[key] = hf_get(arg) if arg else cached(key, lm_config_dict[f"{key}_name"])
 
-    mx.random.seed(299792458)
+    # A compiled model is only used if it was built from exactly these source weights.
+    compiled = entry.get("compiled")
+    paths["compiled"] = None
+    if (use_compiled and not args.no_compiled and compiled and compiled.get("source") == paths["moshi"]
+            and os.path.exists(compiled["path"])):
+        paths["compiled"] = compiled
+
+    if changed:
+        save_manifest(manifest_path, manifest)
+    return paths, lm_config_dict
 
-    # Load LM config
-    lm_config = args.lm_config
-    if lm_config is None:
-        # Download config.json from the HuggingFace repo
-        lm_config = hf_hub_download(args.hf_repo, "config.json")
-    log("info", f"loading config from {args.lm_config}")
-    with open(hf_get(lm_config), "r") as fobj:
-        lm_config_dict = json.load(fobj)
-    print(lm_config_dict)
 
-    # Get weight files
-    mimi_weights = args.mimi_weights
-    if mimi_weights is None:
-        mimi_weights = hf_hub_download(args.hf_repo, lm_config_dict["mimi_name"])
-    mimi_weights = hf_get(mimi_weights)
+def record_compiled(args, compiled: dict):
+    manifest_path = os.path.join(args.artifact_dir, "manifest.json")
+    manifest = load_manifest(manifest_path)
+    manifest.setdefault(args.hf_repo, {})["compiled"] = compiled
+    save_manifest(manifest_path, manifest)
 
-    moshi_weights = args.moshi_weights
-    if moshi_weights is None:
-        moshi_weights = hf_hub_download(args.hf_repo, lm_config_dict["moshi_name"])
-    moshi_weights = hf_get(moshi_weights)
 
-    tokenizer = args.tokenizer
-    if tokenizer is None:
-        tokenizer = hf_hub_download(args.hf_repo, lm_config_dict["tokenizer_name"])
-    tokenizer = hf_get(tokenizer)
+def quantization_for(weights_path: str):
+    """(bits, group_size) implied by a Moshi weights filename, or None for unquantized weights."""
+    if weights_path.endswith(".q4.safetensors"):
+        return 4, 32
+    elif weights_path.endswith(".q8.safetensors"):
+        return 8, 64
+    return None
 
+
+def build_model(lm_config_dict: dict, quantization):
     # Load model configuration and create the model
     lm_config = models.LmConfig.from_config_dict(lm_config_dict)
     model = models.Lm(lm_config)
     model.set_dtype(mx.bfloat16)
-    if moshi_weights.endswith(".q4.safetensors"):
-        nn.quantize(model, bits=4, group_size=32)
-    elif moshi_weights.endswith(".q8.safetensors"):
-        nn.quantize(model, bits=8, group_size=64)
+    if quantization is not None:
+        bits, group_size = quantization
+        nn.quantize(model, bits=bits, group_size=group_size)
+    return model, lm_config
+
+
+class RingBuffer:
+    """Preallocated float32 ring buffer for one writer thread and one reader thread.
+
+    The writer only moves `write_pos` and the reader only moves `read_pos`
+    (both are running sample counts), so the two sides never need a lock.
+    A write that does not fit is dropped and counted as an overrun.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buf = np.zeros(capacity, dtype=np.float32)
+        self.write_pos = 0
+        self.read_pos = 0
+        self.overruns = 0
+
+    def available(self) -> int:
+        return self.write_pos - self.read_pos
+
+    def space(self) -> int:
+        return self.capacity - self.available()
+
+    def write(self, data: np.ndarray) -> bool:
+        n = len(data)
+        if n > self.space():
+            self.overruns += 1
+            return False
+        start = self.write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self.buf[start:start + first] = data[:first]
+        self.buf[:n - first] = data[first:]
+        self.write_pos += n
+        return True
+
+    def read(self, out: np.ndarray) -> bool:
+        n = len(out)
+        if n > self.available():
+            return False
+        start = self.read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.buf[start:start + first]
+        out[first:] = self.buf[:n - first]
+        self.read_pos += n
+        return True
+
+    def skip(self, n: int) -> int:
+        """Drop up to n of the oldest samples (reader side only)."""
+        n = min(n, self.available())
+        self.read_pos += n
+        return n
+
+
+# Stages timed on every step; "playback" is the output stream callback and
+# "glass_to_glass" is microphone ADC time -> speaker DAC time.
+STAGES = ("encode", "lm_step", "item_sync", "decode", "step_total", "playback", "glass_to_glass")
+
+
+class RollingHistogram:
+    """Keeps the last `size` durations (seconds) for rolling percentiles; single writer."""
+
+    def __init__(self, size: int = 1024):
+        self.samples = np.zeros(size, dtype=np.float64)
+        self.count = 0
+
+    def add(self, seconds: float):
+        self.samples[self.count % len(self.samples)] = seconds
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def window(self) -> np.ndarray:
+        return self.samples[:min(self.count, len(self.samples))]
+
+    def percentiles(self, qs=(50, 95, 99)) -> dict:
+        window = self.window()
+        if len(window) == 0:
+            return {f"p{q}": 0.0 for q in qs}
+        return {f"p{q}": float(v) for q, v in zip(qs, np.percentile(window, qs))}
+
+
+class PipelineStats:
+    """Counters and stage timers shared by the pipeline stages; each field has a single writer.
+
+    Writers only store numbers. Percentiles, JSON and Prometheus text are
+    computed by whoever reports (the main thread or the metrics server),
+    never on the audio or inference path.
+    """
+
+    def __init__(self, sample_rate: int, block_size: int):
+        self.block_size = block_size
+        self.block_seconds = block_size / sample_rate
+        self.input_overflows = 0   # reported by PortAudio on the input stream
+        self.dropped_blocks = 0    # input blocks skipped to keep latency bounded
+        self.late_blocks = 0       # steps that took longer than one block of audio
+        self.underruns = 0         # playback ran dry and played silence
+        self.steps = 0
+        self.level = 0.0           # input level of the last processed block
+        self.jitter_target = 0     # current playback buffer target, in samples
+        self.stages = {name: RollingHistogram() for name in STAGES}
+        self.in_ring = None
+        self.out_ring = None
+
+    def record_step(self, encode: float, lm_step: float, item_sync: float, decode: float):
+        total = encode + lm_step + item_sync + decode
+        self.stages["encode"].add(encode)
+        self.stages["lm_step"].add(lm_step)
+        self.stages["item_sync"].add(item_sync)
+        self.stages["decode"].add(decode)
+        self.stages["step_total"].add(total)
+        if total > self.block_seconds:
+            self.late_blocks += 1
+        self.steps += 1
+
+    def rtf(self) -> float:
+        """Mean step time over the rolling window divided by the audio duration of a block."""
+        window = self.stages["step_total"].window()
+        return float(window.mean()) / self.block_seconds if len(window) else 0.0
+
+    def snapshot(self) -> dict:
+        counters = {
+            "steps": self.steps,
+            "late_blocks": self.late_blocks,
+            "dropped_blocks": self.dropped_blocks,
+            "input_overflows": self.input_overflows,
+            "underruns": self.underruns,
+        }
+        if self.in_ring is not None:
+            counters["in_overruns"] = self.in_ring.overruns
+            counters["in_queue_blocks"] = self.in_ring.available() // self.block_size
+        if self.out_ring is not None:
+            counters["out_overruns"] = self.out_ring.overruns
+            counters["out_queue_blocks"] = self.out_ring.available() // self.block_size
+        return {
+            "time": time.time(),
+            "counters": counters,
+            "rtf": self.rtf(),
+            "jitter_target_blocks": self.jitter_target / self.block_size,
+            "stages": {
+                name: dict(hist.percentiles(), count=hist.count)
+                for name, hist in self.stages.items() if hist.count
+            },
+        }
+
+    def prometheus(self) -> str:
+        snap = self.snapshot()
+        lines = []
+        for name, value in snap["counters"].items():
+            if "queue" in name:
+                lines.append(f"# TYPE fr2en_{name} gauge")
+                lines.append(f"fr2en_{name} {value}")
+            else:
+                lines.append(f"# TYPE fr2en_{name}_total counter")
+                lines.append(f"fr2en_{name}_total {value}")
+        lines.append("# TYPE fr2en_rtf gauge")
+        lines.append(f"fr2en_rtf {snap['rtf']:.6f}")
+        lines.append("# TYPE fr2en_stage_seconds summary")
+        for name, values in snap["stages"].items():
+            for q in (50, 95, 99):
+                lines.append(f'fr2en_stage_seconds{{stage="{name}",quantile="{q / 100}"}} {values[f"p{q}"]:.6f}')
+            lines.append(f'fr2en_stage_seconds_count{{stage="{name}"}} {values["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        vu = min(int(self.level * 10), 10)
+        snap = self.snapshot()
+        counters = " ".join(f"{k}={v}" for k, v in snap["counters"].items())
+        stages = " ".join(
+            f"{name}={v['p50'] * 1000:.0f}/{v['p95'] * 1000:.0f}/{v['p99'] * 1000:.0f}ms"
+            for name, v in snap["stages"].items()
+        )
+        return (
+            f"|{'*' * vu}{'-' * (10 - vu)}| {counters} rtf={snap['rtf']:.2f} "
+            f"jitter_target={snap['jitter_target_blocks']:.1f} {stages} (p50/p95/p99)"
+        )
+
+
+def start_metrics_server(port: int, stats: PipelineStats):
+    """Serve Prometheus-style text for `stats` on http://127.0.0.1:<port>/metrics."""
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = stats.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log("info", f"serving metrics on http://127.0.0.1:{port}/metrics")
+    return server
+
+
+class MetricsReporter:
+    """Periodically logs a stats line and appends a JSON snapshot to --metrics-jsonl."""
+
+    def __init__(self, args, stats: PipelineStats):
+        self.stats = stats
+        self.interval = args.stats_interval
+        self.jsonl = open(args.metrics_jsonl, "a", encoding="utf-8") if args.metrics_jsonl else None
+        self.server = start_metrics_server(args.metrics_port, stats) if args.metrics_port else None
+        self.last_report = time.time()
+
+    def report(self):
+        self.last_report = time.time()
+        log("info", self.stats.summary())
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps(self.stats.snapshot()) + "\n")
+            self.jsonl.flush()
+
+    def due(self) -> bool:
+        return self.interval > 0 and time.time() - self.last_report >= self.interval
+
+    def close(self):
+        self.report()
+        if self.jsonl is not None:
+            self.jsonl.close()
+        if self.server is not None:
+            self.server.shutdown()
+
+
+def text_piece_for(text_tokenizer, text_token: int):
+    """The printable piece for a generated text token, or None for padding/EOS tokens."""
+    if text_token in (0, 3):
+        return None
+    text_piece = text_tokenizer.id_to_piece(text_token)
+    return text_piece.replace(" ", " ")
+
+
+class Translator:
+    """Streams 1920-sample PCM blocks through Mimi encode -> LmGen.step -> Mimi decode."""
+
+    def __init__(self, model, text_tokenizer, audio_tokenizer, generated_codebooks, ct, cfg_coef):
+        self.text_tokenizer = text_tokenizer
+        self.audio_tokenizer = audio_tokenizer
+        self.generated_codebooks = generated_codebooks
+        self.ct = ct
+        # Set max_steps high enough for continuous streaming.
+        self.gen = models.LmGen(
+            model=model,
+            max_steps=100000,
+            text_sampler=utils.Sampler(top_k=25),
+            audio_sampler=utils.Sampler(top_k=250),
+            cfg_coef=cfg_coef,
+            check=False,
+        )
+
+    def step(self, pcm: np.ndarray, stats: "PipelineStats" = None):
+        """Process one mono block; returns (text_piece or None, out_pcm or None).
+
+        When `stats` is given, each stage's wall time is recorded. MLX is lazy,
+        so `gen.step` only builds the graph and `.item()` is where it runs.
+        """
+        t0 = time.perf_counter()
+        # The encoder expects an input shape of (batch, channel, samples)
+        encoded = self.audio_tokenizer.encode_step(pcm[None, None, :])
+        encoded = mx.array(encoded).transpose(0, 2, 1)[:, :, :self.generated_codebooks]
+        t1 = time.perf_counter()
 
-    log("info", f"loading model weights from {moshi_weights}")
-    model.load_weights(moshi_weights, strict=True)
+        # Generate the next text token using the model
+        text_token = self.gen.step(encoded[0], self.ct)
+        t2 = time.perf_counter()
+        text_token = text_token[0].item()
+        t3 = time.perf_counter()
 
-    log("info", f"loading the text tokenizer from {tokenizer}")
-    text_tokenizer = sentencepiece.SentencePieceProcessor(tokenizer)
+        text_piece = text_piece_for(self.text_tokenizer, text_token)
 
-    log("info", f"loading the audio tokenizer from {mimi_weights}")
-    generated_codebooks = lm_config.generated_codebooks
-    audio_tokenizer = rustymimi.Tokenizer(mimi_weights, num_codebooks=generated_codebooks)
+        # Get the audio tokens produced in this step and decode them
+        out_pcm = None
+        audio_tokens = self.gen.last_audio_tokens()
+        if audio_tokens is not None:
+            audio_tokens = np.array(audio_tokens[:, :, None]).astype(np.uint32)
+            # decode_step returns (batch, channels, samples); keep the first channel
+            out_pcm = np.asarray(self.audio_tokenizer.decode_step(audio_tokens), dtype=np.float32)
+            out_pcm = out_pcm.reshape(-1, out_pcm.shape[-1])[0]
+        if stats is not None:
+            stats.record_step(t1 - t0, t2 - t1, t3 - t2, time.perf_counter() - t3)
+        return text_piece, out_pcm
+
+
+def load_model(args, timer: StartupTimer):
+    """Load everything shared between streams: (model, text_tokenizer, mimi_weights, generated_codebooks, ct)."""
+    with timer.phase("imports"):
+        import_inference_modules()
+    mx.random.seed(299792458)
+
+    with timer.phase("resolve"):
+        paths, lm_config_dict = resolve_artifacts(args)
+    print(lm_config_dict)
+
+    with timer.phase("build"):
+        compiled = paths["compiled"]
+        if compiled is not None:
+            moshi_weights = compiled["path"]
+            quantization = (compiled["bits"], compiled["group_size"]) if compiled["bits"] else None
+        else:
+            moshi_weights = paths["moshi"]
+            quantization = quantization_for(moshi_weights)
+        model, lm_config = build_model(lm_config_dict, quantization)
+
+    with timer.phase("weights"):
+        log("info", f"loading model weights from {moshi_weights}")
+        model.load_weights(moshi_weights, strict=True)
+
+    with timer.phase("tokenizers"):
+        log("info", f"loading the text tokenizer from {paths['tokenizer']}")
+        text_tokenizer = sentencepiece.SentencePieceProcessor(paths["tokenizer"])
 
     if model.condition_provider is not None:
         ct = model.condition_provider.condition_tensor("description", "very_good")
     else:
         ct = None
 
-    log("info", "warming up the model")
-    model.warmup(ct)
-    log("info", "done warming up the model")
-
-    # Create the generator for text and audio tokens.
-    # Set max_steps high enough for continuous streaming.
-    gen = models.LmGen(
-        model=model,
-        max_steps=100000,
-        text_sampler=utils.Sampler(top_k=25),
-        audio_sampler=utils.Sampler(top_k=250),
-        cfg_coef=args.cfg_coef,
-        check=False,
-    )
+    with timer.phase("warmup"):
+        log("info", "warming up the model")
+        model.warmup(ct)
+        log("info", "done warming up the model")
+
+    return model, text_tokenizer, paths["mimi"], lm_config.generated_codebooks, ct
+
+
+def load_translator(args) -> Translator:
+    timer = StartupTimer()
+    model, text_tokenizer, mimi_weights, generated_codebooks, ct = load_model(args, timer)
+    with timer.phase("mimi"):
+        log("info", f"loading the audio tokenizer from {mimi_weights}")
+        audio_tokenizer = rustymimi.Tokenizer(mimi_weights, num_codebooks=generated_codebooks)
+    log("info", timer.summary())
+    return Translator(model, text_tokenizer, audio_tokenizer, generated_codebooks, ct, args.cfg_coef)
+
+
+def compile_model(args):
+    """One-time step: save the Moshi weights already cast to bf16 (and quantized) for direct loading.
+
+    The result is recorded in the artifact manifest, and later launches load it
+    straight into the quantized model skeleton with no cast or quantize pass.
+    """
+    timer = StartupTimer()
+    with timer.phase("imports"):
+        import_inference_modules()
+        from mlx.utils import tree_flatten
+    with timer.phase("resolve"):
+        paths, lm_config_dict = resolve_artifacts(args, use_compiled=False)
+
+    with timer.phase("build"):
+        quantization = quantization_for(paths["moshi"])
+        model, _ = build_model(lm_config_dict, quantization)
+    with timer.phase("weights"):
+        log("info", f"loading model weights from {paths['moshi']}")
+        model.load_weights(paths["moshi"], strict=True)
+    with timer.phase("quantize"):
+        if quantization is None and args.quantize:
+            quantization = (args.quantize, 32 if args.quantize == 4 else 64)
+            nn.quantize(model, bits=quantization[0], group_size=quantization[1])
+        mx.eval(model.parameters())
+
+    with timer.phase("save"):
+        suffix = f"q{quantization[0]}" if quantization else "bf16"
+        out_path = os.path.join(args.artifact_dir, args.hf_repo.replace("/", "--") + f".compiled.{suffix}.safetensors")
+        os.makedirs(args.artifact_dir, exist_ok=True)
+        mx.save_safetensors(out_path, dict(tree_flatten(model.parameters())))
+        record_compiled(args, {
+            "path": out_path,
+            "source": paths["moshi"],
+            "bits": quantization[0] if quantization else None,
+            "group_size": quantization[1] if quantization else None,
+        })
+    log("info", f"saved compiled model to {out_path}")
+    log("info", timer.summary())
+
+
+def inference_worker(translator, in_ring, out_ring, capture_times, latency_marks, text_queue, stats, stop,
+                     block_size, max_latency_blocks):
+    """Pull blocks from the input ring, run the model, push text and PCM downstream."""
+    block = np.zeros(block_size, dtype=np.float32)
+    while not stop.is_set():
+        # Keep latency bounded: if we fell behind, drop the oldest input blocks
+        # instead of letting the backlog (and the delay) grow forever.
+        backlog = in_ring.available() // block_size
+        if backlog > max_latency_blocks:
+            stats.dropped_blocks += in_ring.skip((backlog - max_latency_blocks) * block_size) // block_size
+        block_index = in_ring.read_pos // block_size
+        if not in_ring.read(block):
+            time.sleep(0.002)
+            continue
+
+        stats.level = float(np.linalg.norm(block))
+        try:
+            text_piece, out_pcm = translator.step(block, stats)
+        except Exception as e:
+            # Without the worker nothing is translated any more; take the pipeline down with it
+            log("error", f"inference failed: {e!r}")
+            stop.set()
+            return
+        if text_piece is not None:
+            text_queue.put(text_piece)
+        if out_pcm is not None and out_ring.write(out_pcm):
+            # Remember when the input behind this output was captured, keyed by
+            # the output ring position at which its audio ends.
+            latency_marks.append((out_ring.write_pos, capture_times[block_index % len(capture_times)]))
+
+
+class JitterBufferPlayer:
+    """Plays the output ring through one persistent callback-driven sd.OutputStream.
+
+    Playback starts once `target` samples are buffered. On underrun the
+    callback fills the rest of the period with silence (it never blocks),
+    raises the target by one block and re-buffers. After `adapt_seconds`
+    without an underrun the target is lowered again by one block, and any
+    excess above target + one block is skipped so latency does not creep up.
+    """
+
+    def __init__(self, out_ring, latency_marks, stats, sample_rate, block_size,
+                 jitter_blocks, min_jitter_blocks, max_jitter_blocks, adapt_seconds=10.0):
+        self.out_ring = out_ring
+        self.latency_marks = latency_marks
+        self.stats = stats
+        self.block_size = block_size
+        self.min_target = min_jitter_blocks * block_size
+        self.max_target = max_jitter_blocks * block_size
+        self.target = min(max(jitter_blocks * block_size, self.min_target), self.max_target)
+        self.adapt_samples = int(adapt_seconds * sample_rate)
+        self.stable_samples = 0
+        self.buffering = True
+        self.stats.jitter_target = self.target
+
+    def callback(self, outdata, frames, time_info, status):
+        started = time.perf_counter()
+        ring = self.out_ring
+        out = outdata[:, 0]
+        available = ring.available()
+
+        if self.buffering:
+            if available < self.target:
+                outdata.fill(0)
+                return
+            self.buffering = False
+
+        if available < frames:
+            # Underrun: play what we have, pad with silence and re-buffer at a higher target.
+            ring.read(out[:available])
+            out[available:] = 0
+            self.stats.underruns += 1
+            self.buffering = True
+            self.stable_samples = 0
+            self.target = min(self.target + self.block_size, self.max_target)
+            self.stats.jitter_target = self.target
+        else:
+            excess = available - frames - (self.target + self.block_size)
+            if excess > 0:
+                ring.skip(excess)
+            ring.read(out)
+            self.stable_samples += frames
+            if self.stable_samples >= self.adapt_samples and self.target > self.min_target:
+                self.stable_samples = 0
+                self.target -= self.block_size
+                self.stats.jitter_target = self.target
+
+        # Glass-to-glass latency for every output chunk that finished in this period.
+        dac_time = time.monotonic() + (time_info.outputBufferDacTime - time_info.currentTime)
+        marks = self.latency_marks
+        while marks and marks[0][0] <= ring.read_pos:
+            _, capture_time = marks.popleft()
+            self.stats.stages["glass_to_glass"].add(dac_time - capture_time)
+        self.stats.stages["playback"].add(time.perf_counter() - started)
+
+
+def run_realtime(args, translator: Translator, sample_rate: int, block_size: int):
+    import sounddevice as sd
+
+    in_ring = RingBuffer(block_size * args.queue_blocks)
+    out_ring = RingBuffer(block_size * max(args.queue_blocks, args.max_jitter_blocks + 2))
+    # Capture timestamp of each input block, indexed by block number modulo the ring size.
+    capture_times = np.zeros(args.queue_blocks + 1, dtype=np.float64)
+    latency_marks = collections.deque(maxlen=4 * args.queue_blocks)
+    text_queue = queue.SimpleQueue()
+    stats = PipelineStats(sample_rate, block_size)
+    stats.in_ring = in_ring
+    stats.out_ring = out_ring
+    stop = threading.Event()
 
     # --- Callback Function ---
-    def audio_callback(indata, frames, time, status):
-        """This is called (from a separate thread) for each audio block."""
-        if status:
-            print(status)
+    def audio_callback(indata, frames, time_info, status):
+        """This is called (from the PortAudio thread) for each audio block; it only copies PCM."""
+        if status.input_overflow:
+            stats.input_overflows += 1
+        captured = time.monotonic() - (time_info.currentTime - time_info.inputBufferAdcTime)
+        block_index = in_ring.write_pos // block_size
         # indata shape: (frames, num_channels)  <--  (block_size, 1) in our case
+        if in_ring.write(indata[:, 0]):
+            # Only a block that made it into the ring gets a timestamp; a dropped one
+            # must not overwrite the slot of a block still waiting to be read.
+            capture_times[block_index % len(capture_times)] = captured
+
+    player = JitterBufferPlayer(
+        out_ring, latency_marks, stats, sample_rate, block_size,
+        args.jitter_blocks, args.min_jitter_blocks, args.max_jitter_blocks,
+    )
+    worker = threading.Thread(
+        target=inference_worker,
+        args=(translator, in_ring, out_ring, capture_times, latency_marks, text_queue, stats, stop,
+              block_size, args.max_latency_blocks),
+        daemon=True,
+    )
+    reporter = MetricsReporter(args, stats)
+    worker.start()
 
-        # VU Meter (Feedback)
-        volume_norm = np.linalg.norm(indata) * 10
-        print("|" + "*" * int(volume_norm) + "-" * (10 - int(volume_norm)) + "|")
-
-        # Prepare the audio block (reshape as needed)
-        # The audio block shape is (block_size, 1). Transpose to (1, block_size)
-        pcm_data = indata.T
-
-        # The encoder expects an input shape of (batch, channel, samples)
-        encoded = audio_tokenizer.encode_step(pcm_data[None, 0:1])
-        encoded = mx.array(encoded).transpose(0, 2, 1)[:, :, :generated_codebooks]
-
-        # Generate the next text token using the model
-        text_token = gen.step(encoded[0], ct)
-        text_token = text_token[0].item()
-
-        # Print the translated text if it is meaningful
-        if text_token not in (0, 3):
-            text_piece = text_tokenizer.id_to_piece(text_token)
-            text_piece = text_piece.replace(" ", " ")
-            print(text_piece, end="", flush=True)
-
-        # Get the audio tokens produced in this step and decode them
-        audio_tokens = gen.last_audio_tokens()
-        if audio_tokens is not None:
-            audio_tokens = np.array(audio_tokens[:, :, None]).astype(np.uint32)
-            out_pcm = audio_tokenizer.decode_step(audio_tokens)
-            # out_pcm is expected to be of shape (channels, samples)
-            # Transpose to (samples, channels) for sd.play()
-            out_pcm = out_pcm.T
-            if out_pcm.shape[1] == 1:  # Check for mono output
-                out_pcm = out_pcm[:, 0]  # Squeeze to one dimension
-            if args.device:
-                sd.play(out_pcm, samplerate=sample_rate, device=args.device)
-            else:
-                sd.play(out_pcm, samplerate=sample_rate)
-            sd.wait()  # Wait until playback is finished
-
-
-    # --- Start the Stream ---
+    # --- Start the Streams ---
     log("info", "starting real-time inference. Press Ctrl+C to stop.")
     try:
         with sd.InputStream(
@@ -179,14 +692,175 @@ def main():
             channels=1,
             dtype='float32',
             callback=audio_callback
+        ), sd.OutputStream(
+            device=args.device,
+            samplerate=sample_rate,
+            channels=1,
+            dtype='float32',
+            latency='low',
+            callback=player.callback
         ):
-            while True: # Keep the main thread alive
-                time.sleep(0.1) #  Avoid busy-waiting
+            # The main thread owns the terminal and the metrics sinks: text
+            # and counters are printed here, never from the audio path.
+            while not stop.is_set():
+                try:
+                    print(text_queue.get(timeout=0.1), end="", flush=True)
+                except queue.Empty:
+                    pass
+                if reporter.due():
+                    print()
+                    reporter.report()
 
     except KeyboardInterrupt:
         log("info", "Real-time inference stopped by user.")
     except Exception as e:
         log("error", str(e))
+    finally:
+        stop.set()
+        worker.join(timeout=1.0)
+        reporter.close()
+
+
+def iter_file_blocks(path: str, sample_rate: int, block_size: int, tail_seconds: float):
+    """Yield mono float32 blocks of `block_size` samples from a WAV/FLAC file.
+
+    Files already at `sample_rate` are streamed from disk into one reused
+    buffer; anything else is decoded and resampled up front with sphn. The
+    last block is zero-padded, followed by `tail_seconds` of silence so the
+    model can finish translating the final sentence.
+    """
+    import soundfile as sf
+
+    block = np.zeros(block_size, dtype=np.float32)
+    info = sf.info(path)
+    if info.samplerate == sample_rate:
+        frames = np.zeros((block_size, info.channels), dtype=np.float32)
+        with sf.SoundFile(path) as f:
+            while True:
+                n = len(f.read(block_size, dtype='float32', always_2d=True, out=frames))
+                if n == 0:
+                    break
+                if info.channels == 1:
+                    block[:n] = frames[:n, 0]
+                else:
+                    np.mean(frames[:n], axis=1, out=block[:n])
+                block[n:] = 0
+                yield block
+    else:
+        import sphn
+        log("info", f"resampling {path} from {info.samplerate} Hz to {sample_rate} Hz")
+        pcm, _ = sphn.read(path, sample_rate=sample_rate)
+        pcm = pcm.mean(axis=0) if pcm.ndim > 1 else pcm
+        for start in range(0, len(pcm), block_size):
+            chunk = pcm[start:start + block_size]
+            block[:len(chunk)] = chunk
+            block[len(chunk):] = 0
+            yield block
+
+    block[:] = 0
+    for _ in range(int(tail_seconds * sample_rate) // block_size):
+        yield block
+
+
+def run_offline(args, translator: Translator, sample_rate: int, block_size: int):
+    """Translate a recorded file as fast as the hardware allows (no wall-clock pacing)."""
+    import soundfile as sf
+
+    output_text = args.output_text
+    if output_text is None:
+        base = args.output_file if args.output_file else args.input_file
+        output_text = os.path.splitext(base)[0] + ".en.txt"
+
+    log("info", f"translating {args.input_file} -> text {output_text}"
+        + (f", audio {args.output_file}" if args.output_file else ""))
+    audio_out = None
+    if args.output_file:
+        audio_out = sf.SoundFile(args.output_file, "w", samplerate=sample_rate, channels=1)
+
+    stats = PipelineStats(sample_rate, block_size)
+    reporter = MetricsReporter(args, stats)
+    start = time.perf_counter()
+    try:
+        with open(output_text, "w", encoding="utf-8") as text_out:
+            for block in iter_file_blocks(args.input_file, sample_rate, block_size, args.tail_seconds):
+                text_piece, out_pcm = translator.step(block, stats)
+                if text_piece is not None:
+                    text_out.write(text_piece)
+                    text_out.flush()
+                    print(text_piece, end="", flush=True)
+                if audio_out is not None and out_pcm is not None:
+                    audio_out.write(out_pcm)
+                if reporter.due():
+                    print()
+                    reporter.report()
+    finally:
+        if audio_out is not None:
+            audio_out.close()
+        print()
+        reporter.close()
+
+    elapsed = time.perf_counter() - start
+    audio_seconds = stats.steps * block_size / sample_rate
+    log("info", f"processed {audio_seconds:.1f}s of audio in {elapsed:.1f}s: "
+        f"RTF {elapsed / max(audio_seconds, 1e-9):.3f} ({audio_seconds / max(elapsed, 1e-9):.2f}x real time)")
+
+
+def add_model_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--tokenizer", type=str, help="Path to the text tokenizer file")
+    parser.add_argument("--moshi-weights", type=str, help="Path to a local checkpoint file for Moshi.")
+    parser.add_argument("--mimi-weights", type=str, help="Path to a local checkpoint file for Mimi.")
+    parser.add_argument("--hf-repo", type=str, default="kyutai/hibiki-1b-mlx-bf16", help="HuggingFace repo name")
+    parser.add_argument("--lm-config", type=str, help="The LM config as a json file.")
+    parser.add_argument("--artifact-dir", type=str, default=os.path.expanduser("~/.cache/fr2en"),
+                        help="Where the artifact manifest and compiled models are kept")
+    parser.add_argument("--compile", action="store_true",
+                        help="Save the bf16-cast (and quantized) model to --artifact-dir for fast startup, then exit")
+    parser.add_argument("--quantize", type=int, choices=[4, 8], default=None,
+                        help="With --compile: quantize unquantized weights to this many bits")
+    parser.add_argument("--no-compiled", action="store_true", help="Ignore any compiled model and load the source weights")
+    parser.add_argument("--cfg-coef", type=float, default=1.0, help="CFG coefficient")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Real-time French-to-English translation using microphone input (or a recorded file)"
+    )
+    add_model_args(parser)
+    parser.add_argument("--device", type=str, default=None, help="Audio device for playback (optional)")
+    parser.add_argument("--input-device", type=str, default=None, help="Audio input device (microphone)")
+    parser.add_argument("--queue-blocks", type=int, default=16, help="Capacity of the input/output rings, in 80ms blocks")
+    parser.add_argument("--max-latency-blocks", type=int, default=4,
+                        help="Drop the oldest input once more than this many blocks are waiting for inference")
+    parser.add_argument("--jitter-blocks", type=int, default=2,
+                        help="Initial playback jitter-buffer depth, in 80ms blocks")
+    parser.add_argument("--min-jitter-blocks", type=int, default=1, help="Lowest depth the adaptive jitter buffer may shrink to")
+    parser.add_argument("--max-jitter-blocks", type=int, default=8, help="Highest depth the adaptive jitter buffer may grow to")
+    parser.add_argument("--input-file", type=str, default=None,
+                        help="Translate a WAV/FLAC file instead of the microphone, as fast as possible")
+    parser.add_argument("--output-file", type=str, default=None, help="Write the synthesized English audio to this file")
+    parser.add_argument("--output-text", type=str, default=None,
+                        help="Write the translated text here (defaults to <output or input>.en.txt)")
+    parser.add_argument("--tail-seconds", type=float, default=2.0,
+                        help="Silence fed after the end of --input-file so the last sentence gets translated")
+    parser.add_argument("--stats-interval", type=float, default=5.0, help="Seconds between pipeline stat lines (0 to disable)")
+    parser.add_argument("--metrics-jsonl", type=str, default=None,
+                        help="Append a JSON snapshot of counters and stage percentiles here every --stats-interval")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus-style metrics on http://127.0.0.1:<port>/metrics")
+    args = parser.parse_args()
+
+    sample_rate = SAMPLE_RATE
+    block_size = BLOCK_SIZE
+
+    if args.compile:
+        compile_model(args)
+        return
+
+    translator = load_translator(args)
+    if args.input_file:
+        run_offline(args, translator, sample_rate, block_size)
+    else:
+        run_realtime(args, translator, sample_rate, block_size)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Multi-stream French-to-English translation server.
+
+Clients stream 24 kHz mono float32 PCM over a local TCP port or Unix socket.
+Every 80 ms tick, all active sessions are pushed through LmGen together in
+fixed-size batches, so several speakers share a single model and one step per
+tick instead of one process each; a new session takes a free row of a running
+batch. Each session keeps its own Mimi encoder/decoder state; new sessions
+are refused once the tick no longer fits the budget.
+
+    python fr2en_server.py serve --port 8765
+    python fr2en_server.py replay --port 8765 speaker1.wav speaker2.wav
+
+Wire protocol: after connecting, the server sends one frame, either READY or
+ERROR. The client then writes raw float32 little-endian samples and
+half-closes its side when done. Server frames are a 1-byte type followed by
+a 4-byte big-endian payload length:
+
+    b"r" ready, b"e" error (utf-8 reason), b"t" text (utf-8), b"a" audio (float32 PCM)
+"""
+
+import argparse
+import asyncio
+import inspect
+import os
+import struct
+import threading
+import time
+import numpy as np
+
+import fr2en
+from fr2en import BLOCK_SIZE, SAMPLE_RATE, RingBuffer, RollingHistogram, StartupTimer, log
+
+FRAME_HEADER = struct.Struct("!cI")
+READY, ERROR, TEXT, AUDIO = b"r", b"e", b"t", b"a"
+BLOCK_BYTES = BLOCK_SIZE * 4
+TICK_SECONDS = BLOCK_SIZE / SAMPLE_RATE
+
+
+def frame(kind: bytes, payload: bytes = b"") -> bytes:
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    header = await reader.readexactly(FRAME_HEADER.size)
+    kind, length = FRAME_HEADER.unpack(header)
+    return kind, await reader.readexactly(length)
+
+
+class Session:
+    """One client: its input ring, its own Mimi tokenizer and a queue of frames to send back."""
+
+    def __init__(self, session_id: int, audio_tokenizer, loop, queue_blocks: int):
+        self.id = session_id
+        self.audio_tokenizer = audio_tokenizer
+        self.loop = loop
+        self.in_ring = RingBuffer(BLOCK_SIZE * queue_blocks)
+        self.outbox = asyncio.Queue()
+        self.steps = 0
+        self.underruns = 0            # ticks where the client had not sent a full block yet
+        self.closed = False           # set by the tick thread when it drops the session
+
+    def send(self, kind: bytes, payload: bytes):
+        """Called from the tick thread; hands the frame to the asyncio loop."""
+        self.loop.call_soon_threadsafe(self.outbox.put_nowait, frame(kind, payload))
+
+    def close(self, reason: str):
+        """Called from the tick thread: send ERROR and hang up once the outbox is flushed."""
+        self.closed = True
+        self.send(ERROR, reason.encode("utf-8"))
+        self.loop.call_soon_threadsafe(self.outbox.put_nowait, None)
+
+
+class BatchGroup:
+    """A fixed number of rows stepped together through one batched LmGen.
+
+    Rows without a session are fed Mimi's codes for silence and their output
+    is discarded. A new session takes a free row of a running group, which
+    has only ever heard silence, so sessions admitted in different ticks
+    still share a batch. LmGen cannot reset a single row, so the row of a
+    session that left is retired rather than handed to someone else. New
+    sessions are only placed while the group has max_steps left, so each one
+    gets a full session before the group's LmGen runs out. The transformer
+    KV cache is kept here and swapped into the shared model before each step.
+    """
+
+    def __init__(self, model, size: int, max_steps: int, cfg_coef: float):
+        self.sessions = [None] * size
+        self.retired = set()
+        self.steps = 0
+        self.join_steps = max_steps
+        self.cache = new_transformer_cache(model)
+        self.gen = fr2en.models.LmGen(
+            model=model,
+            max_steps=2 * max_steps,
+            text_sampler=fr2en.utils.Sampler(top_k=25),
+            audio_sampler=fr2en.utils.Sampler(top_k=250),
+            batch_size=size,
+            cfg_coef=cfg_coef,
+            check=False,
+        )
+        self.blocks = np.zeros((size, BLOCK_SIZE), dtype=np.float32)
+
+    def free_row(self):
+        if self.steps >= self.join_steps:
+            return None
+        for row, session in enumerate(self.sessions):
+            if session is None and row not in self.retired:
+                return row
+        return None
+
+    def alive(self) -> bool:
+        return any(session is not None for session in self.sessions)
+
+
+def check_batched_lmgen():
+    """Fail at startup, not at the first session, if the installed moshi_mlx cannot batch."""
+    if "batch_size" not in inspect.signature(fr2en.models.LmGen).parameters:
+        raise SystemExit("fr2en_server needs a moshi_mlx whose LmGen accepts batch_size=; upgrade moshi_mlx")
+
+
+def silence_codes(mimi_weights: str, generated_codebooks: int) -> np.ndarray:
+    """Mimi's codes for one block of silence, for the rows of a batch that have no session."""
+    tokenizer = fr2en.rustymimi.Tokenizer(mimi_weights, num_codebooks=generated_codebooks)
+    block = np.zeros((1, 1, BLOCK_SIZE), dtype=np.float32)
+    # The encoder is streaming; let it settle on steady silence first
+    for _ in range(8):
+        codes = tokenizer.encode_step(block)
+    return np.asarray(codes)[0, :generated_codebooks, 0]
+
+
+def new_transformer_cache(model):
+    make = getattr(model.transformer, "make_rot_cache", None) or model.transformer.make_cache
+    return make()
+
+
+class TranslationServer:
+    def __init__(self, args, model, text_tokenizer, mimi_weights, generated_codebooks, ct):
+        check_batched_lmgen()
+        self.args = args
+        self.model = model
+        self.text_tokenizer = text_tokenizer
+        self.mimi_weights = mimi_weights
+        self.generated_codebooks = generated_codebooks
+        self.ct = ct
+        self.max_steps = int(args.max_session_seconds / TICK_SECONDS) + 1
+        self.silence = silence_codes(mimi_weights, generated_codebooks)
+        self.lock = threading.Lock()  # guards pending/groups between the asyncio loop and the tick thread
+        self.pending = []
+        self.groups = []
+        self.admitting = 0  # admitted clients whose Mimi tokenizer is still loading
+        self.next_id = 0
+        self.ticks = RollingHistogram(256)
+        self.late_ticks = 0
+        self.rejected = 0
+        self.failed_groups = 0
+        self.stop = threading.Event()
+
+    # --- admission (asyncio side) ---
+
+    def active_sessions(self) -> int:
+        with self.lock:
+            return self.admitting + len(self.pending) + sum(
+                1 for group in self.groups for session in group.sessions if session is not None
+            )
+
+    def admission_error(self):
+        if self.active_sessions() >= self.args.max_sessions:
+            return f"server full ({self.args.max_sessions} sessions)"
+        window = self.ticks.window()
+        if len(window) >= 8:
+            p95 = float(np.percentile(window, 95))
+            if p95 > self.args.tick_budget * TICK_SECONDS:
+                return f"tick budget exceeded (p95 {p95 * 1000:.0f}ms)"
+        return None
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        error = self.admission_error()
+        if error is not None:
+            self.rejected += 1
+            log("warning", f"rejecting client: {error}")
+            writer.write(frame(ERROR, error.encode("utf-8")))
+            await writer.drain()
+            writer.close()
+            return
+
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            self.admitting += 1
+        # Loading a Mimi tokenizer takes a moment; keep it off the event loop.
+        try:
+            audio_tokenizer = await loop.run_in_executor(
+                None, lambda: fr2en.rustymimi.Tokenizer(self.mimi_weights, num_codebooks=self.generated_codebooks)
+            )
+        finally:
+            with self.lock:
+                self.admitting -= 1
+        with self.lock:
+            session = Session(self.next_id, audio_tokenizer, loop, self.args.queue_blocks)
+            self.next_id += 1
+            self.pending.append(session)
+        log("info", f"session {session.id} connected")
+        writer.write(frame(READY))
+
+        async def pump_outbox():
+            while True:
+                data = await session.outbox.get()
+                if data is None:
+                    if session.closed:
+                        # Dropped by the tick thread: hanging up ends the read loop below
+                        writer.close()
+                    return
+                writer.write(data)
+                await writer.drain()
+
+        sender = asyncio.create_task(pump_outbox())
+        carry = b""
+        try:
+            while not session.closed:
+                data = await reader.read(BLOCK_BYTES * 4)
+                if not data:
+                    break
+                data = carry + data
+                usable = len(data) - len(data) % 4
+                session.in_ring.write(np.frombuffer(data[:usable], dtype="<f4"))
+                carry = data[usable:]
+            # Let the model finish the last sentence before hanging up.
+            tail = np.zeros(BLOCK_SIZE, dtype=np.float32)
+            for _ in range(int(self.args.tail_seconds / TICK_SECONDS)):
+                while not session.closed and not session.in_ring.write(tail):
+                    await asyncio.sleep(TICK_SECONDS)
+            while not session.closed and session.in_ring.available() >= BLOCK_SIZE:
+                await asyncio.sleep(TICK_SECONDS)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.remove(session)
+            session.outbox.put_nowait(None)
+            await sender
+            writer.close()
+            log("info", f"session {session.id} done: {session.steps} steps, {session.underruns} underruns, "
+                f"{session.in_ring.overruns} overruns")
+
+    def remove(self, session: Session):
+        with self.lock:
+            if session in self.pending:
+                self.pending.remove(session)
+            for group in self.groups:
+                if session in group.sessions:
+                    group.retired.add(group.sessions.index(session))
+                    group.sessions = [None if s is session else s for s in group.sessions]
+
+    def drop(self, session: Session, reason: str):
+        """Tick thread: take a session out of its batch and hang up on it."""
+        self.remove(session)
+        session.close(reason)
+        log("warning", f"session {session.id} closed: {reason}")
+
+    # --- batched inference (tick thread) ---
+
+    def place_pending(self):
+        """Give each pending session a free row, starting a new group when none has one. Holds the lock."""
+        while self.pending:
+            session = self.pending[0]
+            for group in self.groups:
+                row = group.free_row()
+                if row is not None:
+                    break
+            else:
+                group = BatchGroup(self.model, self.args.batch_size, self.max_steps, self.args.cfg_coef)
+                self.groups.append(group)
+                row = 0
+            sessions = list(group.sessions)
+            sessions[row] = session
+            group.sessions = sessions
+            self.pending.pop(0)
+
+    def tick(self):
+        unplaced = []
+        with self.lock:
+            self.groups = [group for group in self.groups if group.alive()]
+            try:
+                self.place_pending()
+            except Exception as e:
+                log("error", f"could not start a batch: {e!r}")
+                unplaced, self.pending = self.pending, []
+            groups = list(self.groups)
+        for session in unplaced:
+            session.close("could not start a batch")
+
+        for group in groups:
+            try:
+                self.step_group(group)
+            except Exception as e:
+                # One bad batch must not take the tick thread, and every other session, down with it
+                self.failed_groups += 1
+                log("error", f"batch step failed: {e!r}")
+                for session in group.sessions:
+                    if session is not None:
+                        self.drop(session, f"translation failed: {e}")
+
+    def step_group(self, group: BatchGroup):
+        mx = fr2en.mx
+        for session in group.sessions:
+            if session is not None and session.steps >= self.max_steps:
+                self.drop(session, f"session length limit reached ({self.args.max_session_seconds:.0f}s)")
+        sessions = group.sessions  # the asyncio side may swap in a new list at any time
+        encoded = []
+        for row, session in enumerate(sessions):
+            if session is None:
+                encoded.append(None)
+                continue
+            block = group.blocks[row]
+            if not session.in_ring.read(block):
+                # The client is behind: feed silence rather than stall the whole batch.
+                block[:] = 0
+                session.underruns += 1
+            codes = session.audio_tokenizer.encode_step(block[None, None, :])
+            encoded.append(np.asarray(codes)[0, :self.generated_codebooks, 0])
+
+        if all(codes is None for codes in encoded):
+            return
+        # Free and retired rows still occupy the batch; they hear silence and their output is discarded.
+        batch = mx.array(np.stack([self.silence if codes is None else codes for codes in encoded]))
+
+        self.model.transformer_cache = group.cache
+        text_tokens = np.array(group.gen.step(batch, self.ct)).reshape(-1)
+        group.steps += 1
+        audio_tokens = group.gen.last_audio_tokens()
+        if audio_tokens is not None:
+            audio_tokens = np.array(audio_tokens[:, :, None]).astype(np.uint32)
+
+        for row, session in enumerate(sessions):
+            if session is None:
+                continue
+            session.steps += 1
+            text_piece = fr2en.text_piece_for(self.text_tokenizer, int(text_tokens[row]))
+            if text_piece is not None:
+                session.send(TEXT, text_piece.encode("utf-8"))
+            if audio_tokens is not None:
+                out_pcm = np.asarray(session.audio_tokenizer.decode_step(audio_tokens[row:row + 1]), dtype=np.float32)
+                session.send(AUDIO, out_pcm.reshape(-1, out_pcm.shape[-1])[0].astype("<f4").tobytes())
+
+    def run_ticks(self):
+        next_tick = time.perf_counter()
+        last_report = time.time()
+        while not self.stop.is_set():
+            started = time.perf_counter()
+            self.tick()
+            elapsed = time.perf_counter() - started
+            if self.groups:
+                self.ticks.add(elapsed)
+                if elapsed > TICK_SECONDS:
+                    self.late_ticks += 1
+            elif self.ticks.count:
+                # Nothing is running, so the old tick times no longer say anything about load;
+                # kept, an overload that ended with every session would refuse clients forever.
+                self.ticks.clear()
+
+            if self.args.stats_interval > 0 and time.time() - last_report >= self.args.stats_interval:
+                last_report = time.time()
+                log("info", self.summary())
+
+            next_tick += TICK_SECONDS
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Behind schedule: do not try to catch up with a burst of ticks.
+                next_tick = time.perf_counter()
+
+    def summary(self) -> str:
+        p = self.ticks.percentiles()
+        with self.lock:
+            sizes = [sum(1 for s in group.sessions if s is not None) for group in self.groups]
+        return (
+            f"sessions={sum(sizes)} groups={len(sizes)} batch_sizes={sizes} "
+            f"tick={p['p50'] * 1000:.0f}/{p['p95'] * 1000:.0f}/{p['p99'] * 1000:.0f}ms (p50/p95/p99) "
+            f"late_ticks={self.late_ticks} rejected={self.rejected} failed_groups={self.failed_groups}"
+        )
+
+
+async def serve(args):
+    timer = StartupTimer()
+    model, text_tokenizer, mimi_weights, generated_codebooks, ct = fr2en.load_model(args, timer)
+    log("info", timer.summary())
+    server = TranslationServer(args, model, text_tokenizer, mimi_weights, generated_codebooks, ct)
+
+    ticker = threading.Thread(target=server.run_ticks, daemon=True)
+    ticker.start()
+    if args.unix_socket:
+        listener = await asyncio.start_unix_server(server.handle_client, path=args.unix_socket)
+        log("info", f"listening on {args.unix_socket}")
+    else:
+        listener = await asyncio.start_server(server.handle_client, host="127.0.0.1", port=args.port)
+        log("info", f"listening on 127.0.0.1:{args.port}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.stop.set()
+        log("info", server.summary())
+
+
+async def replay_file(args, path: str):
+    """Stream one WAV file to the server at real time and save what comes back."""
+    import soundfile as sf
+
+    pcm, sr = sf.read(path, dtype="float32", always_2d=True)
+    if sr != SAMPLE_RATE:
+        raise ValueError(f"{path}: expected {SAMPLE_RATE} Hz audio, got {sr} Hz")
+    pcm = pcm.mean(axis=1).astype("<f4")
+
+    if args.unix_socket:
+        reader, writer = await asyncio.open_unix_connection(args.unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection("127.0.0.1", args.port)
+    kind, payload = await read_frame(reader)
+    if kind != READY:
+        log("warning", f"{path}: refused: {payload.decode('utf-8')}")
+        writer.close()
+        return
+
+    async def send():
+        next_send = time.perf_counter()
+        for start in range(0, len(pcm), BLOCK_SIZE):
+            writer.write(pcm[start:start + BLOCK_SIZE].tobytes())
+            await writer.drain()
+            next_send += TICK_SECONDS
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+        writer.write_eof()
+
+    stem = os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0])
+    first_audio = None
+    started = time.perf_counter()
+    sender = asyncio.create_task(send())
+    with open(stem + ".en.txt", "w", encoding="utf-8") as text_out, \
+            sf.SoundFile(stem + ".en.wav", "w", samplerate=SAMPLE_RATE, channels=1) as audio_out:
+        try:
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind == TEXT:
+                    text_out.write(payload.decode("utf-8"))
+                elif kind == AUDIO:
+                    if first_audio is None:
+                        first_audio = time.perf_counter() - started
+                    audio_out.write(np.frombuffer(payload, dtype="<f4"))
+        except asyncio.IncompleteReadError:
+            pass
+    await sender
+    writer.close()
+    first_audio_text = f"{first_audio:.2f}s" if first_audio is not None else "n/a"
+    log("info", f"{path}: done in {time.perf_counter() - started:.1f}s for {len(pcm) / SAMPLE_RATE:.1f}s of audio, "
+        f"first audio after {first_audio_text} -> {stem}.en.txt / .en.wav")
+
+
+async def replay(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    await asyncio.gather(*(replay_file(args, path) for path in args.files))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-stream French-to-English translation server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run the translation server")
+    fr2en.add_model_args(serve_parser)
+    serve_parser.add_argument("--max-sessions", type=int, default=8, help="Hard cap on concurrent sessions")
+    serve_parser.add_argument("--tick-budget", type=float, default=0.8,
+                              help="Refuse new sessions once p95 tick time exceeds this fraction of 80ms")
+    serve_parser.add_argument("--max-session-seconds", type=float, default=3600.0,
+                              help="Longest session; longer ones are closed with an ERROR frame")
+    serve_parser.add_argument("--batch-size", type=int, default=4,
+                              help="Rows per batched LmGen; unused rows still cost compute")
+    serve_parser.add_argument("--queue-blocks", type=int, default=16, help="Per-session input ring capacity, in 80ms blocks")
+    serve_parser.add_argument("--tail-seconds", type=float, default=2.0,
+                              help="Silence appended after a client finishes so its last sentence gets translated")
+    serve_parser.add_argument("--stats-interval", type=float, default=5.0, help="Seconds between stat lines (0 to disable)")
+
+    replay_parser = subparsers.add_parser("replay", help="Test client: stream WAV files to the server at real time")
+    replay_parser.add_argument("files", nargs="+", help="24 kHz WAV/FLAC files, one session each")
+    replay_parser.add_argument("--output-dir", type=str, default=".", help="Where <name>.en.txt/.en.wav are written")
+
+    for sub in (serve_parser, replay_parser):
+        sub.add_argument("--port", type=int, default=8765, help="TCP port on 127.0.0.1")
+        sub.add_argument("--unix-socket", type=str, default=None, help="Use this Unix socket path instead of TCP")
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args) if args.command == "serve" else replay(args))
+    except KeyboardInterrupt:
+        log("info", "stopped by user.")
+
+
+if __name__ == "__main__":
+    main()